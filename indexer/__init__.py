@@ -0,0 +1,9 @@
+"""
+An event-sourced index of the Nest and bUSDL state, so that analytics queries are local reads
+instead of contract invocations.
+"""
+from indexer.indexer import Indexer
+
+__all__ = [
+    'Indexer',
+]
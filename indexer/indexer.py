@@ -0,0 +1,170 @@
+"""
+An incremental index of the balances, loan principals and collateral of the Nest and bUSDL, kept in SQLite.
+
+Notifications are applied block by block, in the order they were emitted. Each block is applied in a
+single transaction together with the checkpoint, so an interrupted indexer resumes from the block after
+the last one it committed, and a block is never applied twice.
+
+Loans are indexed by their principal rather than their debt: bUSDL only notifies the USDL lent and repaid,
+while its loans grow with the interest multiplier, which isn't notified. So the principal of a loan is the
+USDL lent minus the USDL repaid, clipped to zero, and it falls behind loanedBalanceOf as the interest accrues,
+by the accrued interest less any repaid interest.
+"""
+import sqlite3
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoint (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    block_index INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS balance (
+    contract BLOB NOT NULL,
+    account BLOB NOT NULL,
+    quantity INTEGER NOT NULL,
+    PRIMARY KEY (contract, account)
+);
+CREATE TABLE IF NOT EXISTS principal (
+    account BLOB PRIMARY KEY,
+    quantity INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS collateral (
+    account BLOB NOT NULL,
+    symbol TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    PRIMARY KEY (account, symbol)
+);
+"""
+
+
+class Indexer:
+
+    def __init__(self, path: str, busdl_script_hash: bytes, nest_script_hash: bytes):
+        """
+        :param path: the SQLite database, which is created if it doesn't exist, or ':memory:'
+        """
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+        self.busdl_script_hash = bytes(busdl_script_hash)
+        self.nest_script_hash = bytes(nest_script_hash)
+
+    def close(self):
+        self.connection.close()
+
+    @property
+    def checkpoint(self) -> int:
+        """
+        :return: the index of the last applied block, or -1 if none was applied
+        """
+        row = self.connection.execute('SELECT block_index FROM checkpoint WHERE id = 0').fetchone()
+        return row[0] if row is not None else -1
+
+    def apply_block(self, block_index: int, notifications: Sequence) -> bool:
+        """
+        Applies the notifications of a block, which have an origin, a name and arguments, such as those of the TestEngine
+        :return: whether the block was applied, i.e. it is after the checkpoint
+        """
+        if block_index <= self.checkpoint:
+            return False
+        with self.connection:
+            for notification in notifications:
+                self.apply_notification(bytes(notification.origin), notification.name, list(notification.arguments))
+            self.connection.execute('INSERT OR REPLACE INTO checkpoint (id, block_index) VALUES (0, ?)', (block_index,))
+        return True
+
+    def apply_blocks(self, blocks: Iterable[Tuple[int, Sequence]]) -> int:
+        """
+        :param blocks: the block index and notifications of each block, in order
+        :return: the number of blocks applied
+        """
+        return sum(self.apply_block(block_index, notifications) for block_index, notifications in blocks)
+
+    def apply_notification(self, origin: bytes, name: str, arguments: list) -> bool:
+        """
+        :return: whether the notification changed the index
+        """
+        if name == 'Transfer':
+            from_address, to_address, amount = arguments
+            # bUSDL notifies both mints and burns as transfers from None, so they are applied from Deposit and Redeem instead
+            if origin == self.busdl_script_hash and not from_address:
+                return False
+            if from_address:
+                self.update_balance(origin, from_address, -amount)
+            if to_address:
+                self.update_balance(origin, to_address, amount)
+        elif origin == self.busdl_script_hash and name in ('Deposit', 'Redeem'):
+            # bUSDL mints and burns the b_asset_quantity from its own balance
+            account, underlying_quantity, b_asset_quantity = arguments
+            self.update_balance(origin, origin, b_asset_quantity if name == 'Deposit' else -b_asset_quantity)
+        elif origin == self.busdl_script_hash and name == 'Loan':
+            account, loan_quantity = arguments
+            self.update_principal(account, loan_quantity)
+        elif origin == self.busdl_script_hash and name == 'Repayment':
+            # Overpayments are refunded, so the repayment is clipped to the principal
+            account, repayment_quantity = arguments
+            self.update_principal(account, -min(repayment_quantity, self.principal_of(account)))
+        elif origin == self.nest_script_hash and name == 'CollateralDeposit':
+            account, symbol, quantity = arguments
+            self.update_collateral(account, symbol, quantity)
+        elif origin == self.nest_script_hash and name == 'CollateralWithdraw':
+            account, symbol, quantity = arguments
+            self.update_collateral(account, symbol, -quantity)
+        elif origin == self.nest_script_hash and name == 'Liquidate':
+            liquidator, account, symbol, usdl_quantity, collateral_quantity = arguments
+            self.update_collateral(account, symbol, -collateral_quantity)
+        else:
+            return False
+        return True
+
+    def update_row(self, table: str, key: dict, diff: int):
+        """
+        Adds diff to the quantity of a row, where rows with a zero quantity are deleted, as the contracts do
+        """
+        condition = ' AND '.join('{0} = ?'.format(column) for column in key)
+        row = self.connection.execute('SELECT quantity FROM {0} WHERE {1}'.format(table, condition), tuple(key.values())).fetchone()
+        quantity = (row[0] if row is not None else 0) + diff
+        if quantity == 0:
+            self.connection.execute('DELETE FROM {0} WHERE {1}'.format(table, condition), tuple(key.values()))
+        else:
+            columns = ', '.join(list(key) + ['quantity'])
+            self.connection.execute('INSERT OR REPLACE INTO {0} ({1}) VALUES ({2})'.format(table, columns, ', '.join('?' * (len(key) + 1))),
+                                    tuple(key.values()) + (quantity,))
+
+    def update_balance(self, contract: bytes, account: bytes, diff: int):
+        self.update_row('balance', {'contract': bytes(contract), 'account': bytes(account)}, diff)
+
+    def update_principal(self, account: bytes, diff: int):
+        self.update_row('principal', {'account': bytes(account)}, diff)
+
+    def update_collateral(self, account: bytes, symbol: str, diff: int):
+        self.update_row('collateral', {'account': bytes(account), 'symbol': symbol}, diff)
+
+    def balance_of(self, contract: bytes, account: bytes) -> int:
+        row = self.connection.execute('SELECT quantity FROM balance WHERE contract = ? AND account = ?',
+                                      (bytes(contract), bytes(account))).fetchone()
+        return row[0] if row is not None else 0
+
+    def get_balances(self, contract: bytes, offset: int = 0, limit: Optional[int] = None) -> List[Tuple[bytes, int]]:
+        """
+        :return: the non-zero balances of a token, in the order of the accounts as in bUSDL getBalances
+        """
+        return self.connection.execute('SELECT account, quantity FROM balance WHERE contract = ? ORDER BY account LIMIT ? OFFSET ?',
+                                       (bytes(contract), -1 if limit is None else limit, offset)).fetchall()
+
+    def principal_of(self, account: bytes) -> int:
+        """
+        :return: the USDL lent to an account minus the USDL it repaid, which excludes the accrued interest,
+            unlike the debt given by loanedBalanceOf
+        """
+        row = self.connection.execute('SELECT quantity FROM principal WHERE account = ?', (bytes(account),)).fetchone()
+        return row[0] if row is not None else 0
+
+    def collateral_of(self, account: bytes) -> Dict[str, int]:
+        """
+        :return: the quantity of each collateral of an account, keyed by symbol
+        """
+        return dict(self.connection.execute('SELECT symbol, quantity FROM collateral WHERE account = ?', (bytes(account),)).fetchall())
+
+    def total_collateral(self, symbol: str) -> int:
+        row = self.connection.execute('SELECT SUM(quantity) FROM collateral WHERE symbol = ?', (symbol,)).fetchone()
+        return row[0] if row[0] is not None else 0
@@ -0,0 +1,26 @@
+"""
+A reference liquidation keeper for the Nest.
+
+It indexes the positions from the notifications of the Nest and bUSDL, recomputes their health
+on every price update, and liquidates the eligible accounts with ACTION_LIQUIDATE transfers.
+"""
+from keeper.keeper import ACTION_LIQUIDATE, MAX_BATCH_ACCOUNTS, MAX_LIQUIDATE_PAIRS, Keeper, liquidate_data
+from keeper.positions import Collateral, Position, PositionIndex
+from keeper.price_server import PriceServer
+from keeper.prices import PRICE_URL, fetch_prices, parse_prices, read_prices
+
+__all__ = [
+    'ACTION_LIQUIDATE',
+    'MAX_BATCH_ACCOUNTS',
+    'MAX_LIQUIDATE_PAIRS',
+    'PRICE_URL',
+    'Collateral',
+    'Keeper',
+    'Position',
+    'PositionIndex',
+    'PriceServer',
+    'fetch_prices',
+    'liquidate_data',
+    'parse_prices',
+    'read_prices',
+]
@@ -0,0 +1,127 @@
+"""
+The liquidation loop of the keeper.
+
+Each step applies the new notifications to the position index, refreshes the loans with their accrued interest,
+fetches the price feed,
+and submits a single ACTION_LIQUIDATE transfer for every eligible account, which the Nest
+liquidates against one Oracle response.
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence
+
+from keeper.positions import PositionIndex
+from keeper.prices import PRICE_URL, fetch_prices
+
+ACTION_LIQUIDATE = 'ACTION_LIQUIDATE'
+# Matches MAX_LIQUIDATE_PAIRS in BowerbirdNest
+MAX_LIQUIDATE_PAIRS = 32
+# Matches MAX_BATCH_ACCOUNTS in BoweredUSDLToken, the most accounts read by a single loanedBalanceOfBatch
+MAX_BATCH_ACCOUNTS = 512
+
+logger = logging.getLogger(__name__)
+
+
+def liquidate_data(targets: List[list]) -> list:
+    """
+    :return: the data of the USDL transfer to the Nest which liquidates the targets
+    """
+    return [ACTION_LIQUIDATE, targets]
+
+
+class Keeper:
+
+    def __init__(self,
+                 index: PositionIndex,
+                 submit: Callable[[List[list], int], Awaitable[None]],
+                 poll_events: Optional[Callable[[], Awaitable[Sequence]]] = None,
+                 get_prices: Optional[Callable[[], Awaitable[Dict[str, int]]]] = None,
+                 read_debts: Optional[Callable[[List[bytes]], Awaitable[List[int]]]] = None,
+                 usdl_budget: Optional[int] = None,
+                 max_pairs: int = MAX_LIQUIDATE_PAIRS,
+                 pending_steps: int = 4,
+                 interval: float = 15.0):
+        """
+        :param submit: sends the USDL transfer to the Nest with liquidate_data(targets), given the targets and the USDL quantity
+        :param poll_events: returns the notifications of the Nest and bUSDL since the previous call, in the order they were emitted
+        :param get_prices: returns the price feed, which is read from PRICE_URL by default
+        :param read_debts: returns the loans of at most MAX_BATCH_ACCOUNTS accounts, e.g. with loanedBalanceOfBatch,
+            since the notifications don't include the interest accrued since the last loan or repayment
+        :param usdl_budget: the most USDL to send with a single transfer, or None to send whatever the targets need
+        :param max_pairs: the most collateral tokens, summed over the accounts, to liquidate with a single transfer
+        :param pending_steps: the number of steps during which a submitted account is not submitted again,
+            unless its Liquidate or LiquidateFailure notification arrives first
+        """
+        self.index = index
+        self.submit = submit
+        self.poll_events = poll_events
+        self.get_prices = get_prices if get_prices is not None else (lambda: fetch_prices(PRICE_URL))
+        self.read_debts = read_debts
+        self.usdl_budget = usdl_budget
+        self.max_pairs = max_pairs
+        self.pending_steps = pending_steps
+        self.interval = interval
+        # The accounts waiting on the Oracle response of a submitted liquidation, and the steps left until they are retried
+        self.pending: Dict[bytes, int] = {}
+
+    def apply_events(self, notifications: Sequence):
+        for notification in notifications:
+            arguments = list(notification.arguments)
+            if notification.name in ('Liquidate', 'LiquidateFailure'):
+                self.pending.pop(bytes(arguments[1]), None)
+            self.index.apply_event(notification.name, arguments)
+
+    async def liquidate(self, price_map: Dict[str, int]) -> List[list]:
+        """
+        Submits the eligible accounts at the given prices
+        :return: the submitted targets
+        """
+        for account in list(self.pending):
+            self.pending[account] -= 1
+            if self.pending[account] <= 0:
+                del self.pending[account]
+
+        targets = self.index.get_targets(price_map, self.max_pairs, self.pending)
+        usdl_quantity = sum(self.index.liquidation_quantity(target[0], price_map) for target in targets)
+        if self.usdl_budget is not None:
+            usdl_quantity = min(usdl_quantity, self.usdl_budget)
+        if len(targets) == 0 or usdl_quantity <= 0:
+            return []
+
+        logger.info('liquidating %d accounts with %d USDL', len(targets), usdl_quantity)
+        await self.submit(targets, usdl_quantity)
+        for target in targets:
+            self.pending[bytes(target[0])] = self.pending_steps
+        return targets
+
+    async def refresh_debts(self):
+        """
+        Sets the loan of every indexed account to its current loan, including the accrued interest
+        """
+        accounts = list(self.index.positions)
+        for start in range(0, len(accounts), MAX_BATCH_ACCOUNTS):
+            batch = accounts[start:start + MAX_BATCH_ACCOUNTS]
+            for account, debt in zip(batch, await self.read_debts(batch)):
+                self.index.set_debt(account, debt)
+
+    async def step(self) -> List[list]:
+        if self.poll_events is not None:
+            self.apply_events(await self.poll_events())
+        if self.read_debts is not None:
+            await self.refresh_debts()
+        price_map = await self.get_prices()
+        return await self.liquidate(price_map)
+
+    async def run(self, stop: asyncio.Event):
+        """
+        Runs a step every interval seconds until stop is set
+        """
+        while not stop.is_set():
+            try:
+                await self.step()
+            except Exception:
+                logger.exception('keeper step failed')
+            try:
+                await asyncio.wait_for(stop.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,161 @@
+"""
+An in-memory index of the Nest positions, rebuilt from the notifications of the Nest and bUSDL.
+
+The health of a position uses the same integer arithmetic as computeCollateralLTV and applyLiquidate,
+so that the keeper only submits liquidations which the Nest would accept at the same prices.
+"""
+from dataclasses import dataclass, field
+from typing import Collection, Dict, List, Sequence
+
+BASIS_POINTS = 10000
+USDL = 'USDL'
+
+
+@dataclass
+class Collateral:
+    """
+    The parameters of a collateral, as returned by getCollateralParameters
+    """
+    token: bytes
+    loan_to_value: int
+    max_liquidation_ratio: int
+
+
+@dataclass
+class Position:
+    # The quantity of each collateral, keyed by symbol
+    collateral: Dict[str, int] = field(default_factory=dict)
+    # The USDL loan, which does not include the interest accrued since the last set_debt
+    debt: int = 0
+
+
+class PositionIndex:
+
+    def __init__(self, collaterals: Dict[str, Collateral]):
+        """
+        :param collaterals: the parameters of every supported collateral, keyed by symbol
+        """
+        self.collaterals = collaterals
+        self.positions: Dict[bytes, Position] = {}
+
+    def get_position(self, account: bytes) -> Position:
+        account = bytes(account)
+        if account not in self.positions:
+            self.positions[account] = Position()
+        return self.positions[account]
+
+    def find_position(self, account: bytes) -> Position:
+        """
+        :return: the position of the account, or an empty position if it has none, without adding it to the index
+        """
+        return self.positions.get(bytes(account), Position())
+
+    def update_collateral(self, account: bytes, symbol: str, diff: int):
+        position = self.get_position(account)
+        quantity = position.collateral.get(symbol, 0) + diff
+        if quantity > 0:
+            position.collateral[symbol] = quantity
+        else:
+            position.collateral.pop(symbol, None)
+        self.prune(account)
+
+    def update_debt(self, account: bytes, diff: int):
+        position = self.get_position(account)
+        position.debt = max(position.debt + diff, 0)
+        self.prune(account)
+
+    def set_debt(self, account: bytes, debt: int):
+        """
+        Sets the loan of an account, e.g. from loanedBalanceOfBatch, to account for the accrued interest
+        """
+        self.update_debt(account, debt - self.get_position(account).debt)
+
+    def prune(self, account: bytes):
+        position = self.positions[bytes(account)]
+        if len(position.collateral) == 0 and position.debt == 0:
+            del self.positions[bytes(account)]
+
+    def apply_event(self, name: str, arguments: Sequence) -> bool:
+        """
+        Applies a notification of the Nest or bUSDL, in the order they were emitted
+        :return: whether the notification changed the index
+        """
+        if name == 'CollateralDeposit':
+            account, symbol, quantity = arguments
+            self.update_collateral(account, symbol, quantity)
+        elif name == 'CollateralWithdraw':
+            account, symbol, quantity = arguments
+            self.update_collateral(account, symbol, -quantity)
+        elif name == 'Liquidate':
+            # The repayment is notified by bUSDL separately
+            liquidator, account, symbol, usdl_quantity, collateral_quantity = arguments
+            self.update_collateral(account, symbol, -collateral_quantity)
+        elif name == 'Loan' and len(arguments) == 3:
+            # bUSDL notifies the same loan as [ account, quantity ], which is skipped so that it isn't counted twice
+            account, symbol, quantity = arguments
+            self.update_debt(account, quantity)
+        elif name == 'Repayment':
+            account, quantity = arguments
+            self.update_debt(account, -quantity)
+        else:
+            return False
+        return True
+
+    def apply_events(self, notifications: Sequence) -> int:
+        """
+        Applies notifications which have a name and arguments, such as those of the TestEngine
+        :return: the number of notifications which changed the index
+        """
+        return sum(self.apply_event(notification.name, list(notification.arguments)) for notification in notifications)
+
+    def collateral_ltv(self, account: bytes, price_map: Dict[str, int]) -> int:
+        """
+        Mirrors computeCollateralLTV
+        """
+        collateral_value = 0
+        for symbol, quantity in self.find_position(account).collateral.items():
+            weighted_quantity = quantity * self.collaterals[symbol].loan_to_value
+            collateral_value += (weighted_quantity * price_map[symbol]) // BASIS_POINTS
+        return collateral_value
+
+    def is_eligible(self, account: bytes, price_map: Dict[str, int]) -> bool:
+        """
+        Mirrors the eligibility check of applyLiquidate
+        """
+        position = self.find_position(account)
+        if position.debt == 0 or len(position.collateral) == 0:
+            return False
+        return self.collateral_ltv(account, price_map) <= price_map[USDL] * position.debt
+
+    def liquidation_quantity(self, account: bytes, price_map: Dict[str, int]) -> int:
+        """
+        :return: the USDL the Nest would take at most to liquidate every collateral of the account once,
+            which is clipped to the loan
+        """
+        position = self.find_position(account)
+        usdl_quantity = 0
+        for symbol, quantity in position.collateral.items():
+            max_liquidate_quantity = (quantity * self.collaterals[symbol].max_liquidation_ratio) // BASIS_POINTS
+            usdl_quantity += (max_liquidate_quantity * price_map[symbol]) // price_map[USDL]
+        return min(usdl_quantity, position.debt)
+
+    def get_targets(self, price_map: Dict[str, int], max_pairs: int, excluded: Collection[bytes] = ()) -> List[list]:
+        """
+        :param max_pairs: the most collateral tokens, summed over the targets, as capped by MAX_LIQUIDATE_PAIRS
+        :param excluded: the accounts which are skipped, such as those with a pending liquidation
+        :return: the ACTION_LIQUIDATE targets of the eligible accounts, largest loans first,
+            where the collateral of each account is ordered by value
+        """
+        accounts = [account for account in self.positions
+                    if account not in excluded and self.is_eligible(account, price_map)]
+        accounts.sort(key=lambda account: self.positions[account].debt, reverse=True)
+
+        targets = []
+        for account in accounts:
+            if max_pairs <= 0:
+                break
+            collateral = self.positions[account].collateral
+            symbols = sorted(collateral, key=lambda symbol: collateral[symbol] * price_map[symbol], reverse=True)[:max_pairs]
+            max_pairs -= len(symbols)
+            targets.append([account, [self.collaterals[symbol].token for symbol in symbols]])
+        return targets
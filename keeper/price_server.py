@@ -0,0 +1,71 @@
+"""
+A local stand-in for the price feed at PRICE_URL, for running the keeper against the TestEngine.
+
+The TestEngine does not reach the Oracle, so tests read the same body from the server
+and pass it to run_oracle_response, as the Oracle nodes would.
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+
+
+class PriceServer:
+
+    def __init__(self, prices: Dict[str, int], host: str = '127.0.0.1', port: int = 0):
+        """
+        :param port: the port to listen on, where 0 picks a free one
+        """
+        self.prices = dict(prices)
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/prices':
+                    self.send_error(404)
+                    return
+                body = server.body()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.http_server = ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.http_server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.http_server.server_address[:2]
+        return 'http://{0}:{1}/prices'.format(host, port)
+
+    def body(self) -> bytes:
+        """
+        :return: the price feed in the format of PRICE_URL
+        """
+        with self.lock:
+            return json.dumps(self.prices, separators=(',', ':')).encode()
+
+    def set_prices(self, prices: Dict[str, int]):
+        with self.lock:
+            self.prices.update(prices)
+
+    def start(self) -> 'PriceServer':
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.http_server.shutdown()
+        self.http_server.server_close()
+        self.thread.join()
+
+    def __enter__(self) -> 'PriceServer':
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,30 @@
+"""
+Reads the price feed which the Nest requests from the Oracle.
+"""
+import asyncio
+import json
+import urllib.request
+from typing import Dict
+
+# Matches PRICE_URL in BowerbirdNest
+PRICE_URL = 'https://bowerbird.finance/prices'
+
+
+def parse_prices(body: bytes) -> Dict[str, int]:
+    """
+    Parses a price feed, e.g. {"USDL":1000000,"bNEO":500000}, where prices are multiplied by PRICE_MULT
+    """
+    return {symbol: int(price) for symbol, price in json.loads(body).items()}
+
+
+def read_prices(url: str = PRICE_URL, timeout: float = 10.0) -> bytes:
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return response.read()
+
+
+async def fetch_prices(url: str = PRICE_URL, timeout: float = 10.0) -> Dict[str, int]:
+    """
+    Fetches the price feed without blocking the event loop
+    """
+    body = await asyncio.get_running_loop().run_in_executor(None, read_prices, url, timeout)
+    return parse_prices(body)
@@ -0,0 +1,249 @@
+"""
+A reference model of the Bowerbird economics, for evaluating parameters off-chain.
+
+Each function mirrors the integer arithmetic of a contract method, so that it gives
+the same results as the TestEngine, but over NumPy arrays of accounts and price paths.
+Pass arrays of dtype=object (see exact) to keep Python's arbitrary precision integers.
+The contracts' products overflow int64 at their usual scale, e.g. 1000 bNEO of 1e8 units
+weighted by a loan to value of 7500 at a price of 1e6 is already 7.5e20, and NumPy wraps
+around silently, so collateral_ltv and stress_liquidations raise OverflowError instead
+when given int64 arrays that could overflow.
+"""
+import numpy as np
+
+
+# -------------------------------------------
+# BoweredUSDLToken settings
+# -------------------------------------------
+
+EXCHANGE_RATE_MULT = 100_000_000
+INITIAL_EXCHANGE_RATE = EXCHANGE_RATE_MULT
+FLOAT_MULTIPLIER = 1_000_000_000_000_000_000
+INITIAL_INTEREST_MULTIPLIER = FLOAT_MULTIPLIER
+BASIS_POINTS = 10000
+BLOCKS_PER_YEAR = 4 * 60 * 24 * 365
+
+INITIAL_BASE_RATE = 10_000
+INITIAL_RATE_SLOPE_1 = 0
+INITIAL_RATE_SLOPE_2 = 0
+INITIAL_OPTIMAL_UTILIZATION = 8_000
+
+# -------------------------------------------
+# BowerbirdNest settings
+# -------------------------------------------
+
+PRICE_MULT = 1_000_000
+INITIAL_LOAN_TO_VALUE = 7500
+INITIAL_MAX_LIQUIDATION_RATIO = 5000
+INITIAL_LIQUIDATION_PENALTY = 500
+INITIAL_AUCTION_PENALTY_FLOOR = 5000
+
+
+INT64_MAX = np.iinfo(np.int64).max
+
+
+def exact(values) -> np.ndarray:
+    """
+    Converts the values to an array of Python integers
+    """
+    return np.vectorize(int, otypes=[object])(np.asarray(values))
+
+
+def promote_exact(*values) -> list:
+    """
+    Converts every value to an array of Python integers if any of them is one,
+    so that no intermediate product of a mixed computation falls back to int64
+    """
+    arrays = [np.asarray(value) for value in values]
+    if any(array.dtype == object for array in arrays):
+        return [exact(array) for array in arrays]
+    return arrays
+
+
+def check_int64(bound: int, *values):
+    """
+    Raises OverflowError if values are fixed width integers and bound, the largest product
+    the computation may reach, doesn't fit in int64
+    """
+    if all(np.asarray(value).dtype != object for value in values) and bound > INT64_MAX:
+        raise OverflowError('products of up to {0} overflow int64, pass arrays of Python integers with exact'.format(bound))
+
+
+def max_magnitude(*values) -> int:
+    """
+    :return: the largest absolute value over every value, as a Python integer
+    """
+    return max(int(np.max(np.abs(value))) if np.size(value) > 0 else 0 for value in values)
+
+
+# -------------------------------------------
+# BoweredUSDLToken
+# -------------------------------------------
+
+def accrue_interest(interest_multiplier, diff_height, annual_rate):
+    """
+    Mirrors accrueInterest
+    :return: the interest multiplier after diff_height blocks at annual_rate basis points
+    """
+    interest_accrued = (FLOAT_MULTIPLIER * diff_height * annual_rate) // (BLOCKS_PER_YEAR * BASIS_POINTS)
+    return ((FLOAT_MULTIPLIER + interest_accrued) * interest_multiplier) // FLOAT_MULTIPLIER
+
+
+def scaled_quantity(quantity, interest_multiplier):
+    """
+    Mirrors getScaledQuantity
+    """
+    return (quantity * interest_multiplier) // (FLOAT_MULTIPLIER * FLOAT_MULTIPLIER)
+
+
+def unscaled_quantity(quantity, interest_multiplier):
+    """
+    Mirrors getUnscaledQuantity
+    """
+    return (quantity * FLOAT_MULTIPLIER * FLOAT_MULTIPLIER) // interest_multiplier
+
+
+def utilization(underlying_supply, loaned_supply):
+    """
+    Mirrors computeUtilization, where loaned_supply is already scaled
+    """
+    usdl_total = underlying_supply + loaned_supply
+    return np.where(usdl_total == 0, 0, (loaned_supply * BASIS_POINTS) // np.where(usdl_total == 0, 1, usdl_total))
+
+
+def annual_rate(utilization,
+                base_rate=INITIAL_BASE_RATE,
+                rate_slope_1=INITIAL_RATE_SLOPE_1,
+                rate_slope_2=INITIAL_RATE_SLOPE_2,
+                optimal_utilization=INITIAL_OPTIMAL_UTILIZATION):
+    """
+    Mirrors updateInterestRate
+    """
+    below_kink = base_rate + (rate_slope_1 * np.minimum(utilization, optimal_utilization)) // optimal_utilization
+    excess_utilization = np.maximum(utilization - optimal_utilization, 0)
+    excess_range = max(BASIS_POINTS - optimal_utilization, 1)
+    above_kink = base_rate + rate_slope_1 + (rate_slope_2 * excess_utilization) // excess_range
+    return np.where(utilization <= optimal_utilization, below_kink, above_kink)
+
+
+def exchange_rate(busdl_supply, underlying_supply, loaned_supply):
+    """
+    Mirrors getExchangeRate, where loaned_supply is already scaled
+    """
+    rate = (EXCHANGE_RATE_MULT * (underlying_supply + loaned_supply)) // np.where(busdl_supply == 0, 1, busdl_supply)
+    return np.where(busdl_supply == 0, INITIAL_EXCHANGE_RATE, rate)
+
+
+# -------------------------------------------
+# BowerbirdNest
+# -------------------------------------------
+
+def collateral_ltv(collateral_quantity, loan_to_value, collateral_price):
+    """
+    Mirrors computeCollateralLTV
+    The last axis holds the collateral tokens of an account, and loan_to_value and collateral_price broadcast along it
+    """
+    collateral_quantity, loan_to_value, collateral_price = promote_exact(collateral_quantity, loan_to_value, collateral_price)
+    num_tokens = collateral_quantity.shape[-1] if collateral_quantity.ndim > 0 else 1
+    check_int64(max_magnitude(collateral_quantity) * max_magnitude(loan_to_value) * max_magnitude(collateral_price) * num_tokens,
+                collateral_quantity)
+    weighted_quantity = collateral_quantity * loan_to_value
+    return ((weighted_quantity * collateral_price) // BASIS_POINTS).sum(axis=-1)
+
+
+def liquidate(loan_quantity, collateral_quantity, account_collateral_ltv, usdl_quantity, usdl_price, collateral_price,
+              max_liquidation_ratio=INITIAL_MAX_LIQUIDATION_RATIO,
+              liquidation_penalty=INITIAL_LIQUIDATION_PENALTY):
+    """
+    Mirrors applyLiquidate, as called by liquidateCallback, for a single collateral token
+
+    An account is liquidated when its collateral loan to value does not exceed its loan value,
+    and the penalized collateral quantity is positive. The contract faults when that quantity
+    exceeds the collateral balance, so such liquidations are not applied either.
+
+    :return: a dict of arrays
+        liquidated: whether the liquidation was applied
+        usdl_quantity: the USDL used to repay the loan
+        collateral_quantity: the collateral paid out to the liquidator
+        refund_quantity: the USDL returned to the liquidator
+    """
+    loan_value = usdl_price * loan_quantity
+    eligible = account_collateral_ltv <= loan_value
+
+    # The USDL beyond the loan is refunded, so it doesn't buy any collateral
+    desired_liquidate_quantity = (np.minimum(usdl_quantity, loan_quantity) * usdl_price) // collateral_price
+    max_liquidate_quantity = (collateral_quantity * max_liquidation_ratio) // BASIS_POINTS
+    clipped_liquidate_quantity = np.minimum(desired_liquidate_quantity, max_liquidate_quantity)
+    total_liquidate_quantity = ((liquidation_penalty + BASIS_POINTS) * clipped_liquidate_quantity) // BASIS_POINTS
+    clipped_usdl_quantity = (clipped_liquidate_quantity * collateral_price) // usdl_price
+
+    liquidated = eligible & (total_liquidate_quantity > 0) & (total_liquidate_quantity <= collateral_quantity)
+    zero = usdl_quantity * 0
+    return {
+        'liquidated': liquidated,
+        'usdl_quantity': np.where(liquidated, clipped_usdl_quantity, zero),
+        'collateral_quantity': np.where(liquidated, total_liquidate_quantity, zero),
+        'refund_quantity': np.where(liquidated, usdl_quantity - clipped_usdl_quantity, usdl_quantity),
+    }
+
+
+def auction_penalty(liquidation_penalty, start_height, auction_duration, height,
+                    auction_penalty_floor=INITIAL_AUCTION_PENALTY_FLOOR):
+    """
+    Mirrors getAuctionPenalty, where height is the current block of each liquidation
+    """
+    penalty_floor = (liquidation_penalty * auction_penalty_floor) // BASIS_POINTS
+    remaining_blocks = np.maximum(start_height + auction_duration - height, 0)
+    return penalty_floor + ((liquidation_penalty - penalty_floor) * remaining_blocks) // auction_duration
+
+
+def stress_liquidations(collateral_quantity, loan_quantity, collateral_prices,
+                        usdl_price=PRICE_MULT,
+                        loan_to_value=INITIAL_LOAN_TO_VALUE,
+                        max_liquidation_ratio=INITIAL_MAX_LIQUIDATION_RATIO,
+                        liquidation_penalty=INITIAL_LIQUIDATION_PENALTY):
+    """
+    Runs accounts holding a single collateral through price paths, where at every step
+    a liquidator offers to repay the whole loan of every account
+
+    The arrays of Python integers this needs at the contracts' scale run at roughly 700k
+    account-steps per second on a single core, e.g. about 1.5 s for 100k paths of 10 steps,
+    and time grows linearly with paths * steps * accounts
+
+    :param collateral_quantity: the collateral of each account, of shape (accounts,)
+    :param loan_quantity: the USDL loan of each account, of shape (accounts,)
+    :param collateral_prices: the collateral price at each step of each path, of shape (paths, steps)
+    :return: a dict of arrays
+        collateral_quantity, loan_quantity: the positions at the end of each path, of shape (paths, accounts)
+        liquidations: the number of liquidations of each account, of shape (paths, accounts)
+        bad_debt: the loan value left uncovered by the collateral at the final price, of shape (paths,)
+    """
+    collateral_quantity, loan_quantity, collateral_prices = promote_exact(collateral_quantity, loan_quantity, collateral_prices)
+    # The largest products are quantity * loan_to_value * price and the bad debt summed over the accounts
+    check_int64(max_magnitude(collateral_quantity, loan_quantity) * max_magnitude(collateral_prices, usdl_price)
+                * max(loan_to_value, max_liquidation_ratio, BASIS_POINTS + liquidation_penalty, len(collateral_quantity)),
+                collateral_quantity)
+    num_paths = collateral_prices.shape[0]
+    collateral = np.repeat(collateral_quantity[np.newaxis, :], num_paths, axis=0)
+    loan = np.repeat(loan_quantity[np.newaxis, :], num_paths, axis=0)
+    liquidations = np.zeros(collateral.shape, dtype=np.int64)
+
+    for step in range(collateral_prices.shape[1]):
+        collateral_price = collateral_prices[:, step][:, np.newaxis]
+        account_collateral_ltv = (collateral * loan_to_value * collateral_price) // BASIS_POINTS
+        result = liquidate(loan, collateral, account_collateral_ltv, loan, usdl_price, collateral_price,
+                           max_liquidation_ratio, liquidation_penalty)
+        liquidated = result['liquidated'] & (loan > 0)
+        collateral = np.where(liquidated, collateral - result['collateral_quantity'], collateral)
+        # The repayment is clipped to the loaned balance
+        loan = np.where(liquidated, np.maximum(loan - result['usdl_quantity'], 0), loan)
+        liquidations += liquidated
+
+    final_price = collateral_prices[:, -1][:, np.newaxis]
+    shortfall = loan * usdl_price - collateral * final_price
+    return {
+        'collateral_quantity': collateral,
+        'loan_quantity': loan,
+        'liquidations': liquidations,
+        'bad_debt': np.maximum(shortfall, 0).sum(axis=-1),
+    }
@@ -1,4 +1,4 @@
-from typing import Any
+from typing import Any, Union
 
 from boa3.builtin import CreateNewEvent, NeoMetadata, metadata, public
 from boa3.builtin.contract import Nep17TransferEvent, abort
@@ -7,8 +7,8 @@ from boa3.builtin.interop.contract import call_contract, destroy_contract, updat
 from boa3.builtin.interop.json import json_deserialize
 from boa3.builtin.interop.oracle import Oracle
 from boa3.builtin.interop.runtime import calling_script_hash, check_witness, script_container, executing_script_hash
-from boa3.builtin.interop.stdlib import base64_decode, base64_encode, itoa
-from boa3.builtin.interop.storage import find, get, put, get_context, get_read_only_context
+from boa3.builtin.interop.stdlib import base64_decode, deserialize, itoa, serialize
+from boa3.builtin.interop.storage import delete, find, get, put, get_context, get_read_only_context
 from boa3.builtin.type import UInt160
 from typing import cast
 
@@ -29,6 +29,17 @@ def manifest_metadata() -> NeoMetadata:
     return meta
 
 
+# -------------------------------------------
+# STORAGE SETTINGS
+# -------------------------------------------
+
+# The maps keyed by token or account use a single byte prefix followed by the raw 20 byte script hash
+# The layout version is bumped whenever _deploy needs to migrate existing storage on update
+STORAGE_VERSION_KEY = 'sv'
+STORAGE_VERSION = 1
+# The length of a UInt160 key
+UINT160_LENGTH = 20
+
 # -------------------------------------------
 # ADDRESS SETTINGS
 # -------------------------------------------
@@ -36,7 +47,6 @@ def manifest_metadata() -> NeoMetadata:
 USDL_SCRIPT_HASH_KEY = 'usdl'
 BUSDL_SCRIPT_HASH_KEY = 'busdl'
 BNEO_SCRIPT_HASH_KEY = 'bneo'
-COLLATERAL_SCRIPT_HASH_KEY = 'col/'
 ORACLE_SCRIPT_HASH_KEY = 'oracle'
 ORACLE_SCRIPT_HASH = UInt160(b'X\x87\x17\x11~\n\xa8\x10r\xaf\xabq\xd2\xdd\x89\xfe|K\x92\xfe')
 
@@ -56,27 +66,102 @@ ORACLE_FEE_KEY = 'of'
 # Initial fee = 0.10 GAS
 INITIAL_ORACLE_FEE = 10_000_000
 
+# The last price feed received from the Oracle and the height at which it arrived
+PRICE_SNAPSHOT_KEY = 'ps'
+PRICE_HEIGHT_KEY = 'ph'
+# The number of blocks for which the last price feed may be reused instead of consulting the Oracle
+# 0 disables the price snapshot
+PRICE_FRESHNESS_KEY = 'pf'
+INITIAL_PRICE_FRESHNESS = 0
+# The number of blocks for which a liquidation auction stays open
+# 0 disables the auctions, so that every liquidation takes up to the max liquidation ratio at the liquidation penalty
+AUCTION_DURATION_KEY = 'ad'
+INITIAL_AUCTION_DURATION = 0
+# The penalty of an auction decays from the liquidation penalty to this share of it, expressed in basis points
+AUCTION_PENALTY_FLOOR_KEY = 'af'
+INITIAL_AUCTION_PENALTY_FLOOR = 5000
+
+# The parameters of a collateral are kept in a single serialized record per token,
+# so that an operation reads them once and passes them along
+# The record is a list indexed by the following fields
+COLLATERAL_PARAMETERS_KEY = b'\x0d'
+# Whether the collateral is currently accepted
+COLLATERAL_SUPPORTED = 0
+# The symbol and decimals of a supported collateral
+# These are recorded once when the collateral is supported
+# so that we don't need to call the token contract on every operation
+COLLATERAL_SYMBOL = 1
+COLLATERAL_DECIMALS = 2
+# The minimum loan-to-value, expressed in basis points
+# COLLATERAL_VALUE / LOAN_VALUE
+COLLATERAL_LOAN_TO_VALUE = 3
 # Expressed in basis points
-MAX_LIQUIDATION_RATIO_KEY = 'ml/'
-INITIAL_MAX_LIQUIDATION_RATIO = 5000
+COLLATERAL_MAX_LIQUIDATION_RATIO = 4
 # Expressed in basis points
-LIQUIDATION_PENALTY_KEY = 'lp/'
-INITIAL_LIQUIDATION_PENALTY = 500
+COLLATERAL_LIQUIDATION_PENALTY = 5
+# The quantity of the collateral held by the Nest across all accounts
+COLLATERAL_TOTAL = 6
 
-# The minimum loan-to-value, expressed in basis points
-# COLLATERAL_VALUE / LOAN_VALUE
-LOAN_TO_VALUE_KEY = 'lv/'
+INITIAL_MAX_LIQUIDATION_RATIO = 5000
+INITIAL_LIQUIDATION_PENALTY = 500
 INITIAL_LOAN_TO_VALUE = 7500
 BASIS_POINTS = 10000
 
-# The quantity of a given collateral for a wallet
-COLLATERAL_KEY = 'cl/'
-
-TOTAL_COLLATERAL_KEY = 'tc/'
+# The quantity of a given collateral for a wallet, keyed by account + token
+# Only non-zero quantities are kept, so this doubles as the index of active collateral
+COLLATERAL_KEY = b'\x05'
+# The number of collateral tokens with a non-zero quantity for a wallet
+COLLATERAL_COUNT_KEY = b'\x06'
+# The LTV-weighted quantity of each collateral for a wallet, keyed by collateral token
+# Each entry is [symbol, weighted_quantity], so that it is priced without reading the parameter record
+# The collateral loan to value is then the dot product of this vector with the price map
+COLLATERAL_VALUE_KEY = b'\x07'
+# The quantity of a given collateral for a wallet again, keyed by token + account instead,
+# so that reweighting a collateral only scans the accounts that hold it
+COLLATERAL_HOLDER_KEY = b'\x0f'
+# The index of accounts with an open position, i.e. at least one active collateral
+# POSITION_KEY maps a position to an account and POSITION_INDEX_KEY maps an account to its position + 1
+# An account keeps its position once it is assigned, even while it has no collateral, so positions never move
+POSITION_KEY = b'\x08'
+POSITION_INDEX_KEY = b'\x09'
+# The number of accounts with an open position, and the number of positions assigned so far
+NUM_POSITIONS_KEY = 'np'
+NUM_INDEXED_ACCOUNTS_KEY = 'ia'
+# The open liquidation auction of a collateral for a wallet, keyed by account + token
+# An auction is a serialized [start_height, lot_quantity], where the lot is the collateral left to liquidate
+# An exhausted auction is kept until it expires, so that the position can't be liquidated again in the meantime
+AUCTION_KEY = b'\x0e'
+
+# The prefixes of the maps before STORAGE_VERSION 1, which were keyed by base64 encoded script hashes
+V0_COLLATERAL_SCRIPT_HASH_KEY = 'col/'
+V0_MAX_LIQUIDATION_RATIO_KEY = 'ml/'
+V0_LIQUIDATION_PENALTY_KEY = 'lp/'
+V0_LOAN_TO_VALUE_KEY = 'lv/'
+V0_COLLATERAL_KEY = 'cl/'
+V0_TOTAL_COLLATERAL_KEY = 'tc/'
+V0_UINT160_BASE64_LENGTH = 28
 
 # Actions
 ACTION_COLLATERALIZE = 'ACTION_COLLATERALIZE'
 ACTION_LIQUIDATE = 'ACTION_LIQUIDATE'
+ACTION_LOAN = 'ACTION_LOAN'
+ACTION_WITHDRAW = 'ACTION_WITHDRAW'
+ACTION_BATCH = 'ACTION_BATCH'
+
+# Batches of actions and liquidation targets waiting on their Oracle callback
+BATCH_REQUEST_KEY = 'br/'
+BATCH_REQUEST_ID_KEY = 'bi'
+# The number of blocks after which a request without a callback can be reclaimed
+REQUEST_EXPIRY = 240
+# The response GAS of a batch is getOracleFee(), which pays for the response as for a single request,
+# plus CALLBACK_ACTION_GAS for each action, an upper bound on the GAS an action spends in the callback
+CALLBACK_ACTION_GAS = 50000000
+# The most GAS a batch callback may spend on its actions, which caps the size of a batch
+MAX_CALLBACK_ACTION_GAS = 400000000
+MAX_BATCH_SIZE = MAX_CALLBACK_ACTION_GAS // CALLBACK_ACTION_GAS
+# The maximum number of collateral tokens, summed over the accounts, liquidated by a single ACTION_LIQUIDATE
+# The response GAS is getOracleFee() plus CALLBACK_ACTION_GAS per collateral token, each being liquidated like a liquidation action
+MAX_LIQUIDATE_PAIRS = 32
 
 # -------------------------------------------
 # Events
@@ -153,6 +238,33 @@ on_liquidate_failure = CreateNewEvent(
     'LiquidateFailure'
 )
 
+on_liquidate_refund_failure = CreateNewEvent(
+    [
+        ('liquidator', UInt160),
+        ('usdl_quantity', int),
+        ('failure_reason', str),
+    ],
+    'LiquidateRefundFailure'
+)
+
+on_liquidation_auction = CreateNewEvent(
+    [
+        ('account', UInt160),
+        ('collateral_symbol', str),
+        ('collateral_quantity', int),
+    ],
+    'LiquidationAuction'
+)
+
+on_batch_request = CreateNewEvent(
+    [
+        ('request_id', int),
+        ('liquidator', UInt160),
+        ('usdl_quantity', int),
+    ],
+    'BatchRequest'
+)
+
 # -------------------------------------------
 # Methods
 # -------------------------------------------
@@ -220,10 +332,27 @@ def setOracleScriptHash(hash: UInt160) -> bool:
 
 
 @public
-def isCollateralSupported(token: UInt160) -> bool:
+def getCollateralParameters(token: UInt160) -> list:
+    """
+    Get the parameter record of a collateral
+    Operations read it once and pass it along, instead of reading each parameter separately
+
+    :return: [supported, symbol, decimals, loan_to_value, max_liquidation_ratio, liquidation_penalty, total_collateral]
+    """
     assert validate_address(token), 'token must be a valid 20 byte UInt160'
-    token64 = base64_encode(token)
-    return get_read_only_context().create_map(COLLATERAL_SCRIPT_HASH_KEY).get(token64).to_bool()
+    serialized_parameters = get_read_only_context().create_map(COLLATERAL_PARAMETERS_KEY).get(token)
+    if len(serialized_parameters) == 0:
+        return [False, '', 0, 0, 0, 0, 0]
+    return cast(list, deserialize(serialized_parameters))
+
+
+def putCollateralParameters(token: UInt160, collateral_parameters: list):
+    get_context().create_map(COLLATERAL_PARAMETERS_KEY).put(token, serialize(collateral_parameters))
+
+
+@public
+def isCollateralSupported(token: UInt160) -> bool:
+    return cast(bool, getCollateralParameters(token)[COLLATERAL_SUPPORTED])
 
 
 @public
@@ -231,11 +360,16 @@ def supportCollateral(token: UInt160) -> bool:
     assert validate_address(token), 'token must be a valid 20 byte UInt160'
     if not verify():
         abort()
-    token64 = base64_encode(token)
-    get_context().create_map(COLLATERAL_SCRIPT_HASH_KEY).put(token64, True)
-    setLoanToValue(token, INITIAL_LOAN_TO_VALUE)
-    setMaxLiquiationRatio(token, INITIAL_MAX_LIQUIDATION_RATIO)
-    setLiquidationPenalty(token, INITIAL_LIQUIDATION_PENALTY)
+    collateral_parameters = getCollateralParameters(token)
+    # A token that is supported again keeps the parameters the owner set for it
+    configured = cast(int, collateral_parameters[COLLATERAL_LOAN_TO_VALUE]) > 0
+    collateral_parameters[COLLATERAL_SUPPORTED] = True
+    putCollateralParameters(token, collateral_parameters)
+    updateCollateralMetadata(token)
+    if not configured:
+        setLoanToValue(token, INITIAL_LOAN_TO_VALUE)
+        setMaxLiquiationRatio(token, INITIAL_MAX_LIQUIDATION_RATIO)
+        setLiquidationPenalty(token, INITIAL_LIQUIDATION_PENALTY)
     return True
 
 
@@ -244,16 +378,47 @@ def invalidateCollateral(token: UInt160) -> bool:
     assert validate_address(token), 'token must be a valid 20 byte UInt160'
     if not verify():
         abort()
-    token64 = base64_encode(token)
-    get_context().create_map(COLLATERAL_SCRIPT_HASH_KEY).delete(token64)
+    collateral_parameters = getCollateralParameters(token)
+    collateral_parameters[COLLATERAL_SUPPORTED] = False
+    putCollateralParameters(token, collateral_parameters)
     return True
 
 
 @public
-def getMaxLiquidationRatio(token: UInt160) -> int:
+def getCollateralSymbol(token: UInt160) -> str:
+    return cast(str, getCollateralParameters(token)[COLLATERAL_SYMBOL])
+
+
+@public
+def getCollateralDecimals(token: UInt160) -> int:
+    return cast(int, getCollateralParameters(token)[COLLATERAL_DECIMALS])
+
+
+@public
+def updateCollateralMetadata(token: UInt160) -> bool:
+    """
+    Records the symbol and decimals of a collateral token.
+    This is called by supportCollateral, but it can also be called by the owner
+    to refresh the metadata of a collateral that was supported before it was recorded.
+    """
     assert validate_address(token), 'token must be a valid 20 byte UInt160'
-    token64 = base64_encode(token)
-    return get_read_only_context().create_map(MAX_LIQUIDATION_RATIO_KEY).get(token64).to_int()
+    if not verify():
+        abort()
+    collateral_parameters = getCollateralParameters(token)
+    current_symbol = cast(str, collateral_parameters[COLLATERAL_SYMBOL])
+    collateral_symbol = cast(str, call_contract(token, 'symbol', [], CallFlags.READ_ONLY))
+    collateral_parameters[COLLATERAL_SYMBOL] = collateral_symbol
+    collateral_parameters[COLLATERAL_DECIMALS] = cast(int, call_contract(token, 'decimals', [], CallFlags.READ_ONLY))
+    putCollateralParameters(token, collateral_parameters)
+    # The collateral vectors price each collateral by its symbol, so they follow a renamed token
+    if current_symbol != collateral_symbol and cast(int, collateral_parameters[COLLATERAL_TOTAL]) > 0:
+        refreshCollateralValues(token, collateral_parameters)
+    return True
+
+
+@public
+def getMaxLiquidationRatio(token: UInt160) -> int:
+    return cast(int, getCollateralParameters(token)[COLLATERAL_MAX_LIQUIDATION_RATIO])
 
 
 @public
@@ -262,16 +427,15 @@ def setMaxLiquiationRatio(token: UInt160, max_liquidation_ratio: int) -> bool:
     assert max_liquidation_ratio >= 0, 'max_liquidation_ratio must be a non-negative integer'
     if not verify():
         abort()
-    token64 = base64_encode(token)
-    get_context().create_map(MAX_LIQUIDATION_RATIO_KEY).put(token64, max_liquidation_ratio)
+    collateral_parameters = getCollateralParameters(token)
+    collateral_parameters[COLLATERAL_MAX_LIQUIDATION_RATIO] = max_liquidation_ratio
+    putCollateralParameters(token, collateral_parameters)
     return True
 
 
 @public
 def getLiquidationPenalty(token: UInt160) -> int:
-    assert validate_address(token), 'token must be a valid 20 byte UInt160'
-    token64 = base64_encode(token)
-    return get_read_only_context().create_map(LIQUIDATION_PENALTY_KEY).get(token64).to_int()
+    return cast(int, getCollateralParameters(token)[COLLATERAL_LIQUIDATION_PENALTY])
 
 
 @public
@@ -279,8 +443,9 @@ def setLiquidationPenalty(token: UInt160, liquidation_penalty: int) -> bool:
     assert liquidation_penalty >= 0, 'liquidation_penalty must be a non-negative integer'
     if not verify():
         abort()
-    token64 = base64_encode(token)
-    get_context().create_map(LIQUIDATION_PENALTY_KEY).put(token64, liquidation_penalty)
+    collateral_parameters = getCollateralParameters(token)
+    collateral_parameters[COLLATERAL_LIQUIDATION_PENALTY] = liquidation_penalty
+    putCollateralParameters(token, collateral_parameters)
     return True
 
 
@@ -299,11 +464,79 @@ def setOracleFee(oracle_fee: int) -> bool:
     return True
 
 
+@public
+def getPriceFreshness() -> int:
+    return get(PRICE_FRESHNESS_KEY).to_int()
+
+
+@public
+def setPriceFreshness(price_freshness: int) -> bool:
+    assert price_freshness >= 0, 'price_freshness must be a non-negative integer'
+    if not verify():
+        abort()
+    put(PRICE_FRESHNESS_KEY, price_freshness)
+    return True
+
+
+@public
+def getPriceSnapshotHeight() -> int:
+    return get(PRICE_HEIGHT_KEY).to_int()
+
+
+def updatePriceSnapshot(result: bytes):
+    put(PRICE_SNAPSHOT_KEY, result)
+    put(PRICE_HEIGHT_KEY, current_index)
+
+
+@public
+def getAuctionDuration() -> int:
+    return get(AUCTION_DURATION_KEY).to_int()
+
+
+@public
+def setAuctionDuration(auction_duration: int) -> bool:
+    assert auction_duration >= 0, 'auction_duration must be a non-negative integer'
+    if not verify():
+        abort()
+    put(AUCTION_DURATION_KEY, auction_duration)
+    # Disabling the auctions deletes the open ones, so that none is left behind if they are enabled again
+    if auction_duration == 0:
+        deleteMap(AUCTION_KEY)
+    return True
+
+
+@public
+def getAuctionPenaltyFloor() -> int:
+    return get(AUCTION_PENALTY_FLOOR_KEY).to_int()
+
+
+@public
+def setAuctionPenaltyFloor(auction_penalty_floor: int) -> bool:
+    assert auction_penalty_floor >= 0, 'auction_penalty_floor must be a non-negative integer'
+    assert auction_penalty_floor <= BASIS_POINTS, 'auction_penalty_floor must not exceed BASIS_POINTS'
+    if not verify():
+        abort()
+    put(AUCTION_PENALTY_FLOOR_KEY, auction_penalty_floor)
+    return True
+
+
+def getFreshPrices() -> dict:
+    """
+    Get the last price feed if it arrived within the freshness window
+    :return: the price map, or an empty map if the Oracle needs to be consulted
+    """
+    price_freshness = getPriceFreshness()
+    if price_freshness == 0:
+        return {}
+    price_snapshot = get(PRICE_SNAPSHOT_KEY)
+    if len(price_snapshot) == 0 or current_index >= getPriceSnapshotHeight() + price_freshness:
+        return {}
+    return cast(dict, json_deserialize(price_snapshot.to_str()))
+
+
 @public
 def getLoanToValue(token: UInt160) -> int:
-    assert validate_address(token), 'token must be a valid 20 byte UInt160'
-    token64 = base64_encode(token)
-    return get_read_only_context().create_map(LOAN_TO_VALUE_KEY).get(token64).to_int()
+    return cast(int, getCollateralParameters(token)[COLLATERAL_LOAN_TO_VALUE])
 
 
 @public
@@ -312,24 +545,46 @@ def setLoanToValue(token: UInt160, collateralization_ratio: int) -> bool:
     assert collateralization_ratio > 0, 'collateralization_ratio must be greater than zero'
     if not verify():
         abort()
-    token64 = base64_encode(token)
-    get_context().create_map(LOAN_TO_VALUE_KEY).put(token64, collateralization_ratio)
+    collateral_parameters = getCollateralParameters(token)
+    current_loan_to_value = cast(int, collateral_parameters[COLLATERAL_LOAN_TO_VALUE])
+    collateral_parameters[COLLATERAL_LOAN_TO_VALUE] = collateralization_ratio
+    putCollateralParameters(token, collateral_parameters)
+    # Reweight the collateral vectors of the accounts that already hold this collateral
+    if current_loan_to_value != 0 and current_loan_to_value != collateralization_ratio:
+        refreshCollateralValues(token, collateral_parameters)
     return True
 
 
 @public
 def getTotalCollateral(token: UInt160) -> int:
-    assert validate_address(token), 'token must be a valid 20 byte UInt160'
-    token64 = base64_encode(token)
-    return get_read_only_context().create_map(TOTAL_COLLATERAL_KEY).get(token64).to_int()
+    return cast(int, getCollateralParameters(token)[COLLATERAL_TOTAL])
 
 
-def updateTotalCollateral(token: UInt160, collateral_quantity: int) -> bool:
-    assert validate_address(token), 'token must be a valid 20 byte UInt160'
-    assert collateral_quantity >= 0, 'collateral_quantity must be non-negative'
-    token64 = base64_encode(token)
-    get_context().create_map(TOTAL_COLLATERAL_KEY).put(token64, collateral_quantity)
-    return True
+@public
+def getTotalCollaterals() -> list:
+    """
+    Get the total quantity held across all accounts of every collateral that was ever supported
+    This reads one record per collateral token, regardless of the number of accounts
+
+    :return: [[token, total_collateral], ...]
+    """
+    records = find(COLLATERAL_PARAMETERS_KEY)
+    ret = []
+    while records.next():
+        token = UInt160(cast(bytes, records.value[0])[len(COLLATERAL_PARAMETERS_KEY):])
+        collateral_parameters = cast(list, deserialize(cast(bytes, records.value[1])))
+        ret.append([token, collateral_parameters[COLLATERAL_TOTAL]])
+    return ret
+
+
+def updateTotalCollateral(token: UInt160, diff_quantity: int, collateral_parameters: list):
+    """
+    Adds diff_quantity to the total collateral in the record, which stays up to date for the caller
+    """
+    total_collateral = cast(int, collateral_parameters[COLLATERAL_TOTAL]) + diff_quantity
+    assert total_collateral >= 0, 'total collateral must be non-negative'
+    collateral_parameters[COLLATERAL_TOTAL] = total_collateral
+    putCollateralParameters(token, collateral_parameters)
 
 
 @public
@@ -337,22 +592,282 @@ def getCollateralBalance(token: UInt160, account: UInt160) -> int:
     assert validate_address(token), 'token must be a valid 20 byte UInt160'
     assert validate_address(account), 'account must be a valid 20 byte UInt160'
 
-    token64 = base64_encode(token)
-    account64 = base64_encode(account)
-    return get_read_only_context().create_map(COLLATERAL_KEY + account64 + '/').get(token64).to_int()
+    return get_read_only_context().create_map(COLLATERAL_KEY + account).get(token).to_int()
 
 
-def updateCollateralBalance(token: UInt160, account: UInt160, collateral_quantity: int) -> bool:
+def updateCollateralBalance(token: UInt160, account: UInt160, collateral_quantity: int, collateral_parameters: list) -> bool:
     assert validate_address(token), 'token must be a valid 20 byte UInt160'
     assert validate_address(account), 'account must be a valid 20 byte UInt160'
     assert collateral_quantity >= 0, 'collateral_quantity must be non-negative'
 
-    token64 = base64_encode(token)
-    account64 = base64_encode(account)
-    get_context().create_map(COLLATERAL_KEY + account64 + '/').put(token64, collateral_quantity)
+    collateral_map = get_context().create_map(COLLATERAL_KEY + account)
+    holder_map = get_context().create_map(COLLATERAL_HOLDER_KEY + token)
+    current_collateral = collateral_map.get(token).to_int()
+
+    # Emptied positions are deleted so that they are no longer scanned
+    if collateral_quantity == 0:
+        collateral_map.delete(token)
+        holder_map.delete(account)
+        if current_collateral > 0:
+            updateCollateralCount(account, -1)
+    else:
+        collateral_map.put(token, collateral_quantity)
+        holder_map.put(account, collateral_quantity)
+        if current_collateral == 0:
+            updateCollateralCount(account, 1)
+    updateCollateralValue(account, token, collateral_quantity, collateral_parameters)
+    if collateral_quantity != current_collateral:
+        updateTotalCollateral(token, collateral_quantity - current_collateral, collateral_parameters)
     return True
 
 
+def getCollateralVector(account: UInt160) -> dict:
+    serialized_vector = get_read_only_context().create_map(COLLATERAL_VALUE_KEY).get(account)
+    if len(serialized_vector) == 0:
+        return {}
+    return cast(dict, deserialize(serialized_vector))
+
+
+def updateCollateralValue(account: UInt160, token: UInt160, collateral_quantity: int, collateral_parameters: list):
+    """
+    Sets the symbol and LTV-weighted quantity of a collateral in the collateral vector of an account
+    """
+    collateral_vector = getCollateralVector(account)
+    if collateral_quantity == 0:
+        if token in collateral_vector:
+            collateral_vector.pop(token)
+    else:
+        token_symbol = cast(str, collateral_parameters[COLLATERAL_SYMBOL])
+        loan_to_value = cast(int, collateral_parameters[COLLATERAL_LOAN_TO_VALUE])
+        collateral_vector[token] = [token_symbol, collateral_quantity * loan_to_value]
+
+    value_map = get_context().create_map(COLLATERAL_VALUE_KEY)
+    if len(collateral_vector) == 0:
+        value_map.delete(account)
+    else:
+        value_map.put(account, serialize(collateral_vector))
+
+
+def refreshCollateralValues(token: UInt160, collateral_parameters: list):
+    """
+    Recomputes the symbol and LTV-weighted quantity of a collateral for every account that holds it.
+    Only the holders of this collateral are scanned, and it is only done when the owner changes a loan to value or a symbol.
+    """
+    holder_prefix = COLLATERAL_HOLDER_KEY + token
+    holders = find(holder_prefix)
+    while holders.next():
+        account = UInt160(cast(bytes, holders.value[0])[len(holder_prefix):])
+        quantity = cast(bytes, holders.value[1]).to_int()
+        updateCollateralValue(account, token, quantity, collateral_parameters)
+
+
+@public
+def getCollateralCount(account: UInt160) -> int:
+    assert validate_address(account), 'account must be a valid 20 byte UInt160'
+    return get_read_only_context().create_map(COLLATERAL_COUNT_KEY).get(account).to_int()
+
+
+def updateCollateralCount(account: UInt160, diff_count: int):
+    count_map = get_context().create_map(COLLATERAL_COUNT_KEY)
+    current_count = count_map.get(account).to_int()
+    new_count = current_count + diff_count
+    if new_count > 0:
+        count_map.put(account, new_count)
+        if current_count == 0:
+            addPosition(account)
+    else:
+        count_map.delete(account)
+        if current_count > 0:
+            removePosition(account)
+
+
+@public
+def numPositions() -> int:
+    return get(NUM_POSITIONS_KEY).to_int()
+
+
+@public
+def getPositions(cursor: int, page_size: int, include_debt: bool) -> list:
+    """
+    Get the accounts with an open position and their collateral balances, starting at a cursor
+    Accounts never move between positions, so a pass over every page returns each account
+    that kept an open position throughout the pass exactly once, however positions change in between
+    The positions of accounts without collateral are skipped, so a page may hold fewer than page_size accounts
+
+    :return: [next_cursor, [[account, [[token, balance], ...]], ...]], where next_cursor is -1 once every position was read
+    When include_debt is set, the loaned bUSDL balance is appended, i.e. [account, [[token, balance], ...], debt]
+    """
+    num_positions = get(NUM_INDEXED_ACCOUNTS_KEY).to_int()
+    assert cursor >= 0 and cursor <= num_positions, 'cursor must be a position in the account index'
+    assert page_size > 0 and page_size <= 64, 'page_size must be a positive integer <= 64'
+
+    position_map = get_read_only_context().create_map(POSITION_KEY)
+    end = min(cursor + page_size, num_positions)
+    accounts = []
+    ret = []
+    position = cursor
+    while position < end:
+        account = UInt160(position_map.get(itoa(position)))
+
+        collateral_prefix = COLLATERAL_KEY + account
+        collateral = []
+        balances = find(collateral_prefix)
+        while balances.next():
+            token = UInt160(cast(bytes, balances.value[0])[len(collateral_prefix):])
+            quantity = cast(bytes, balances.value[1]).to_int()
+            collateral.append([token, quantity])
+
+        if len(collateral) > 0:
+            accounts.append(account)
+            ret.append([account, collateral])
+        position += 1
+
+    # The debts of the whole page are read with a single call to bUSDL
+    if include_debt and len(accounts) > 0:
+        debts = cast(list, call_contract(getBUSDLScriptHash(), 'loanedBalanceOfBatch', [accounts], CallFlags.READ_ONLY))
+        index = 0
+        while index < len(ret):
+            cast(list, ret[index]).append(debts[index])
+            index += 1
+
+    next_cursor = end
+    if next_cursor >= num_positions:
+        next_cursor = -1
+    return [next_cursor, ret]
+
+
+@public
+def getAccountDashboard(account: UInt160) -> list:
+    """
+    Get everything needed to render an account in a single read-only invocation
+
+    :return: [[[token, balance, collateral_parameters], ...], debt, exchange_rate, interest_multiplier]
+    Every collateral that is supported or still held by the account is listed, with its record as returned by getCollateralParameters
+    The debt, exchange rate and interest multiplier are read from bUSDL
+    """
+    assert validate_address(account), 'account must be a valid 20 byte UInt160'
+
+    collateral_map = get_read_only_context().create_map(COLLATERAL_KEY + account)
+    collateral = []
+    records = find(COLLATERAL_PARAMETERS_KEY)
+    while records.next():
+        token = UInt160(cast(bytes, records.value[0])[len(COLLATERAL_PARAMETERS_KEY):])
+        collateral_parameters = cast(list, deserialize(cast(bytes, records.value[1])))
+        balance = collateral_map.get(token).to_int()
+        if balance > 0 or cast(bool, collateral_parameters[COLLATERAL_SUPPORTED]):
+            collateral.append([token, balance, collateral_parameters])
+
+    busdl_script_hash = getBUSDLScriptHash()
+    debt = cast(int, call_contract(busdl_script_hash, 'loanedBalanceOf', [account], CallFlags.READ_ONLY))
+    # The exchange rate and interest multiplier are taken from the same getPoolState read
+    pool_state = cast(list, call_contract(busdl_script_hash, 'getPoolState', [], CallFlags.READ_ONLY))
+    return [collateral, debt, pool_state[3], pool_state[4]]
+
+
+def addPosition(account: UInt160):
+    """
+    Counts an account that opened a position, and assigns it the next position in the index the first time
+    """
+    index_map = get_context().create_map(POSITION_INDEX_KEY)
+    if index_map.get(account).to_int() == 0:
+        num_indexed_accounts = get(NUM_INDEXED_ACCOUNTS_KEY).to_int()
+        get_context().create_map(POSITION_KEY).put(itoa(num_indexed_accounts), account)
+        index_map.put(account, num_indexed_accounts + 1)
+        put(NUM_INDEXED_ACCOUNTS_KEY, num_indexed_accounts + 1)
+    put(NUM_POSITIONS_KEY, numPositions() + 1)
+
+
+def removePosition(account: UInt160):
+    """
+    Uncounts an account that closed its position, which keeps its place in the index for when it opens one again
+    """
+    put(NUM_POSITIONS_KEY, numPositions() - 1)
+
+
+def deleteMap(prefix: Union[bytes, str]):
+    entries = find(prefix)
+    while entries.next():
+        delete(cast(bytes, entries.value[0]))
+
+
+def rebuildCollateralIndex():
+    """
+    Deletes zero quantity collateral entries, then recounts the active collateral,
+    recomputes the collateral vector and the collateral holders of every account, reindexes the open positions
+    and sums the total of every collateral.
+    Entries written before the index was maintained may still hold zero quantities.
+    """
+    deleteMap(COLLATERAL_COUNT_KEY)
+    deleteMap(POSITION_KEY)
+    deleteMap(POSITION_INDEX_KEY)
+    put(NUM_POSITIONS_KEY, 0)
+    put(NUM_INDEXED_ACCOUNTS_KEY, 0)
+    deleteMap(COLLATERAL_VALUE_KEY)
+    deleteMap(COLLATERAL_HOLDER_KEY)
+
+    records = find(COLLATERAL_PARAMETERS_KEY)
+    while records.next():
+        token = UInt160(cast(bytes, records.value[0])[len(COLLATERAL_PARAMETERS_KEY):])
+        collateral_parameters = cast(list, deserialize(cast(bytes, records.value[1])))
+        collateral_parameters[COLLATERAL_TOTAL] = 0
+        putCollateralParameters(token, collateral_parameters)
+
+    balances = find(COLLATERAL_KEY)
+    while balances.next():
+        key = cast(bytes, balances.value[0])
+        quantity = cast(bytes, balances.value[1]).to_int()
+        if quantity == 0:
+            delete(key)
+        else:
+            # The key is COLLATERAL_KEY + account + token
+            account = UInt160(key[len(COLLATERAL_KEY):len(COLLATERAL_KEY) + UINT160_LENGTH])
+            updateCollateralCount(account, 1)
+            token = UInt160(key[len(key) - UINT160_LENGTH:])
+            put(COLLATERAL_HOLDER_KEY + token + account, quantity)
+            collateral_parameters = getCollateralParameters(token)
+            updateCollateralValue(account, token, quantity, collateral_parameters)
+            updateTotalCollateral(token, quantity, collateral_parameters)
+
+
+def migrateStorage():
+    """
+    Moves the storage written before STORAGE_VERSION 1 into the collateral parameter records and the binary key layout.
+    The symbol and decimals weren't recorded then, so they are read from each collateral token.
+    The totals are derived from the collateral balances, so they are deleted here and recomputed by rebuildCollateralIndex.
+    Every legacy entry is rewritten within the update, so its GAS grows with the number of positions.
+    """
+    # Every collateral that was ever supported was given a loan to value, so that map lists them all
+    loan_to_values = find(V0_LOAN_TO_VALUE_KEY)
+    while loan_to_values.next():
+        token64 = cast(str, loan_to_values.value[0])[len(V0_LOAN_TO_VALUE_KEY):]
+        token = UInt160(base64_decode(token64))
+        collateral_parameters = [
+            get(V0_COLLATERAL_SCRIPT_HASH_KEY + token64).to_bool(),
+            cast(str, call_contract(token, 'symbol', [], CallFlags.READ_ONLY)),
+            cast(int, call_contract(token, 'decimals', [], CallFlags.READ_ONLY)),
+            cast(bytes, loan_to_values.value[1]).to_int(),
+            get(V0_MAX_LIQUIDATION_RATIO_KEY + token64).to_int(),
+            get(V0_LIQUIDATION_PENALTY_KEY + token64).to_int(),
+            0,
+        ]
+        putCollateralParameters(token, collateral_parameters)
+
+    deleteMap(V0_COLLATERAL_SCRIPT_HASH_KEY)
+    deleteMap(V0_MAX_LIQUIDATION_RATIO_KEY)
+    deleteMap(V0_LIQUIDATION_PENALTY_KEY)
+    deleteMap(V0_LOAN_TO_VALUE_KEY)
+    deleteMap(V0_TOTAL_COLLATERAL_KEY)
+
+    balances = find(V0_COLLATERAL_KEY)
+    while balances.next():
+        key = cast(str, balances.value[0])
+        # The key is V0_COLLATERAL_KEY + account64 + '/' + token64
+        account64 = key[len(V0_COLLATERAL_KEY):len(V0_COLLATERAL_KEY) + V0_UINT160_BASE64_LENGTH]
+        token64 = key[len(key) - V0_UINT160_BASE64_LENGTH:]
+        put(COLLATERAL_KEY + base64_decode(account64) + base64_decode(token64), cast(bytes, balances.value[1]))
+        delete(key)
+
+
 @public
 def setOwner(hash: UInt160):
     assert validate_address(hash), 'hash must be a valid 20 byte UInt160'
@@ -396,59 +911,62 @@ def callByOracle() -> bool:
 
 # The total collateral value with LTV applied
 def computeCollateralLTV(account: UInt160, price_map: dict) -> int:
-    account64 = base64_encode(account)
-    account_collateral_key = COLLATERAL_KEY + account64 + '/'
-    balances = find(account_collateral_key)
+    # The collateral vector already holds [symbol, quantity * loan_to_value] for each collateral
+    collateral_vector = getCollateralVector(account)
 
     collateral_value = 0
-    while balances.next():
-        token64 = cast(str, balances.value[0])[len(account_collateral_key):]
-        token = UInt160(base64_decode(token64))
-        quantity = cast(bytes, balances.value[1]).to_int()
-        if quantity > 0:
-            token_symbol = cast(str, call_contract(token, 'symbol', [], CallFlags.READ_ONLY))
-            token_price = cast(int, price_map[token_symbol])
-            loan_to_value = getLoanToValue(token)
-            token_value = (quantity * token_price * loan_to_value) // BASIS_POINTS
-            collateral_value += token_value
+    for token in collateral_vector.keys():
+        collateral_value_entry = cast(list, collateral_vector[token])
+        weighted_quantity = cast(int, collateral_value_entry[1])
+        token_price = cast(int, price_map[cast(str, collateral_value_entry[0])])
+        token_value = (weighted_quantity * token_price) // BASIS_POINTS
+        collateral_value += token_value
 
     return collateral_value
 
 
-@public
-def loanCallback(url: str, user_data: Any, code: int, result: bytes):
-    if not callByOracle():
-        abort()
-
-    loan_data = cast(dict, user_data)
-    account = cast(UInt160, loan_data['account'])
-    loan_quantity = cast(int, loan_data['loan_quantity'])
-    loan_token = cast(UInt160, loan_data['loan_token'])
-
+def getLoanSymbol(loan_token: UInt160) -> str:
     underlying_token = cast(UInt160, call_contract(loan_token, 'getUnderlyingScriptHash', [], CallFlags.READ_ONLY))
-    loan_symbol = cast(str, call_contract(underlying_token, 'symbol', [], CallFlags.READ_ONLY))
-    current_loan = cast(int, call_contract(loan_token, 'loanedBalanceOf', [account], CallFlags.READ_ONLY))
-
-    if code != 0:
-        on_loan_failure(account, loan_symbol, loan_quantity, 'Oracle invocation failed')
-        pass
+    return cast(str, call_contract(underlying_token, 'symbol', [], CallFlags.READ_ONLY))
 
 
-    json_result = cast(dict, json_deserialize(cast(str, result)))
+def applyLoan(account: UInt160, loan_token: UInt160, loan_quantity: int, price_map: dict) -> bool:
+    loan_symbol = getLoanSymbol(loan_token)
+    current_loan = cast(int, call_contract(loan_token, 'loanedBalanceOf', [account], CallFlags.READ_ONLY))
 
     # Compute the total loan value
     total_loan = current_loan + loan_quantity
-    loan_price = cast(int, json_result[loan_symbol])
+    loan_price = cast(int, price_map[loan_symbol])
     loan_value = total_loan * loan_price
-    collateral_ltv = computeCollateralLTV(account, json_result)
+    collateral_ltv = computeCollateralLTV(account, price_map)
             
     if loan_value > collateral_ltv:
         on_loan_failure(account, loan_symbol, loan_quantity, 'The total loan value=' + itoa(loan_value) +
             ' > total collateral loan to value=' + itoa(collateral_ltv))
-        return
+        return False
 
     call_contract(loan_token, 'loan', [account, loan_quantity])
     on_loan(account, loan_symbol, loan_quantity)
+    return True
+
+
+@public
+def loanCallback(url: str, user_data: Any, code: int, result: bytes):
+    if not callByOracle():
+        abort()
+
+    loan_data = cast(dict, user_data)
+    account = cast(UInt160, loan_data['account'])
+    loan_quantity = cast(int, loan_data['loan_quantity'])
+    loan_token = cast(UInt160, loan_data['loan_token'])
+
+    if code != 0:
+        on_loan_failure(account, getLoanSymbol(loan_token), loan_quantity, 'Oracle invocation failed')
+        return
+
+    updatePriceSnapshot(result)
+    json_result = cast(dict, json_deserialize(cast(str, result)))
+    applyLoan(account, loan_token, loan_quantity, json_result)
 
     
 @public
@@ -458,8 +976,13 @@ def loan(account: UInt160, loan_token: UInt160, loan_quantity: int):
     assert loan_quantity >= 0, 'loan_quantity must be a non-negative integer'
 
     # Keep in mind that loan_token is the wrapped token
-    # 1. Make a call to the oracle to see if this is valid
-    # If not valid, cut down to valid quantity
+    # 1. Use the last price feed if it is fresh enough
+    price_map = getFreshPrices()
+    if len(price_map) > 0:
+        applyLoan(account, loan_token, loan_quantity, price_map)
+        return
+
+    # 2. Otherwise, make a call to the oracle to see if this is valid
     loan_data = {
         'account': account,
         'loan_token': loan_token,
@@ -472,42 +995,29 @@ def depositCollateral(account: UInt160, collateral_token: UInt160, quantity: int
     assert validate_address(account), 'account must be a valid 20 byte UInt160'
     assert quantity >= 0, 'quantity must be a non-negative integer'
 
-    collateral_symbol = cast(str, call_contract(collateral_token, 'symbol', [], CallFlags.READ_ONLY))
+    collateral_parameters = getCollateralParameters(collateral_token)
+    collateral_symbol = cast(str, collateral_parameters[COLLATERAL_SYMBOL])
     current_collateral = getCollateralBalance(collateral_token, account)
     new_collateral = current_collateral + quantity
-    updateCollateralBalance(collateral_token, account, new_collateral)
+    updateCollateralBalance(collateral_token, account, new_collateral, collateral_parameters)
     on_collateral_deposit(account, collateral_symbol, quantity)
 
 
-@public
-def withdrawCollateralCallback(url: str, user_data: Any, code: int, result: bytes):
-    if not callByOracle():
-        abort()
-
-    withdraw_collateral_data = cast(dict, user_data)
-    account = cast(UInt160, withdraw_collateral_data['account'])
-    collateral_token = cast(UInt160, withdraw_collateral_data['collateral_token'])
-    withdraw_quantity = cast(int, withdraw_collateral_data['withdraw_quantity'])
-
-    collateral_symbol = cast(str, call_contract(collateral_token, 'symbol', [], CallFlags.READ_ONLY))
-
-    if code != 0:
-        on_collateral_withdraw_failure(account, collateral_symbol, withdraw_quantity, 'Oracle invocation failed')
-        pass
-
+def applyWithdrawCollateral(account: UInt160, collateral_token: UInt160, withdraw_quantity: int, price_map: dict) -> bool:
+    collateral_parameters = getCollateralParameters(collateral_token)
+    collateral_symbol = cast(str, collateral_parameters[COLLATERAL_SYMBOL])
     loan_quantity = cast(int, call_contract(getBUSDLScriptHash(), 'loanedBalanceOf', [account], CallFlags.READ_ONLY))
     current_collateral = getCollateralBalance(collateral_token, account)
     if current_collateral < withdraw_quantity:
         on_collateral_withdraw_failure(account, collateral_symbol, withdraw_quantity, 'Withdraw quantity=' + itoa(withdraw_quantity) + ' < current collateral=' + itoa(current_collateral))
-        return
+        return False
 
-    json_result = cast(dict, json_deserialize(cast(str, result)))
-    usdl_price = cast(int, json_result[USDL])
-    collateral_price = cast(int, json_result[collateral_symbol])
+    usdl_price = cast(int, price_map[USDL])
+    collateral_price = cast(int, price_map[collateral_symbol])
 
     loan_value = usdl_price * loan_quantity
-    collateral_ltv = computeCollateralLTV(account, json_result)
-    loan_to_value = getLoanToValue(collateral_token)
+    collateral_ltv = computeCollateralLTV(account, price_map)
+    loan_to_value = cast(int, collateral_parameters[COLLATERAL_LOAN_TO_VALUE])
     withdraw_collateral_ltv = (withdraw_quantity * collateral_price * loan_to_value) // BASIS_POINTS
     remaining_collateral_ltv = collateral_ltv - withdraw_collateral_ltv
 
@@ -515,14 +1025,34 @@ def withdrawCollateralCallback(url: str, user_data: Any, code: int, result: byte
     if loan_value > 0:
         if loan_value > remaining_collateral_ltv:
             on_collateral_withdraw_failure(account, collateral_symbol, withdraw_quantity, 'Withdrawal causes loan value=' + itoa(loan_value) + ' < remaining collateral loan to value=' + itoa(remaining_collateral_ltv))
-            return
+            return False
     
-    updateCollateralBalance(collateral_token, account, current_collateral - withdraw_quantity)
+    updateCollateralBalance(collateral_token, account, current_collateral - withdraw_quantity, collateral_parameters)
     transfer_success = cast(bool, call_contract(collateral_token, 'transfer', [executing_script_hash, account, withdraw_quantity, None]))
     if not transfer_success:
         on_collateral_withdraw_failure(account, collateral_symbol, withdraw_quantity, 'Failed to transfer collateral to withdrawer')
-        return
+        return False
     on_collateral_withdraw(account, collateral_symbol, withdraw_quantity)
+    return True
+
+
+@public
+def withdrawCollateralCallback(url: str, user_data: Any, code: int, result: bytes):
+    if not callByOracle():
+        abort()
+
+    withdraw_collateral_data = cast(dict, user_data)
+    account = cast(UInt160, withdraw_collateral_data['account'])
+    collateral_token = cast(UInt160, withdraw_collateral_data['collateral_token'])
+    withdraw_quantity = cast(int, withdraw_collateral_data['withdraw_quantity'])
+
+    if code != 0:
+        on_collateral_withdraw_failure(account, getCollateralSymbol(collateral_token), withdraw_quantity, 'Oracle invocation failed')
+        return
+
+    updatePriceSnapshot(result)
+    json_result = cast(dict, json_deserialize(cast(str, result)))
+    applyWithdrawCollateral(account, collateral_token, withdraw_quantity, json_result)
 
 
 @public
@@ -531,6 +1061,11 @@ def withdrawCollateral(account: UInt160, collateral_token: UInt160, withdraw_qua
     assert validate_address(collateral_token), 'collateral_token must be a valid 20 byte UInt160'
     assert withdraw_quantity >= 0, 'withdraw_quantity must be a non-negative integer'
 
+    price_map = getFreshPrices()
+    if len(price_map) > 0:
+        applyWithdrawCollateral(account, collateral_token, withdraw_quantity, price_map)
+        return
+
     # Currently, we don't have any plans to support any loans other than USDL
     withdraw_collateral_data = {
         'account': account,
@@ -540,6 +1075,196 @@ def withdrawCollateral(account: UInt160, collateral_token: UInt160, withdraw_qua
     Oracle.request(PRICE_URL, None, 'withdrawCollateralCallback', withdraw_collateral_data, getOracleFee())
 
 
+def refundLiquidator(liquidator: UInt160, account: UInt160, collateral_symbol: str, usdl_quantity: int):
+    transfer_success = cast(bool, call_contract(getUSDLScriptHash(), 'transfer', [executing_script_hash, liquidator, usdl_quantity, None]))
+    if not transfer_success:
+        on_liquidate_failure(liquidator, account, collateral_symbol, usdl_quantity, 'failed to refund usdl quantity=' + itoa(usdl_quantity))
+
+
+def refundLiquidateTargets(liquidator: UInt160, usdl_quantity: int):
+    """
+    Refunds the USDL left over from several targets, which doesn't belong to any one of them
+    """
+    transfer_success = cast(bool, call_contract(getUSDLScriptHash(), 'transfer', [executing_script_hash, liquidator, usdl_quantity, None]))
+    if not transfer_success:
+        on_liquidate_refund_failure(liquidator, usdl_quantity, 'failed to refund usdl quantity=' + itoa(usdl_quantity))
+
+
+def getAuctionPenalty(liquidation_penalty: int, start_height: int, auction_duration: int) -> int:
+    """
+    The penalty of an auction decays linearly from the liquidation penalty when it opens
+    to its getAuctionPenaltyFloor share when it expires, so it never exceeds the configured penalty
+    """
+    penalty_floor = (liquidation_penalty * getAuctionPenaltyFloor()) // BASIS_POINTS
+    remaining_blocks = start_height + auction_duration - current_index
+    if remaining_blocks <= 0:
+        return penalty_floor
+    return penalty_floor + ((liquidation_penalty - penalty_floor) * remaining_blocks) // auction_duration
+
+
+@public
+def getLiquidationAuction(account: UInt160, token: UInt160) -> list:
+    """
+    Get the open liquidation auction of a collateral for a wallet
+
+    :return: [start_height, lot_quantity, liquidation_penalty], or an empty list if there is no open auction
+    The lot_quantity of an exhausted auction is 0 until it expires
+    """
+    assert validate_address(account), 'account must be a valid 20 byte UInt160'
+    assert validate_address(token), 'token must be a valid 20 byte UInt160'
+    auction_duration = getAuctionDuration()
+    serialized_auction = get_read_only_context().create_map(AUCTION_KEY + account).get(token)
+    if auction_duration == 0 or len(serialized_auction) == 0:
+        return []
+    auction = cast(list, deserialize(serialized_auction))
+    start_height = cast(int, auction[0])
+    if current_index >= start_height + auction_duration:
+        return []
+    auction.append(getAuctionPenalty(getLiquidationPenalty(token), start_height, auction_duration))
+    return auction
+
+
+def openLiquidationAuction(account: UInt160, token: UInt160, collateral_symbol: str, lot_quantity: int, auction_duration: int) -> list:
+    """
+    Get the open auction of an eligible position, or open one with the given lot if it has none or it expired
+    :return: [start_height, lot_quantity]
+    """
+    auction_map = get_context().create_map(AUCTION_KEY + account)
+    serialized_auction = auction_map.get(token)
+    if len(serialized_auction) > 0:
+        auction = cast(list, deserialize(serialized_auction))
+        if current_index < cast(int, auction[0]) + auction_duration:
+            return auction
+    auction = [current_index, lot_quantity]
+    auction_map.put(token, serialize(auction))
+    on_liquidation_auction(account, collateral_symbol, lot_quantity)
+    return auction
+
+
+def closeLiquidationAuction(account: UInt160, token: UInt160):
+    get_context().create_map(AUCTION_KEY + account).delete(token)
+
+
+def fillLiquidationAuction(account: UInt160, token: UInt160, auction: list, collateral_quantity: int):
+    # The auction stays open once its lot runs out, otherwise the next liquidation would open a new lot at the full penalty
+    auction[1] = max(cast(int, auction[1]) - collateral_quantity, 0)
+    get_context().create_map(AUCTION_KEY + account).put(token, serialize(auction))
+
+
+def executeLiquidate(liquidator: UInt160, account: UInt160, collateral_token: UInt160, usdl_quantity: int, loan_quantity: int, price_map: dict) -> int:
+    """
+    Liquidates a collateral of an account against the given loan quantity, without refunding the liquidator,
+    so that several liquidations can share the same USDL
+
+    :return: the quantity of USDL spent on the repayment
+    """
+    # The parameters are read once for the whole liquidation
+    collateral_parameters = getCollateralParameters(collateral_token)
+    collateral_symbol = cast(str, collateral_parameters[COLLATERAL_SYMBOL])
+    current_collateral = getCollateralBalance(collateral_token, account)
+
+    usdl_price = cast(int, price_map[USDL])
+    collateral_price = cast(int, price_map[collateral_symbol])
+
+    loan_value = usdl_price * loan_quantity
+    collateral_ltv = computeCollateralLTV(account, price_map)
+    usdl_script_hash = getUSDLScriptHash()
+    auction_duration = getAuctionDuration()
+
+    # The account isn't eligible for liquidation
+    if collateral_ltv > loan_value:
+        on_liquidate_failure(liquidator, account, collateral_symbol, usdl_quantity, 'collateral loan to value=' + itoa(collateral_ltv) + ' > loan value=' + itoa(loan_value))
+        # The position recovered, so its auction is over
+        if auction_duration > 0:
+            closeLiquidationAuction(account, collateral_token)
+        return 0
+
+    # The desired quantity of the collateral to be liquidated, where anything beyond the loan would be refunded by bUSDL to the Nest
+    desired_liquidate_quantity = (min(usdl_quantity, loan_quantity) * usdl_price) // collateral_price
+    # The maxiumum quantity of the collateral allowed to be liquidated
+    max_liquidate_quantity = (current_collateral * cast(int, collateral_parameters[COLLATERAL_MAX_LIQUIDATION_RATIO])) // BASIS_POINTS
+    liquidation_penalty = cast(int, collateral_parameters[COLLATERAL_LIQUIDATION_PENALTY])
+    auction = []
+    if auction_duration > 0:
+        # The max liquidation ratio sizes the lot of an auction instead, which is shared by every liquidator
+        # until it runs out or expires, and whose penalty decays with every block
+        auction = openLiquidationAuction(account, collateral_token, collateral_symbol, max_liquidate_quantity, auction_duration)
+        if cast(int, auction[1]) <= 0:
+            on_liquidate_failure(liquidator, account, collateral_symbol, usdl_quantity, 'liquidation auction exhausted until height=' + itoa(cast(int, auction[0]) + auction_duration))
+            return 0
+        liquidation_penalty = getAuctionPenalty(liquidation_penalty, cast(int, auction[0]), auction_duration)
+        # The lot pays for the penalty too
+        max_liquidate_quantity = (min(cast(int, auction[1]), current_collateral) * BASIS_POINTS) // (liquidation_penalty + BASIS_POINTS)
+    clipped_liquidate_quantity = min(desired_liquidate_quantity, max_liquidate_quantity)
+    total_liquidate_quantity = ((liquidation_penalty + BASIS_POINTS) * clipped_liquidate_quantity) // BASIS_POINTS
+    clipped_usdl_quantity = (clipped_liquidate_quantity * collateral_price) // usdl_price
+
+    if total_liquidate_quantity <= 0:
+        # An auction whose lot is too small to pay for anything is left to expire like an exhausted one
+        on_liquidate_failure(liquidator, account, collateral_symbol, usdl_quantity, 'total liquidate quantity = 0')
+        return 0
+
+    # Update the collateral balance
+    updateCollateralBalance(collateral_token, account, current_collateral - total_liquidate_quantity, collateral_parameters)
+    # Make a repayment with the incoming USDL
+    transfer_success = cast(bool, call_contract(usdl_script_hash, 'transfer', [executing_script_hash, getBUSDLScriptHash(), clipped_usdl_quantity, ['ACTION_REPAYMENT', account]]))
+    if not transfer_success:
+        on_liquidate_failure(liquidator, account, collateral_symbol, usdl_quantity, 'failed to repay usdl quantity=' + itoa(clipped_usdl_quantity))
+        updateCollateralBalance(collateral_token, account, current_collateral, collateral_parameters)
+        return 0
+    # Pay out the liquidated collateral
+    transfer_success = cast(bool, call_contract(collateral_token, 'transfer', [executing_script_hash, liquidator, total_liquidate_quantity, None]))
+    if not transfer_success:
+        on_liquidate_failure(liquidator, account, collateral_symbol, usdl_quantity, 'failed to transfer liquidated collateral=' + itoa(total_liquidate_quantity))
+        updateCollateralBalance(collateral_token, account, current_collateral, collateral_parameters)
+        # The repayment went through, so the USDL is spent all the same
+        return clipped_usdl_quantity
+    if auction_duration > 0:
+        fillLiquidationAuction(account, collateral_token, auction, total_liquidate_quantity)
+    on_liquidate(liquidator, account, collateral_symbol, clipped_usdl_quantity, total_liquidate_quantity)
+    return clipped_usdl_quantity
+
+
+def applyLiquidate(liquidator: UInt160, account: UInt160, collateral_token: UInt160, usdl_quantity: int, price_map: dict) -> bool:
+    loan_quantity = cast(int, call_contract(getBUSDLScriptHash(), 'loanedBalanceOf', [account], CallFlags.READ_ONLY))
+    spent_usdl_quantity = executeLiquidate(liquidator, account, collateral_token, usdl_quantity, loan_quantity, price_map)
+    # Refund the unused usdl_quantity
+    unused_usdl_quantity = usdl_quantity - spent_usdl_quantity
+    if unused_usdl_quantity > 0:
+        refundLiquidator(liquidator, account, getCollateralSymbol(collateral_token), unused_usdl_quantity)
+    return spent_usdl_quantity > 0
+
+
+def applyLiquidateTargets(liquidator: UInt160, targets: list, usdl_quantity: int, price_map: dict):
+    """
+    Liquidates the targets in order against the same prices, until the USDL runs out
+    The collateral of each account is taken in its order of preference, for as long as the account stays eligible
+    """
+    accounts: list = []
+    for target in targets:
+        accounts.append(cast(list, target)[0])
+    # The loans are read in a single call, and kept up to date with the repayments below
+    loan_quantities = cast(list, call_contract(getBUSDLScriptHash(), 'loanedBalanceOfBatch', [accounts], CallFlags.READ_ONLY))
+
+    unused_usdl_quantity = usdl_quantity
+    index = 0
+    for target in targets:
+        liquidate_target = cast(list, target)
+        account = cast(UInt160, liquidate_target[0])
+        loan_quantity = cast(int, loan_quantities[index])
+        index += 1
+        for token in cast(list, liquidate_target[1]):
+            if unused_usdl_quantity <= 0 or loan_quantity <= 0:
+                break
+            spent_usdl_quantity = executeLiquidate(liquidator, account, cast(UInt160, token), unused_usdl_quantity, loan_quantity, price_map)
+            unused_usdl_quantity -= spent_usdl_quantity
+            loan_quantity -= spent_usdl_quantity
+
+    # Refund whatever is left once, at the end
+    if unused_usdl_quantity > 0:
+        refundLiquidateTargets(liquidator, unused_usdl_quantity)
+
+
 @public
 def liquidateCallback(url: str, user_data: Any, code: int, result: bytes):
     if not callByOracle():
@@ -552,64 +1277,15 @@ def liquidateCallback(url: str, user_data: Any, code: int, result: bytes):
     # liquidate_quantity is the amount of USDL
     usdl_quantity = cast(int, liquidate_data['usdl_quantity'])
 
-    loan_quantity = cast(int, call_contract(getBUSDLScriptHash(), 'loanedBalanceOf', [account], CallFlags.READ_ONLY))
-    collateral_symbol = cast(str, call_contract(collateral_token, 'symbol', [], CallFlags.READ_ONLY))
-    current_collateral = getCollateralBalance(collateral_token, account)
-
     if code != 0:
+        collateral_symbol = getCollateralSymbol(collateral_token)
         on_liquidate_failure(liquidator, account, collateral_symbol, usdl_quantity, 'Oracle invocation failed')
-        pass
-
-    json_result = cast(dict, json_deserialize(cast(str, result)))
-    usdl_price = cast(int, json_result[USDL])
-    collateral_price = cast(int, json_result[collateral_symbol])
-
-    loan_value = usdl_price * loan_quantity
-    collateral_ltv = computeCollateralLTV(account, json_result)
-    usdl_script_hash = getUSDLScriptHash()
-    
-    # The account isn't eligible for liquidation, so refund the liquidator
-    if collateral_ltv > loan_value:
-        on_liquidate_failure(liquidator, account, collateral_symbol, usdl_quantity, 'collateral loan to value=' + itoa(collateral_ltv) + ' > loan value=' + itoa(loan_value))
-        # Refund the liquidator
-        transfer_success = cast(bool, call_contract(usdl_script_hash, 'transfer', [executing_script_hash, liquidator, usdl_quantity, None]))
-        if not transfer_success:
-            on_liquidate_failure(liquidator, account, collateral_symbol, usdl_quantity, 'failed to refund usdl quantity=' + itoa(usdl_quantity))
+        refundLiquidator(liquidator, account, collateral_symbol, usdl_quantity)
         return
 
-    # The desired quantity of the collateral to be liquidated
-    desired_liquidate_quantity = (usdl_quantity * usdl_price) // collateral_price
-    # The maxiumum quantity of the collateral allowed to be liquidated
-    max_liquidate_quantity = (current_collateral * getMaxLiquidationRatio(collateral_token)) // BASIS_POINTS
-    clipped_liquidate_quantity = min(desired_liquidate_quantity, max_liquidate_quantity)
-    total_liquidate_quantity = ((getLiquidationPenalty(collateral_token) + BASIS_POINTS) * clipped_liquidate_quantity) // BASIS_POINTS
-    clipped_usdl_quantity = (clipped_liquidate_quantity * collateral_price) // usdl_price
-    unused_usdl_quantity = usdl_quantity - clipped_usdl_quantity
-
-    if total_liquidate_quantity > 0:
-        # Update the collateral balance
-        updateCollateralBalance(collateral_token, account, current_collateral - total_liquidate_quantity)
-        # Make a repayment with the incoming USDL
-        transfer_success = cast(bool, call_contract(usdl_script_hash, 'transfer', [executing_script_hash, getBUSDLScriptHash(), clipped_usdl_quantity, ['ACTION_REPAYMENT', account]]))
-        if not transfer_success:
-            on_liquidate_failure(liquidator, account, collateral_symbol, usdl_quantity, 'failed to repay usdl quantity=' + itoa(clipped_usdl_quantity))
-            updateCollateralBalance(collateral_token, account, current_collateral)
-            return
-        # Pay out the liquidated collateral
-        transfer_success = cast(bool, call_contract(collateral_token, 'transfer', [executing_script_hash, liquidator, total_liquidate_quantity, None]))
-        if not transfer_success:
-            on_liquidate_failure(liquidator, account, collateral_symbol, usdl_quantity, 'failed to transfer liquidated collateral=' + itoa(total_liquidate_quantity))
-            updateCollateralBalance(collateral_token, account, current_collateral)
-            return
-        # Refund the unused usdl_quantity
-        if unused_usdl_quantity > 0:
-            transfer_success = cast(bool, call_contract(usdl_script_hash, 'transfer', [executing_script_hash, liquidator, unused_usdl_quantity, None]))
-            if not transfer_success:
-                on_liquidate_failure(liquidator, account, collateral_symbol, usdl_quantity, 'failed to repay unused usdl quantity=' + itoa(unused_usdl_quantity))
-        on_liquidate(liquidator, account, collateral_symbol, clipped_usdl_quantity, total_liquidate_quantity)
-    else:
-        on_liquidate_failure(liquidator, account, collateral_symbol, usdl_quantity, 'total liquidate quantity = 0')
-        
+    updatePriceSnapshot(result)
+    json_result = cast(dict, json_deserialize(cast(str, result)))
+    applyLiquidate(liquidator, account, collateral_token, usdl_quantity, json_result)
 
 
 def liquidate(liquidator: UInt160, account: UInt160, collateral_token: UInt160, usdl_quantity: int):
@@ -618,6 +1294,11 @@ def liquidate(liquidator: UInt160, account: UInt160, collateral_token: UInt160,
     assert validate_address(collateral_token), 'collateral_token must be a valid 20 byte UInt160'
     assert usdl_quantity >= 0, 'quantity must be a non-negative integer'
 
+    price_map = getFreshPrices()
+    if len(price_map) > 0:
+        applyLiquidate(liquidator, account, collateral_token, usdl_quantity, price_map)
+        return
+
     # Currently, we don't have any plans to support any loans other than USDL
     # For Polaris, we also don't have any plans to support any other collateral asset
     liquidate_data = {
@@ -629,6 +1310,238 @@ def liquidate(liquidator: UInt160, account: UInt160, collateral_token: UInt160,
     Oracle.request(PRICE_URL, None, 'liquidateCallback', liquidate_data, getOracleFee())
 
 
+def putBatchRequest(request_type: str, liquidator: UInt160, request_data: list, usdl_quantity: int) -> int:
+    """
+    Keeps the data of a request in storage until its Oracle callback, since the Oracle limits the size of its user data
+    The height of the request is kept too, so that the USDL it holds can be reclaimed once it expires
+
+    :param request_type: ACTION_BATCH for the actions of requestBatch, or ACTION_LIQUIDATE for the targets of liquidateTargets
+    :return: the id of the request, to be passed as the user data
+    """
+    request_id = get(BATCH_REQUEST_ID_KEY).to_int() + 1
+    put(BATCH_REQUEST_ID_KEY, request_id)
+    request = [request_type, liquidator, request_data, usdl_quantity, current_index]
+    get_context().create_map(BATCH_REQUEST_KEY).put(itoa(request_id), serialize(request))
+    on_batch_request(request_id, liquidator, usdl_quantity)
+    return request_id
+
+
+def popBatchRequest(user_data: Any) -> list:
+    """
+    :return: [ request_type, liquidator, request_data, usdl_quantity, request_height ]
+    """
+    request_id = itoa(cast(int, user_data))
+    request_map = get_context().create_map(BATCH_REQUEST_KEY)
+    serialized_request = request_map.get(request_id)
+    assert len(serialized_request) > 0, 'request not found'
+    request_map.delete(request_id)
+    return cast(list, deserialize(serialized_request))
+
+
+def failBatchRequest(request: list, failure_reason: str):
+    """
+    Notifies the failure of every action or target of a request, and refunds the USDL it holds
+    """
+    request_type = cast(str, request[0])
+    liquidator = cast(UInt160, request[1])
+    request_data = cast(list, request[2])
+    if request_type == ACTION_BATCH:
+        for action in request_data:
+            failBatchAction(liquidator, cast(list, action), failure_reason)
+    elif request_type == ACTION_LIQUIDATE:
+        # Each target is notified with its preferred collateral, and the USDL of the whole request,
+        # which is refunded once, is notified once with the first target
+        usdl_quantity = cast(int, request[3])
+        notified_usdl_quantity = usdl_quantity
+        for target in request_data:
+            liquidate_target = cast(list, target)
+            collateral_token = cast(UInt160, cast(list, liquidate_target[1])[0])
+            on_liquidate_failure(liquidator, cast(UInt160, liquidate_target[0]), getCollateralSymbol(collateral_token), notified_usdl_quantity, failure_reason)
+            notified_usdl_quantity = 0
+        refundLiquidateTargets(liquidator, usdl_quantity)
+
+
+@public
+def reclaimRequest(request_id: int) -> bool:
+    """
+    Fails a batch or liquidation request whose Oracle callback hasn't come within REQUEST_EXPIRY blocks,
+    and refunds the USDL it holds to its liquidator. A callback which comes afterwards is rejected.
+
+    :return: whether the request was reclaimed
+    """
+    request_map = get_context().create_map(BATCH_REQUEST_KEY)
+    serialized_request = request_map.get(itoa(request_id))
+    if len(serialized_request) == 0:
+        return False
+
+    request = cast(list, deserialize(serialized_request))
+    if current_index < cast(int, request[4]) + REQUEST_EXPIRY:
+        return False
+
+    request_map.delete(itoa(request_id))
+    failBatchRequest(request, 'Oracle request expired')
+    return True
+
+
+@public
+def liquidateTargetsCallback(url: str, user_data: Any, code: int, result: bytes):
+    if not callByOracle():
+        abort()
+
+    request = popBatchRequest(user_data)
+    liquidator = cast(UInt160, request[1])
+    targets = cast(list, request[2])
+    usdl_quantity = cast(int, request[3])
+
+    if code != 0:
+        failBatchRequest(request, 'Oracle invocation failed')
+        return
+
+    updatePriceSnapshot(result)
+    json_result = cast(dict, json_deserialize(cast(str, result)))
+    applyLiquidateTargets(liquidator, targets, usdl_quantity, json_result)
+
+
+def liquidateTargets(liquidator: UInt160, targets: list, usdl_quantity: int):
+    """
+    Validates the targets and requests a single price feed for all of them,
+    unless the last price feed is fresh enough to liquidate them right away
+
+    :param targets: [ [ account, [ collateral_token, ... ] ], ... ], where each account appears once
+    """
+    assert validate_address(liquidator), 'account must be a valid 20 byte UInt160'
+    assert usdl_quantity > 0, 'quantity must be a positive integer'
+    assert len(targets) > 0, 'targets must not be empty'
+
+    # applyLiquidateTargets reads the loan of each account once, so an account can't be targeted twice
+    target_accounts: dict = {}
+    pair_count = 0
+    for target in targets:
+        liquidate_target = cast(list, target)
+        assert len(liquidate_target) == 2, 'target must be [ account, [ collateral_token, ... ] ]'
+        account = cast(UInt160, liquidate_target[0])
+        assert validate_address(account), 'account must be a valid 20 byte UInt160'
+        assert account not in target_accounts, 'targets must not repeat an account'
+        target_accounts[account] = True
+        collateral_tokens = cast(list, liquidate_target[1])
+        assert len(collateral_tokens) > 0, 'collateral tokens must not be empty'
+        for token in collateral_tokens:
+            assert validate_address(cast(UInt160, token)), 'collateral_token must be a valid 20 byte UInt160'
+        pair_count += len(collateral_tokens)
+    assert pair_count <= MAX_LIQUIDATE_PAIRS, 'targets must not contain more than MAX_LIQUIDATE_PAIRS collateral tokens'
+
+    price_map = getFreshPrices()
+    if len(price_map) > 0:
+        applyLiquidateTargets(liquidator, targets, usdl_quantity, price_map)
+        return
+
+    request_id = putBatchRequest(ACTION_LIQUIDATE, liquidator, targets, usdl_quantity)
+    Oracle.request(PRICE_URL, None, 'liquidateTargetsCallback', request_id, getOracleFee() + CALLBACK_ACTION_GAS * pair_count)
+
+
+def applyBatch(liquidator: UInt160, actions: list, price_map: dict):
+    # Every action is applied in order against the same prices
+    for action in actions:
+        batch_action = cast(list, action)
+        action_type = cast(str, batch_action[0])
+        account = cast(UInt160, batch_action[1])
+        token = cast(UInt160, batch_action[2])
+        quantity = cast(int, batch_action[3])
+        if action_type == ACTION_LOAN:
+            applyLoan(account, token, quantity, price_map)
+        elif action_type == ACTION_WITHDRAW:
+            applyWithdrawCollateral(account, token, quantity, price_map)
+        elif action_type == ACTION_LIQUIDATE:
+            applyLiquidate(liquidator, account, token, quantity, price_map)
+
+
+def failBatchAction(liquidator: UInt160, batch_action: list, failure_reason: str):
+    action_type = cast(str, batch_action[0])
+    account = cast(UInt160, batch_action[1])
+    token = cast(UInt160, batch_action[2])
+    quantity = cast(int, batch_action[3])
+    if action_type == ACTION_LOAN:
+        on_loan_failure(account, getLoanSymbol(token), quantity, failure_reason)
+    elif action_type == ACTION_WITHDRAW:
+        on_collateral_withdraw_failure(account, getCollateralSymbol(token), quantity, failure_reason)
+    elif action_type == ACTION_LIQUIDATE:
+        collateral_symbol = getCollateralSymbol(token)
+        on_liquidate_failure(liquidator, account, collateral_symbol, quantity, failure_reason)
+        refundLiquidator(liquidator, account, collateral_symbol, quantity)
+
+
+@public
+def batchCallback(url: str, user_data: Any, code: int, result: bytes):
+    if not callByOracle():
+        abort()
+
+    request = popBatchRequest(user_data)
+    liquidator = cast(UInt160, request[1])
+    actions = cast(list, request[2])
+
+    if code != 0:
+        failBatchRequest(request, 'Oracle invocation failed')
+        return
+
+    updatePriceSnapshot(result)
+    json_result = cast(dict, json_deserialize(cast(str, result)))
+    applyBatch(liquidator, actions, json_result)
+
+
+def requestBatch(liquidator: UInt160, actions: list, usdl_quantity: int):
+    """
+    Validates the actions and requests a single price feed for all of them,
+    unless the last price feed is fresh enough to apply them right away.
+
+    The actions are kept in storage until the callback, since the Oracle limits the size of its user data.
+    The callback is given getOracleFee() of GAS, plus CALLBACK_ACTION_GAS for each action it applies.
+    """
+    assert len(actions) > 0, 'actions must not be empty'
+    assert len(actions) <= MAX_BATCH_SIZE, 'actions must not contain more than MAX_BATCH_SIZE actions'
+
+    liquidate_quantity = 0
+    for action in actions:
+        batch_action = cast(list, action)
+        assert len(batch_action) == 4, 'action must be [ action_type, account, token, quantity ]'
+        action_type = cast(str, batch_action[0])
+        assert validate_address(cast(UInt160, batch_action[1])), 'account must be a valid 20 byte UInt160'
+        assert validate_address(cast(UInt160, batch_action[2])), 'token must be a valid 20 byte UInt160'
+        quantity = cast(int, batch_action[3])
+        assert quantity >= 0, 'quantity must be a non-negative integer'
+        if action_type == ACTION_LIQUIDATE:
+            # The collateral and the refunds of a liquidation go to the liquidator who sent the USDL
+            assert validate_address(liquidator), 'liquidations must be sent as USDL transfers with ACTION_BATCH'
+            assert quantity > 0, 'liquidation quantity must be a positive integer'
+            liquidate_quantity += quantity
+        elif action_type != ACTION_LOAN and action_type != ACTION_WITHDRAW:
+            abort()
+
+    # Liquidations are paid for by the USDL that came with the batch
+    assert liquidate_quantity == usdl_quantity, 'usdl_quantity must equal the total liquidation quantity'
+
+    price_map = getFreshPrices()
+    if len(price_map) > 0:
+        applyBatch(liquidator, actions, price_map)
+        return
+
+    request_id = putBatchRequest(ACTION_BATCH, liquidator, actions, usdl_quantity)
+    Oracle.request(PRICE_URL, None, 'batchCallback', request_id, getOracleFee() + CALLBACK_ACTION_GAS * len(actions))
+
+
+@public
+def batch(actions: list):
+    """
+    Applies several loans and collateral withdrawals, possibly for several accounts,
+    with a single Oracle request.
+
+    actions = [ [ action_type: string, account: UInt160, token: UInt160, quantity: int ], ... ]
+    where action_type is ACTION_LOAN or ACTION_WITHDRAW.
+    Batches with liquidations are sent as USDL transfers with [ ACTION_BATCH, actions ],
+    so requestBatch rejects them here, where there is no liquidator.
+    """
+    requestBatch(UInt160(), actions, 0)
+
+
 @public
 def onNEP17Payment(from_address: UInt160, amount: int, data: Any):
     """
@@ -651,9 +1564,18 @@ def onNEP17Payment(from_address: UInt160, amount: int, data: Any):
     elif action_type == ACTION_LIQUIDATE:
         if calling_script_hash != getUSDLScriptHash():
             abort()
-        liquidate_address = cast(UInt160, transfer_data[1])
-        collateral_token = cast(UInt160, transfer_data[2])
-        liquidate(from_address, liquidate_address, collateral_token, amount)
+        # data = [ ACTION_LIQUIDATE, [ [ account, [ collateral_token, ... ] ], ... ] ] liquidates several targets with the same USDL
+        if isinstance(transfer_data[1], list):
+            liquidateTargets(from_address, cast(list, transfer_data[1]), amount)
+        else:
+            liquidate_address = cast(UInt160, transfer_data[1])
+            collateral_token = cast(UInt160, transfer_data[2])
+            liquidate(from_address, liquidate_address, collateral_token, amount)
+    elif action_type == ACTION_BATCH:
+        if calling_script_hash != getUSDLScriptHash():
+            abort()
+        actions = cast(list, transfer_data[1])
+        requestBatch(from_address, actions, amount)
     else:
         abort()
 
@@ -669,11 +1591,22 @@ def _deploy(data: Any, update: bool):
     :return: whether the deploy was successful. This method must return True only during the smart contract's deploy.
     """
     if update:
+        storage_version = get(STORAGE_VERSION_KEY).to_int()
+        if storage_version < 1:
+            migrateStorage()
+            # The index is derived from the collateral balances, so it is only rebuilt when their layout changes
+            rebuildCollateralIndex()
+            put(AUCTION_PENALTY_FLOOR_KEY, INITIAL_AUCTION_PENALTY_FLOOR)
+            put(STORAGE_VERSION_KEY, STORAGE_VERSION)
         return
 
     tx = cast(Transaction, script_container)
+    put(STORAGE_VERSION_KEY, STORAGE_VERSION)
     put(OWNER_KEY, tx.sender)
     put(ORACLE_FEE_KEY, INITIAL_ORACLE_FEE)
+    put(PRICE_FRESHNESS_KEY, INITIAL_PRICE_FRESHNESS)
+    put(AUCTION_DURATION_KEY, INITIAL_AUCTION_DURATION)
+    put(AUCTION_PENALTY_FLOOR_KEY, INITIAL_AUCTION_PENALTY_FLOOR)
     put(ORACLE_SCRIPT_HASH_KEY, ORACLE_SCRIPT_HASH)
     
 
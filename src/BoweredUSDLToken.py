@@ -5,8 +5,8 @@ from boa3.builtin.contract import Nep17TransferEvent, abort
 from boa3.builtin.interop.blockchain import current_index, get_contract, Transaction
 from boa3.builtin.interop.contract import call_contract, destroy_contract, update_contract
 from boa3.builtin.interop.runtime import calling_script_hash, check_witness, script_container, executing_script_hash
-from boa3.builtin.interop.stdlib import base64_encode, base64_decode, itoa
-from boa3.builtin.interop.storage import find, get, put, get_context, get_read_only_context
+from boa3.builtin.interop.stdlib import base64_decode, itoa
+from boa3.builtin.interop.storage import delete, find, get, put, get_context, get_read_only_context
 from boa3.builtin.type import UInt160
 from typing import cast
 
@@ -28,6 +28,15 @@ def manifest_metadata() -> NeoMetadata:
     return meta
 
 
+# -------------------------------------------
+# STORAGE SETTINGS
+# -------------------------------------------
+
+# The maps keyed by account use a single byte prefix followed by the raw 20 byte script hash
+# The layout version is bumped whenever _deploy needs to migrate existing storage on update
+STORAGE_VERSION_KEY = 'sv'
+STORAGE_VERSION = 1
+
 # -------------------------------------------
 # SAFETY SETTINGS
 # -------------------------------------------
@@ -40,14 +49,27 @@ NEST_SCRIPT_HASH_KEY = 'nest'
 
 OWNER_KEY = 'or'
 SUPPLY_KEY = 'ts'
-BALANCE_KEY = 'bl/'
-LOAN_KEY = 'ln/'
+BALANCE_KEY = b'\x01'
+LOAN_KEY = b'\x02'
 MINTED_KEY = 'mt'
 BURNED_KEY = 'bn'
-NUM_ACCOUNTS_KEY = 'na'
 UNDERLYING_SCRIPT_HASH_KEY = 'uh'
 UNDERLYING_SUPPLY_KEY = 'us'
 LOANED_SUPPLY_KEY = 'ls'
+# The index of accounts with a non-zero balance, for pagination
+# HOLDER_KEY maps a position to an account and HOLDER_POSITION_KEY maps an account to its position + 1
+# An account keeps its position once it is assigned, even while its balance is zero, so positions never move
+HOLDER_KEY = b'\x03'
+HOLDER_POSITION_KEY = b'\x04'
+# The number of accounts with a non-zero balance, and the number of positions assigned so far
+NUM_HOLDERS_KEY = 'nh'
+NUM_HOLDER_POSITIONS_KEY = 'hp'
+# The prefixes of the maps before STORAGE_VERSION 1, which were keyed by base64 encoded script hashes
+LEGACY_BALANCE_KEY = 'bl/'
+LEGACY_LOAN_KEY = 'ln/'
+# The number of accounts before STORAGE_VERSION 1, which was only maintained by transfer
+# numAccounts is now the size of the holder index
+LEGACY_NUM_ACCOUNTS_KEY = 'na'
 
 # Symbol of the Token
 TOKEN_SYMBOL = 'bUSDL'
@@ -71,6 +93,9 @@ BLOCKS_PER_YEAR = 4 * 60 * 24 * 365
 # Initial Supply
 TOKEN_INITIAL_SUPPLY = 0 * TOKEN_MULT
 
+# The maximum number of accounts read by balanceOfBatch and loanedBalanceOfBatch
+MAX_BATCH_ACCOUNTS = 512
+
 # Actions
 ACTION_MINT = 'ACTION_MINT'
 ACTION_DEPOSIT = 'ACTION_DEPOSIT'
@@ -92,6 +117,21 @@ INITIAL_INTEREST_MULTIPLIER = FLOAT_MULTIPLIER
 # for a B-asset was updated
 LAST_HEIGHT_KEY = 'lh'
 
+# The annual interest rate follows a kinked utilization curve, expressed in basis points
+# Below the optimal utilization, the rate rises from the base rate by up to RATE_SLOPE_1
+# Above it, the rate rises further by up to RATE_SLOPE_2 at 100% utilization
+BASE_RATE_KEY = 'rb'
+RATE_SLOPE_1_KEY = 'r1'
+RATE_SLOPE_2_KEY = 'r2'
+OPTIMAL_UTILIZATION_KEY = 'ru'
+# The rate in effect since the last height, which is re-evaluated whenever the supplies change
+CURRENT_RATE_KEY = 'rc'
+# Initially, a flat 100% APR
+INITIAL_BASE_RATE = 10_000
+INITIAL_RATE_SLOPE_1 = 0
+INITIAL_RATE_SLOPE_2 = 0
+INITIAL_OPTIMAL_UTILIZATION = 8_000
+
 
 # -------------------------------------------
 # Events
@@ -186,14 +226,13 @@ def validate_address(address: UInt160) -> bool:
 
 
 # This takes a FLOAT quantity and returns an INT quantity
-def getScaledQuantity(quantity: int) -> int:
-    interest_multiplier = getInterestMultiplier()
+# The interest multiplier is passed in so that it is computed once per invocation
+def getScaledQuantity(quantity: int, interest_multiplier: int) -> int:
     return (quantity * interest_multiplier) // (FLOAT_MULTIPLIER * FLOAT_MULTIPLIER)
 
 
 # This takes an INT quantity and returns FLOAT quantity
-def getUnscaledQuantity(quantity: int) -> int:
-    interest_multiplier = getInterestMultiplier()
+def getUnscaledQuantity(quantity: int, interest_multiplier: int) -> int:
     return (quantity * FLOAT_MULTIPLIER * FLOAT_MULTIPLIER) // interest_multiplier
 
 
@@ -265,7 +304,13 @@ def getInterestMultiplier() -> int:
     unscaled_interest_multiplier = get(INTEREST_MULTIPLIER_KEY).to_int()
     last_height = getLastHeight()
     new_height = current_index
-    diff_height = new_height - last_height
+    # Interest was already accrued in this block
+    if new_height == last_height:
+        return unscaled_interest_multiplier
+    return computeInterestMultiplier(unscaled_interest_multiplier, new_height - last_height)
+
+
+def computeInterestMultiplier(unscaled_interest_multiplier: int, diff_height: int) -> int:
     annual_rate = getR0()
     interest_accrued = (FLOAT_MULTIPLIER * diff_height * annual_rate) // (BLOCKS_PER_YEAR * BASIS_POINTS)
     return ((FLOAT_MULTIPLIER + interest_accrued) * unscaled_interest_multiplier) // FLOAT_MULTIPLIER
@@ -277,7 +322,7 @@ def setInterestMultiplier(interest_multiplier: int):
 
 @public
 def getLoanedSupply() -> int:
-    return getScaledQuantity(get(LOANED_SUPPLY_KEY).to_int())
+    return getScaledQuantity(get(LOANED_SUPPLY_KEY).to_int(), getInterestMultiplier())
 
 
 # LOANED_SUPPLY_KEY keeps track of the
@@ -296,9 +341,10 @@ def totalBurned() -> int:
     return get(BURNED_KEY).to_int()
 
 
+# The number of accounts with a non-zero balance
 @public
 def numAccounts() -> int:
-    return get(NUM_ACCOUNTS_KEY).to_int()
+    return numHolders()
 
 
 @public
@@ -310,39 +356,142 @@ def setLastHeight(last_height: int):
     put(LAST_HEIGHT_KEY, last_height)
 
 
-# TODO: make this settable
-# 100% APR!
+# The current annual interest rate, in basis points
 @public
 def getR0() -> int:
-    return 10_000
+    return get(CURRENT_RATE_KEY).to_int()
+
+
+@public
+def getInterestRateModel() -> list:
+    """
+    :return: [base_rate, rate_slope_1, rate_slope_2, optimal_utilization], all in basis points
+    """
+    return [
+        get(BASE_RATE_KEY).to_int(),
+        get(RATE_SLOPE_1_KEY).to_int(),
+        get(RATE_SLOPE_2_KEY).to_int(),
+        get(OPTIMAL_UTILIZATION_KEY).to_int(),
+    ]
+
+
+@public
+def setInterestRateModel(base_rate: int, rate_slope_1: int, rate_slope_2: int, optimal_utilization: int) -> bool:
+    assert base_rate >= 0, 'base_rate must be a non-negative integer'
+    assert rate_slope_1 >= 0, 'rate_slope_1 must be a non-negative integer'
+    assert rate_slope_2 >= 0, 'rate_slope_2 must be a non-negative integer'
+    assert optimal_utilization > 0 and optimal_utilization <= BASIS_POINTS, 'optimal_utilization must be a positive integer <= BASIS_POINTS'
+    if not verify():
+        abort()
+
+    # Interest up to this height is charged at the previous rate
+    interest_multiplier = accrueInterest()
+    put(BASE_RATE_KEY, base_rate)
+    put(RATE_SLOPE_1_KEY, rate_slope_1)
+    put(RATE_SLOPE_2_KEY, rate_slope_2)
+    put(OPTIMAL_UTILIZATION_KEY, optimal_utilization)
+    updateInterestRate(interest_multiplier)
+    return True
+
+
+# The share of the USDL supply that is loaned out, in basis points
+@public
+def getUtilization() -> int:
+    return computeUtilization(getInterestMultiplier())
+
+
+def computeUtilization(interest_multiplier: int) -> int:
+    usdl_loans = getScaledQuantity(get(LOANED_SUPPLY_KEY).to_int(), interest_multiplier)
+    usdl_total = getUnderlyingSupply() + usdl_loans
+    if usdl_total == 0:
+        return 0
+    return (usdl_loans * BASIS_POINTS) // usdl_total
+
+
+def updateInterestRate(interest_multiplier: int):
+    """
+    Evaluates the rate curve at the current utilization.
+    This is called once the supplies have changed, and the rate applies until the next accrual.
+    """
+    utilization = computeUtilization(interest_multiplier)
+    base_rate = get(BASE_RATE_KEY).to_int()
+    rate_slope_1 = get(RATE_SLOPE_1_KEY).to_int()
+    optimal_utilization = get(OPTIMAL_UTILIZATION_KEY).to_int()
+
+    if utilization <= optimal_utilization:
+        annual_rate = base_rate + (rate_slope_1 * utilization) // optimal_utilization
+    else:
+        rate_slope_2 = get(RATE_SLOPE_2_KEY).to_int()
+        excess_utilization = utilization - optimal_utilization
+        annual_rate = base_rate + rate_slope_1 + (rate_slope_2 * excess_utilization) // (BASIS_POINTS - optimal_utilization)
+    put(CURRENT_RATE_KEY, annual_rate)
+
+
+def initializeInterestRateModel():
+    put(BASE_RATE_KEY, INITIAL_BASE_RATE)
+    put(RATE_SLOPE_1_KEY, INITIAL_RATE_SLOPE_1)
+    put(RATE_SLOPE_2_KEY, INITIAL_RATE_SLOPE_2)
+    put(OPTIMAL_UTILIZATION_KEY, INITIAL_OPTIMAL_UTILIZATION)
+    put(CURRENT_RATE_KEY, INITIAL_BASE_RATE)
 
 
 @public
 def balanceOf(account: UInt160) -> int:
     assert validate_address(account), 'account must be a valid 20 byte UInt160'
-    account64 = base64_encode(account)
-    return get_read_only_context().create_map(BALANCE_KEY).get(account64).to_int()
+    return get_read_only_context().create_map(BALANCE_KEY).get(account).to_int()
 
 
 @public
 def loanedBalanceOf(account: UInt160) -> int:
     assert validate_address(account), 'account must be a valid 20 byte UInt160'
-    account64 = base64_encode(account)
-    unscaled_quantity = get_read_only_context().create_map(LOAN_KEY).get(account64).to_int()
-    return getScaledQuantity(unscaled_quantity)
+    unscaled_quantity = get_read_only_context().create_map(LOAN_KEY).get(account).to_int()
+    return getScaledQuantity(unscaled_quantity, getInterestMultiplier())
+
+
+@public
+def balanceOfBatch(accounts: List[UInt160]) -> list:
+    """
+    Get the balances of several accounts in one invocation
+
+    :return: the balance of each account, in the same order
+    """
+    assert len(accounts) <= MAX_BATCH_ACCOUNTS, 'accounts must not contain more than MAX_BATCH_ACCOUNTS accounts'
+    balance_map = get_read_only_context().create_map(BALANCE_KEY)
+    ret = []
+    for account in accounts:
+        assert validate_address(account), 'account must be a valid 20 byte UInt160'
+        ret.append(balance_map.get(account).to_int())
+    return ret
+
+
+@public
+def loanedBalanceOfBatch(accounts: List[UInt160]) -> list:
+    """
+    Get the loaned balances of several accounts in one invocation
+    The interest multiplier is computed once for the whole batch
+
+    :return: the loaned balance of each account, in the same order
+    """
+    assert len(accounts) <= MAX_BATCH_ACCOUNTS, 'accounts must not contain more than MAX_BATCH_ACCOUNTS accounts'
+    interest_multiplier = getInterestMultiplier()
+    loan_map = get_read_only_context().create_map(LOAN_KEY)
+    ret = []
+    for account in accounts:
+        assert validate_address(account), 'account must be a valid 20 byte UInt160'
+        ret.append(getScaledQuantity(loan_map.get(account).to_int(), interest_multiplier))
+    return ret
 
 
 def updateLoanedBalanceOf(account: UInt160, quantity: int):
     assert validate_address(account), 'account must be a valid 20 byte UInt160'
 
     loan_context = get_context().create_map(LOAN_KEY)
-    account64 = base64_encode(account)
-    existing_loan = loan_context.get(account64).to_int()
+    existing_loan = loan_context.get(account).to_int()
     new_loan = existing_loan + quantity
 
     assert new_loan >= 0, 'update must not make loan quantity negative'
 
-    loan_context.put(account64, new_loan)
+    loan_context.put(account, new_loan)
 
 
 @public
@@ -363,16 +512,140 @@ def getBalances(page_num: int, page_size: int) -> List[UInt160, int]:
         if offset > 0:
             offset -= 1
         else:
-            account64 = cast(str, balances.value[0])[len(BALANCE_KEY):]
-            account = UInt160(base64_decode(account64))
+            account = UInt160(cast(bytes, balances.value[0])[len(BALANCE_KEY):])
             quantity = cast(bytes, balances.value[1]).to_int()
-            if quantity > 0:
-                ret.append((UInt160(account), quantity))
+            ret.append((account, quantity))
             if len(ret) >= page_size:
                 return ret
     return ret
 
 
+@public
+def getBalancesFrom(cursor: int, page_size: int) -> list:
+    """
+    Get pairs of [account, balance] of currently held BUSDL tokens, starting at a cursor
+    Unlike getBalances, this reads the holder index directly at the cursor,
+    so every page costs the same regardless of how deep it is
+
+    Holders never move between positions, so a pass over every page returns each account
+    that held a balance throughout the pass exactly once, however balances change in between
+    The positions of emptied balances are skipped, so a page may hold fewer than page_size holders
+
+    :return: [next_cursor, [[account, balance], ...]], where next_cursor is -1 once every position was read
+    """
+    num_positions = get(NUM_HOLDER_POSITIONS_KEY).to_int()
+    assert cursor >= 0 and cursor <= num_positions, 'cursor must be a position in the holder index'
+    assert page_size > 0 and page_size <= 512, 'page_size must be a positive integer <= 512'
+
+    holder_map = get_read_only_context().create_map(HOLDER_KEY)
+    balance_map = get_read_only_context().create_map(BALANCE_KEY)
+    end = min(cursor + page_size, num_positions)
+    ret = []
+    position = cursor
+    while position < end:
+        account = UInt160(holder_map.get(itoa(position)))
+        quantity = balance_map.get(account).to_int()
+        if quantity > 0:
+            ret.append([account, quantity])
+        position += 1
+
+    next_cursor = end
+    if next_cursor >= num_positions:
+        next_cursor = -1
+    return [next_cursor, ret]
+
+
+@public
+def numHolders() -> int:
+    return get(NUM_HOLDERS_KEY).to_int()
+
+
+def updateBalance(account: UInt160, quantity: int):
+    """
+    Adds quantity to the balance of an account
+    Every balance change goes through here, so that zero balances are deleted
+    and the holder index, and with it numAccounts, follows every account whose balance becomes non-zero or zero
+    """
+    balance_map = get_context().create_map(BALANCE_KEY)
+    previous_balance = balance_map.get(account).to_int()
+    new_balance = previous_balance + quantity
+
+    assert new_balance >= 0, 'update must not make balance negative'
+
+    if new_balance == 0:
+        balance_map.delete(account)
+    else:
+        balance_map.put(account, new_balance)
+    updateHolders(account, previous_balance, new_balance)
+
+
+def updateHolders(account: UInt160, previous_balance: int, new_balance: int):
+    """
+    Adds or removes an account from the holder index when its balance becomes non-zero or zero
+    """
+    if previous_balance == 0 and new_balance > 0:
+        addHolder(account)
+    elif previous_balance > 0 and new_balance == 0:
+        removeHolder(account)
+
+
+def addHolder(account: UInt160):
+    """
+    Counts a holder whose balance became non-zero, and assigns it the next position the first time
+    """
+    position_map = get_context().create_map(HOLDER_POSITION_KEY)
+    if position_map.get(account).to_int() == 0:
+        num_positions = get(NUM_HOLDER_POSITIONS_KEY).to_int()
+        get_context().create_map(HOLDER_KEY).put(itoa(num_positions), account)
+        position_map.put(account, num_positions + 1)
+        put(NUM_HOLDER_POSITIONS_KEY, num_positions + 1)
+    put(NUM_HOLDERS_KEY, numHolders() + 1)
+
+
+def removeHolder(account: UInt160):
+    """
+    Uncounts a holder whose balance became zero, which keeps its position for when it holds a balance again
+    """
+    put(NUM_HOLDERS_KEY, numHolders() - 1)
+
+
+def rebuildHolders():
+    """
+    Adds every account with a non-zero balance to the holder index, and deletes zero balances
+    Balances written before STORAGE_VERSION 1 are not in it yet, and burn left zero balances behind
+    """
+    balances = find(BALANCE_KEY)
+    while balances.next():
+        key = cast(bytes, balances.value[0])
+        quantity = cast(bytes, balances.value[1]).to_int()
+        if quantity > 0:
+            addHolder(UInt160(key[len(BALANCE_KEY):]))
+        else:
+            delete(key)
+
+
+def migrateAccountMap(legacy_prefix: str, prefix: bytes):
+    """
+    Rewrites a map keyed by base64 encoded script hashes under the binary prefix
+    """
+    entries = find(legacy_prefix)
+    while entries.next():
+        key = cast(str, entries.value[0])
+        put(prefix + base64_decode(key[len(legacy_prefix):]), cast(bytes, entries.value[1]))
+        delete(key)
+
+
+def migrateStorage():
+    """
+    Moves the storage written before STORAGE_VERSION 1 to the binary key layout.
+    The holder index didn't exist then, so it is built from the migrated balances by _deploy.
+    Every legacy entry is rewritten within the update, so its GAS grows with the number of holders.
+    """
+    migrateAccountMap(LEGACY_BALANCE_KEY, BALANCE_KEY)
+    migrateAccountMap(LEGACY_LOAN_KEY, LOAN_KEY)
+    delete(LEGACY_NUM_ACCOUNTS_KEY)
+
+
 @public
 def transfer(from_address: UInt160, to_address: UInt160, amount: int, data: Any) -> bool:
     """
@@ -396,13 +669,8 @@ def transfer(from_address: UInt160, to_address: UInt160, amount: int, data: Any)
     assert validate_address(to_address), 'to_address must be a valid 20 byte UInt160'
     assert amount >= 0, 'transfer amount cannot be negative'
 
-    # Keep track of any changes in the number of active accounts
-    diff_num_accounts = 0
-    balance_map = get_context().create_map(BALANCE_KEY)
-
     # The function MUST return false if the from account balance does not have enough tokens to spend.
-    from_address64 = base64_encode(from_address)
-    from_balance = balance_map.get(from_address64).to_int()
+    from_balance = balanceOf(from_address)
     if from_balance < amount:
         return False
 
@@ -412,26 +680,71 @@ def transfer(from_address: UInt160, to_address: UInt160, amount: int, data: Any)
 
     # skip balance changes if transferring to yourself or transferring 0 cryptocurrency
     if from_address != to_address and amount != 0:
-        if from_balance == amount:
-            balance_map.delete(from_address64)
-            diff_num_accounts -= 1
-        else:
-            balance_map.put(from_address64, from_balance - amount)
-
-        to_address64 = base64_encode(to_address)
-        to_balance = balance_map.get(to_address64).to_int()
-        balance_map.put(to_address64, to_balance + amount)
-        if to_balance == 0:
-            diff_num_accounts += 1
+        updateBalance(from_address, -amount)
+        updateBalance(to_address, amount)
 
     # if the method succeeds, it must fire the transfer event
     on_transfer(from_address, to_address, amount)
     # if the to_address is a smart contract, it must call the contracts onPayment
     post_transfer(from_address, to_address, amount, data)
 
-    # Update the total number of accounts
-    num_accounts = numAccounts()
-    put(NUM_ACCOUNTS_KEY, num_accounts + diff_num_accounts)
+    return True
+
+
+@public
+def transferMany(from_address: UInt160, recipients: list, data: Any) -> bool:
+    """
+    Transfers NEP17 tokens from one account to several recipients
+    The sender is checked and debited once,
+    while every recipient gets its own `Transfer` event and, if it is a contract, its own onNEP17Payment call
+
+    :param from_address: the address to transfer from
+    :type from_address: UInt160
+    :param recipients: [[to_address, amount], ...]
+    :type recipients: list
+    :param data: whatever data is pertinent to the onPayment method of every recipient
+    :type data: Any
+    :return: whether the transfers were successful. None of them is made unless all of them can be
+    :raise AssertionError: raised if an address is invalid, if an amount is less than zero,
+        or if there are more than MAX_BATCH_ACCOUNTS recipients.
+    """
+
+    assert validate_address(from_address), 'from_address must be a valid 20 byte UInt160'
+    assert len(recipients) <= MAX_BATCH_ACCOUNTS, 'recipients must not contain more than MAX_BATCH_ACCOUNTS recipients'
+
+    total_amount = 0
+    for recipient in recipients:
+        to_amount = cast(list, recipient)
+        assert len(to_amount) == 2, 'recipient must be [ to_address, amount ]'
+        assert validate_address(cast(UInt160, to_amount[0])), 'to_address must be a valid 20 byte UInt160'
+        assert cast(int, to_amount[1]) >= 0, 'transfer amount cannot be negative'
+        total_amount += cast(int, to_amount[1])
+
+    from_balance = balanceOf(from_address)
+    if from_balance < total_amount:
+        return False
+
+    if not check_witness(from_address):
+        return False
+
+    # Credit every recipient, then debit the sender once
+    debit_amount = 0
+    for recipient in recipients:
+        to_address = cast(UInt160, cast(list, recipient)[0])
+        amount = cast(int, cast(list, recipient)[1])
+        # skip balance changes if transferring to yourself or transferring 0 cryptocurrency
+        if from_address != to_address and amount != 0:
+            updateBalance(to_address, amount)
+            debit_amount += amount
+
+    if debit_amount > 0:
+        updateBalance(from_address, -debit_amount)
+
+    for recipient in recipients:
+        to_address = cast(UInt160, cast(list, recipient)[0])
+        amount = cast(int, cast(list, recipient)[1])
+        on_transfer(from_address, to_address, amount)
+        post_transfer(from_address, to_address, amount, data)
 
     return True
 
@@ -478,12 +791,10 @@ def mint(account: UInt160, amount: int):
     if amount != 0:
         current_total_supply = totalSupply()
         minted = totalMinted()
-        account_balance = balanceOf(account)
-        account64 = base64_encode(account)
 
         put(SUPPLY_KEY, current_total_supply + amount)
         put(MINTED_KEY, minted + amount)
-        get_context().create_map(BALANCE_KEY).put(account64, account_balance + amount)
+        updateBalance(account, amount)
 
         on_transfer(None, account, amount)
         post_transfer(None, account, amount, [ ACTION_MINT ])
@@ -510,12 +821,10 @@ def burn(account: UInt160, amount: int):
     if amount != 0:
         current_total_supply = totalSupply()
         burned = totalBurned()
-        account_balance = balanceOf(account)
-        account64 = base64_encode(account)
 
         put(SUPPLY_KEY, current_total_supply - amount)
         put(BURNED_KEY, burned + amount)
-        get_context().create_map(BALANCE_KEY).put(account64, account_balance - amount)
+        updateBalance(account, -amount)
 
         on_transfer(None, account, amount)
 
@@ -525,6 +834,10 @@ def burn(account: UInt160, amount: int):
 # If BUSDL supply stays the same and USDL supply + loans doubles, then USDl = 5e7 BUSDL
 @public
 def getExchangeRate() -> int:
+    return computeExchangeRate(getInterestMultiplier())
+
+
+def computeExchangeRate(interest_multiplier: int) -> int:
     # Initially, exchange rate is 1:1 but with differing decimal places
     busdl_supply = totalSupply()
     if busdl_supply == 0:
@@ -532,13 +845,37 @@ def getExchangeRate() -> int:
 
     # If supply already exists, the rate is (USDL supply + USDL loans) / (BUSDL supply)
     usdl_supply = getUnderlyingSupply()
-    usdl_loans = getLoanedSupply()
+    usdl_loans = getScaledQuantity(get(LOANED_SUPPLY_KEY).to_int(), interest_multiplier)
     
     return (EXCHANGE_RATE_MULT * (usdl_supply + usdl_loans)) // busdl_supply
 
 
-# TODO: update interest rate
-def accrueInterest():
+@public
+def getPoolState() -> list:
+    """
+    Get the pool metrics at the current height in a single invocation
+    The interest multiplier is computed once and shared by the loaned supply, exchange rate and utilization
+
+    :return: [total_supply, underlying_supply, loaned_supply, exchange_rate, interest_multiplier, last_height,
+        num_accounts, total_minted, total_burned, annual_rate, utilization]
+    """
+    interest_multiplier = getInterestMultiplier()
+    return [
+        totalSupply(),
+        getUnderlyingSupply(),
+        getScaledQuantity(get(LOANED_SUPPLY_KEY).to_int(), interest_multiplier),
+        computeExchangeRate(interest_multiplier),
+        interest_multiplier,
+        getLastHeight(),
+        numAccounts(),
+        totalMinted(),
+        totalBurned(),
+        getR0(),
+        computeUtilization(interest_multiplier),
+    ]
+
+
+def accrueInterest() -> int:
     """
     We accrue interest whenever the underlying supply or loaned supply changes, so on:
         1. Deposit
@@ -551,32 +888,35 @@ def accrueInterest():
         3. Computing the new interest_factor based on the previous interest_factor
         4. Updating the last height
     This function naturally has the effect of updating the exchange rate
+    The interest is charged at the rate set by updateInterestRate on the previous operation
+
+    :return: the accrued interest multiplier, to be reused for the rest of the invocation
     """
-    last_height = getLastHeight()
-    new_height = current_index
-    diff_height = new_height - last_height
-    annual_rate = getR0()
-    interest_accrued = (FLOAT_MULTIPLIER * diff_height * annual_rate) // (BLOCKS_PER_YEAR * BASIS_POINTS)
     # Note that this is the stored value, not the one that scales with the interest accrued
     # since getInterestMultiplier() returns with unaccumulated interest.
     unscaled_interest_multiplier = get(INTEREST_MULTIPLIER_KEY).to_int()
-    new_interest_multiplier = ((FLOAT_MULTIPLIER + interest_accrued) * unscaled_interest_multiplier) // FLOAT_MULTIPLIER
+    last_height = getLastHeight()
+    new_height = current_index
+    # Interest was already accrued in this block
+    if new_height == last_height:
+        return unscaled_interest_multiplier
 
+    new_interest_multiplier = computeInterestMultiplier(unscaled_interest_multiplier, new_height - last_height)
     setInterestMultiplier(new_interest_multiplier)
     setLastHeight(new_height)
-    pass
+    return new_interest_multiplier
 
 
 def deposit(account: UInt160, deposit_quantity: int):
     assert validate_address(account), 'account must be a valid 20 byte UInt160'
     assert deposit_quantity >= 0, 'deposit_quantity must be a non-negative integer'
 
-    exchange_rate = getExchangeRate()
+    interest_multiplier = accrueInterest()
+    exchange_rate = computeExchangeRate(interest_multiplier)
     mint_quantity = (EXCHANGE_RATE_MULT * deposit_quantity) // exchange_rate
 
     if deposit_quantity != 0:
         updateUnderlyingSupply(deposit_quantity)
-        accrueInterest()
         mint(executing_script_hash, mint_quantity)
         # transfer BUSDL to depositor
         transfer_success = cast(bool, call_contract(executing_script_hash, 'transfer', [executing_script_hash, account, mint_quantity, None]))
@@ -584,6 +924,7 @@ def deposit(account: UInt160, deposit_quantity: int):
             on_deposit_failure(account, deposit_quantity, mint_quantity, 'Failed to transfer BUSDL to depositor')
             abort()
 
+    updateInterestRate(interest_multiplier)
     on_deposit(account, deposit_quantity, mint_quantity)
 
 
@@ -591,7 +932,8 @@ def redeem(account: UInt160, redeem_quantity: int):
     assert validate_address(account), 'account must be a valid 20 byte UInt160'
     assert redeem_quantity >= 0, 'redeem_quantity must be a non-negative integer'
 
-    exchange_rate = getExchangeRate()
+    interest_multiplier = accrueInterest()
+    exchange_rate = computeExchangeRate(interest_multiplier)
     burn_quantity = redeem_quantity
     underlying_redeem_quantity = (redeem_quantity * exchange_rate) // EXCHANGE_RATE_MULT
 
@@ -602,7 +944,6 @@ def redeem(account: UInt160, redeem_quantity: int):
             abort()
 
         updateUnderlyingSupply(-underlying_redeem_quantity)
-        accrueInterest()
         burn(executing_script_hash, burn_quantity)
         # transfer USDL to redeemer
         transfer_success = cast(bool, call_contract(getUnderlyingScriptHash(), 'transfer', [executing_script_hash, account, underlying_redeem_quantity, None]))
@@ -610,6 +951,7 @@ def redeem(account: UInt160, redeem_quantity: int):
             on_redeem_failure(account, underlying_redeem_quantity, redeem_quantity, 'Failed to transfer USDL to redeemer')
             abort()
 
+    updateInterestRate(interest_multiplier)
     on_redeem(account, underlying_redeem_quantity, redeem_quantity)
 
 
@@ -621,7 +963,7 @@ def loan(account: UInt160, loan_quantity: int):
     if not callByNest():
         abort()
 
-    accrueInterest()
+    interest_multiplier = accrueInterest()
     if loan_quantity != 0:
         underlying_supply = getUnderlyingSupply()
         if underlying_supply < loan_quantity:
@@ -630,7 +972,7 @@ def loan(account: UInt160, loan_quantity: int):
 
         updateUnderlyingSupply(-loan_quantity)
 
-        unscaled_loan_quantity = getUnscaledQuantity(loan_quantity)
+        unscaled_loan_quantity = getUnscaledQuantity(loan_quantity, interest_multiplier)
         updateLoanedSupply(unscaled_loan_quantity)
         updateLoanedBalanceOf(account, unscaled_loan_quantity)
 
@@ -639,6 +981,7 @@ def loan(account: UInt160, loan_quantity: int):
             on_loan_failure(account, loan_quantity, 'Failed to transfer USDL to loan')
             abort()
 
+    updateInterestRate(interest_multiplier)
     on_loan(account, loan_quantity)
 
 
@@ -646,17 +989,17 @@ def repayment(payer: UInt160, account: UInt160, repayment_quantity: int):
     assert validate_address(account), 'account must be a valid 20 byte UInt160'
     assert repayment_quantity >= 0, 'repayment_quantity must be a non-negative integer'
 
-    max_repayment_quantity = loanedBalanceOf(account)
+    interest_multiplier = accrueInterest()
+    max_repayment_quantity = getScaledQuantity(get_read_only_context().create_map(LOAN_KEY).get(account).to_int(), interest_multiplier)
     clipped_repayment_quantity = min(max_repayment_quantity, repayment_quantity)
 
-    accrueInterest()
     if repayment_quantity != 0:
-        loaned_supply = getLoanedSupply()
+        loaned_supply = getScaledQuantity(get(LOANED_SUPPLY_KEY).to_int(), interest_multiplier)
         if loaned_supply < clipped_repayment_quantity:
             on_repayment_failure(account, clipped_repayment_quantity, 'Failed to repay USDL because loaned supply=' + itoa(loaned_supply) + ' < clipped repayment quantity=' + itoa(clipped_repayment_quantity))
             abort()
 
-        unscaled_repayment_quantity = getUnscaledQuantity(clipped_repayment_quantity)
+        unscaled_repayment_quantity = getUnscaledQuantity(clipped_repayment_quantity, interest_multiplier)
         updateLoanedSupply(-unscaled_repayment_quantity)
         updateUnderlyingSupply(clipped_repayment_quantity)
         updateLoanedBalanceOf(account, -unscaled_repayment_quantity)
@@ -669,6 +1012,7 @@ def repayment(payer: UInt160, account: UInt160, repayment_quantity: int):
             on_repayment_failure(account, clipped_repayment_quantity, 'Failed to repay overpayment quantity=' + itoa(overpayment_quantity))
             abort()
 
+    updateInterestRate(interest_multiplier)
     on_repayment(account, repayment_quantity)
 
 
@@ -746,20 +1090,26 @@ def _deploy(data: Any, update: bool):
     :return: whether the deploy was successful. This method must return True only during the smart contract's deploy.
     """
     if update:
+        storage_version = get(STORAGE_VERSION_KEY).to_int()
+        if storage_version < 1:
+            migrateStorage()
+            rebuildHolders()
+            initializeInterestRateModel()
+            put(STORAGE_VERSION_KEY, STORAGE_VERSION)
         return
 
     tx = cast(Transaction, script_container)
+    put(STORAGE_VERSION_KEY, STORAGE_VERSION)
     put(OWNER_KEY, tx.sender)
     put(SUPPLY_KEY, TOKEN_INITIAL_SUPPLY)
     put(MINTED_KEY, TOKEN_INITIAL_SUPPLY)
     put(BURNED_KEY, 0)
     put(NEST_SCRIPT_HASH_KEY, UInt160())
-    owner64 = base64_encode(tx.sender)
-    get_context().create_map(BALANCE_KEY).put(owner64, TOKEN_INITIAL_SUPPLY)
-    put(NUM_ACCOUNTS_KEY, 0)
+    updateBalance(tx.sender, TOKEN_INITIAL_SUPPLY)
     put(INTEREST_MULTIPLIER_KEY, INITIAL_INTEREST_MULTIPLIER)
     put(UNDERLYING_SUPPLY_KEY, 0)
     put(LOANED_SUPPLY_KEY, 0)
+    initializeInterestRateModel()
     on_transfer(None, tx.sender, TOKEN_INITIAL_SUPPLY)
 
 
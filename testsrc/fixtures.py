@@ -0,0 +1,191 @@
+"""
+Shared fixtures for the contract test suites.
+
+Compiling and deploying the contracts dominates the run time of the suites, so each contract
+is compiled once per session, keyed by the hash of its source, and each deployment is run once
+on a TestEngine whose state is then cloned into every test that needs it.
+
+The contracts are compiled into a build directory of their own for each pytest-xdist worker,
+so that the suites can run in parallel without overwriting each other's artefacts.
+"""
+import copy
+import hashlib
+import os
+import sys
+from typing import Callable, Dict, List, Tuple
+
+from boa3.boa3 import Boa3
+from boa3.builtin.type import UInt160
+from boa3.neo.contracts.neffile import NefFile
+from boa3.neo.cryptography import hash160
+from boa3_test.tests.boa_test import BoaTest
+from boa3_test.tests.test_classes.testengine import TestEngine
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The keeper, indexer and sim packages are imported from the root of the repository
+if ROOT_DIR not in sys.path:
+    sys.path.append(ROOT_DIR)
+# Set BOWERBIRD_BUILD_DIR to build somewhere other than the build directory of the repository
+BUILD_DIR = os.path.join(os.environ.get('BOWERBIRD_BUILD_DIR', os.path.join(ROOT_DIR, 'build')),
+                         os.environ.get('PYTEST_XDIST_WORKER', 'main'))
+
+# The source hash and script of each compiled contract, keyed by the path of its .nef file
+_compiled_contracts: Dict[str, Tuple[str, bytes]] = {}
+# The engine of each deployment, keyed by name and the source hashes of its contracts
+_engine_snapshots: Dict[Tuple[str, ...], TestEngine] = {}
+
+TOKEN_MULT = int(1e8)
+
+
+def get_source_path(*path: str) -> str:
+    """
+    :return: the path of a contract source, relative to the root of the repository
+    """
+    return os.path.join(ROOT_DIR, *path)
+
+
+def get_source_hash(path: str) -> str:
+    with open(path, 'rb') as source_file:
+        return hashlib.sha256(source_file.read()).hexdigest()
+
+
+def get_nef_path(source_path: str) -> str:
+    if source_path.startswith(ROOT_DIR + os.sep):
+        relative_path = os.path.relpath(source_path, ROOT_DIR)
+    else:
+        relative_path = os.path.basename(source_path)
+    return os.path.join(BUILD_DIR, relative_path.replace('.py', '.nef'))
+
+
+def compile_contract(source_path: str) -> str:
+    """
+    Compiles the contract into the build directory, unless it was already compiled from the same source
+    :return: the path of the .nef file, which can be passed to run_smart_contract
+    """
+    nef_path = get_nef_path(source_path)
+    source_hash = get_source_hash(source_path)
+    compiled_contract = _compiled_contracts.get(nef_path)
+    if compiled_contract is not None and compiled_contract[0] == source_hash:
+        return nef_path
+
+    os.makedirs(os.path.dirname(nef_path), exist_ok=True)
+    Boa3.compile_and_save(source_path, output_path=nef_path)
+    with open(nef_path, 'rb') as nef_file:
+        script = NefFile.deserialize(nef_file.read()).script
+    _compiled_contracts[nef_path] = (source_hash, script)
+    return nef_path
+
+
+def get_contract_path(*path: str) -> str:
+    """
+    Compiles the contract at a path relative to the root of the repository
+    :return: the path of the .nef file
+    """
+    return compile_contract(get_source_path(*path))
+
+
+def get_address(nef_path: str) -> UInt160:
+    return hash160(_compiled_contracts[nef_path][1])
+
+
+def get_engine(name: str, nef_paths: List[str], deploy: Callable[[TestEngine], None]) -> TestEngine:
+    """
+    Runs deploy on a new TestEngine the first time a deployment is requested,
+    or whenever the source of one of its contracts changed
+    :return: a copy of the deployed engine, which the caller is free to modify
+    """
+    snapshot_key = (name,) + tuple(_compiled_contracts[nef_path][0] for nef_path in nef_paths)
+    if snapshot_key not in _engine_snapshots:
+        engine = TestEngine()
+        deploy(engine)
+        _engine_snapshots[snapshot_key] = engine
+    return copy.deepcopy(_engine_snapshots[snapshot_key])
+
+
+class NestTemplate(BoaTest):
+    """
+    Deploys the Nest with bNEO, bUSDL and USDL, for the suites which run against the whole protocol
+    """
+    # Typically, we will set the owner to be the address that deploys the contract. However, the test suite uses a different script hash for the caller.
+    OWNER_SCRIPT_HASH = UInt160(b'\x9c\xa5/\x04"{\xf6Z\xe2\xe5\xd1\xffe\x03\xd1\x9dd\xc2\x9cF')
+    OTHER_SCRIPT_HASH = UInt160(b'\xf7\x82<X\xb5:\xcf\xe8\xb4e\xa67C\xcb}2;..b')
+    ORACLE_SCRIPT_HASH = UInt160(b'X\x87\x17\x11~\n\xa8\x10r\xaf\xabq\xd2\xdd\x89\xfe|K\x92\xfe')
+    LIQUIDATOR_SCRIPT_HASH = UInt160(b'\x4c' * 20)
+
+
+    def get_path(self):
+        return get_contract_path('src', 'BowerbirdNest.py')
+
+
+    def get_bneo_path(self):
+        return get_contract_path('testsrc', 'BurgerNeoToken.py')
+
+
+    def get_busdl_path(self):
+        return get_contract_path('src', 'BoweredUSDLToken.py')
+
+
+    def get_usdl_path(self):
+        return get_contract_path('testsrc', 'LyrebirdUSDToken.py')
+
+
+    def get_address(self, path):
+        return get_address(path)
+
+
+    def deploy(self, engine):
+        path = self.get_path()
+        bneo_path = self.get_bneo_path()
+        busdl_path = self.get_busdl_path()
+        usdl_path = self.get_usdl_path()
+
+        self.run_smart_contract(engine, path, '_deploy', None, False,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        self.run_smart_contract(engine, bneo_path, '_deploy', None, False,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        self.run_smart_contract(engine, busdl_path, '_deploy', None, False,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        self.run_smart_contract(engine, usdl_path, '_deploy', None, False,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+
+        # For testing, we set the Nest script hash to the owner script hash
+        self.run_smart_contract(engine, busdl_path, 'setNestScriptHash', self.OWNER_SCRIPT_HASH,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        self.run_smart_contract(engine, busdl_path, 'setUnderlyingScriptHash', self.get_address(usdl_path),
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+
+
+    def wire(self, engine):
+        path = self.get_path()
+        usdl_path = self.get_usdl_path()
+        busdl_address = self.get_address(self.get_busdl_path())
+
+        self.deploy(engine)
+        self.run_smart_contract(engine, usdl_path, 'transfer', self.OWNER_SCRIPT_HASH, busdl_address,
+                                         1000 * TOKEN_MULT, [ 'ACTION_DEPOSIT' ],
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+
+        self.run_smart_contract(engine, path, 'setBNEOScriptHash', self.get_address(self.get_bneo_path()),
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        self.run_smart_contract(engine, path, 'setBUSDLScriptHash', busdl_address,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        self.run_smart_contract(engine, path, 'setUSDLScriptHash', self.get_address(usdl_path),
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+
+
+    def get_contract_paths(self):
+        return [self.get_path(), self.get_bneo_path(), self.get_busdl_path(), self.get_usdl_path()]
+
+
+    def get_deployed_engine(self):
+        """
+        A copy of an engine where all four contracts are deployed, and bUSDL treats the owner as the Nest
+        """
+        return get_engine('nest.deployed', self.get_contract_paths(), self.deploy)
+
+
+    def get_wired_engine(self):
+        """
+        A copy of a deployed engine where the Nest is wired to bNEO, bUSDL and USDL, and 1000 USDL are deposited
+        """
+        return get_engine('nest.wired', self.get_contract_paths(), self.wire)
@@ -1,39 +1,22 @@
+import base64
+
 from boa3.boa3 import Boa3
-from boa3.builtin.type import UInt160
-from boa3.neo.cryptography import hash160
-from boa3_test.tests.boa_test import BoaTest
 from boa3_test.tests.test_classes.TestExecutionException import TestExecutionException
 from boa3_test.tests.test_classes.testengine import TestEngine
+from boa3_test.tests.test_classes.transactionattribute.oracleresponse import OracleResponseCode
 
-ROOT_DIR = '/Users/william/Neo/src/lyrebird-contract'
+import fixtures
 
 TOKEN_MULT = int(1e8)
+CALLBACK_ACTION_GAS = 50000000
+MAX_BATCH_SIZE = 8
+MAX_LIQUIDATE_PAIRS = 32
+REQUEST_EXPIRY = 240
 
-class TestTemplate(BoaTest):
-    # Typically, we will set the owner to be the address that deploys the contract. However, the test suite uses a different script hash for the caller.
-    OWNER_SCRIPT_HASH = UInt160(b'\x9c\xa5/\x04"{\xf6Z\xe2\xe5\xd1\xffe\x03\xd1\x9dd\xc2\x9cF')
-    OTHER_SCRIPT_HASH = UInt160(b'\xf7\x82<X\xb5:\xcf\xe8\xb4e\xa67C\xcb}2;..b')
-    ORACLE_SCRIPT_HASH = UInt160(b'X\x87\x17\x11~\n\xa8\x10r\xaf\xabq\xd2\xdd\x89\xfe|K\x92\xfe')
-
-
-    def get_path(self):
-        return self.get_contract_path(ROOT_DIR, 'src', 'BowerbirdNest.py')
-
-
-    def get_bneo_path(self):
-        return self.get_contract_path(ROOT_DIR, 'testsrc', 'BurgerNeoToken.py')
-
-
-    def get_busdl_path(self):
-        return self.get_contract_path(ROOT_DIR, 'src', 'BoweredUSDLToken.py')
-
-
-    def get_usdl_path(self):
-        return self.get_contract_path(ROOT_DIR, 'testsrc', 'LyrebirdUSDToken.py')
-
+class TestTemplate(fixtures.NestTemplate):
 
     def test_nest_compile(self):
-        path = self.get_path()
+        path = fixtures.get_source_path('src', 'BowerbirdNest.py')
         Boa3.compile(path)
 
 
@@ -48,9 +31,7 @@ class TestTemplate(BoaTest):
 
     def test_nest_get_owner(self):
         path = self.get_path()
-        engine = TestEngine()
-        self.run_smart_contract(engine, path, '_deploy', None, False,
-                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        engine = self.get_deployed_engine()
 
         result = self.run_smart_contract(engine, path, 'getOwner')
         self.assertEqual(self.OWNER_SCRIPT_HASH, result)
@@ -69,36 +50,10 @@ class TestTemplate(BoaTest):
     def test_nest_deposit_collateral(self):
         path = self.get_path()
         bneo_path = self.get_bneo_path()
-        busdl_path = self.get_busdl_path()
-        usdl_path = self.get_usdl_path()
-        engine = TestEngine()
-
-        output, manifest = self.get_output(path)
-        nest_address = hash160(output)
-
-        output, manifest = self.get_output(bneo_path)
-        bneo_address = hash160(output)
+        engine = self.get_deployed_engine()
 
-        output, manifest = self.get_output(busdl_path)
-        busdl_address = hash160(output)
-
-        output, manifest = self.get_output(usdl_path)
-        usdl_address = hash160(output)
-
-        self.run_smart_contract(engine, path, '_deploy', None, False,
-                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
-        self.run_smart_contract(engine, bneo_path, '_deploy', None, False,
-                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
-        self.run_smart_contract(engine, busdl_path, '_deploy', None, False,
-                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
-        self.run_smart_contract(engine, usdl_path, '_deploy', None, False,
-                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
-
-        # For testing, we set the Nest script hash to the owner script hash
-        self.run_smart_contract(engine, busdl_path, 'setNestScriptHash', self.OWNER_SCRIPT_HASH,
-                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
-        self.run_smart_contract(engine, busdl_path, 'setUnderlyingScriptHash', usdl_address,
-                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        nest_address = self.get_address(path)
+        bneo_address = self.get_address(bneo_path)
 
         result = self.run_smart_contract(engine, path, 'getCollateralBalance', bneo_address, self.OWNER_SCRIPT_HASH)
         self.assertEqual(0, result)
@@ -123,6 +78,8 @@ class TestTemplate(BoaTest):
 
         result = self.run_smart_contract(engine, path, 'getCollateralBalance', bneo_address, self.OWNER_SCRIPT_HASH)
         self.assertEqual(1000 * TOKEN_MULT, result)
+        result = self.run_smart_contract(engine, path, 'getTotalCollateral', bneo_address)
+        self.assertEqual(1000 * TOKEN_MULT, result)
 
         result = self.run_smart_contract(engine, bneo_path, 'balanceOf', nest_address,
                                          signer_accounts=[self.OWNER_SCRIPT_HASH])
@@ -137,35 +94,11 @@ class TestTemplate(BoaTest):
         path = self.get_path()
         bneo_path = self.get_bneo_path()
         busdl_path = self.get_busdl_path()
-        usdl_path = self.get_usdl_path()
-        engine = TestEngine()
-
-        output, manifest = self.get_output(path)
-        nest_address = hash160(output)
-
-        output, manifest = self.get_output(bneo_path)
-        bneo_address = hash160(output)
-
-        output, manifest = self.get_output(busdl_path)
-        busdl_address = hash160(output)
-
-        output, manifest = self.get_output(usdl_path)
-        usdl_address = hash160(output)
+        engine = self.get_deployed_engine()
 
-        self.run_smart_contract(engine, path, '_deploy', None, False,
-                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
-        self.run_smart_contract(engine, bneo_path, '_deploy', None, False,
-                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
-        self.run_smart_contract(engine, busdl_path, '_deploy', None, False,
-                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
-        self.run_smart_contract(engine, usdl_path, '_deploy', None, False,
-                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
-
-        # For testing, we set the Nest script hash to the owner script hash
-        self.run_smart_contract(engine, busdl_path, 'setNestScriptHash', self.OWNER_SCRIPT_HASH,
-                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
-        self.run_smart_contract(engine, busdl_path, 'setUnderlyingScriptHash', usdl_address,
-                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        nest_address = self.get_address(path)
+        bneo_address = self.get_address(bneo_path)
+        busdl_address = self.get_address(busdl_path)
 
         result = self.run_smart_contract(engine, path, 'getCollateralBalance', bneo_address, self.OWNER_SCRIPT_HASH)
         self.assertEqual(0, result)
@@ -204,40 +137,22 @@ class TestTemplate(BoaTest):
         self.assertEqual('bNEO', args[1])
         self.assertEqual(700 * TOKEN_MULT, args[2])
 
+        result = self.run_smart_contract(engine, path, 'getTotalCollateral', bneo_address)
+        self.assertEqual(300 * TOKEN_MULT, result)
+        result = self.run_smart_contract(engine, path, 'getTotalCollaterals')
+        self.assertEqual([[bneo_address, 300 * TOKEN_MULT]], result)
+
 
     def test_nest_loan(self):
         path = self.get_path()
         bneo_path = self.get_bneo_path()
         busdl_path = self.get_busdl_path()
         usdl_path = self.get_usdl_path()
-        engine = TestEngine()
-
-        output, manifest = self.get_output(path)
-        nest_address = hash160(output)
-
-        output, manifest = self.get_output(bneo_path)
-        bneo_address = hash160(output)
+        engine = self.get_deployed_engine()
 
-        output, manifest = self.get_output(busdl_path)
-        busdl_address = hash160(output)
-
-        output, manifest = self.get_output(usdl_path)
-        usdl_address = hash160(output)
-
-        self.run_smart_contract(engine, path, '_deploy', None, False,
-                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
-        self.run_smart_contract(engine, bneo_path, '_deploy', None, False,
-                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
-        self.run_smart_contract(engine, busdl_path, '_deploy', None, False,
-                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
-        self.run_smart_contract(engine, usdl_path, '_deploy', None, False,
-                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
-
-        # For testing, we set the Nest script hash to the owner script hash
-        self.run_smart_contract(engine, busdl_path, 'setNestScriptHash', self.OWNER_SCRIPT_HASH,
-                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
-        self.run_smart_contract(engine, busdl_path, 'setUnderlyingScriptHash', usdl_address,
-                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        nest_address = self.get_address(path)
+        bneo_address = self.get_address(bneo_path)
+        busdl_address = self.get_address(busdl_path)
 
         self.run_smart_contract(engine, usdl_path, 'transfer', self.OWNER_SCRIPT_HASH, busdl_address,
                                          1000 * TOKEN_MULT, [ 'ACTION_DEPOSIT' ],
@@ -294,34 +209,12 @@ class TestTemplate(BoaTest):
         bneo_path = self.get_bneo_path()
         busdl_path = self.get_busdl_path()
         usdl_path = self.get_usdl_path()
-        engine = TestEngine()
-
-        output, manifest = self.get_output(path)
-        nest_address = hash160(output)
-
-        output, manifest = self.get_output(bneo_path)
-        bneo_address = hash160(output)
-
-        output, manifest = self.get_output(busdl_path)
-        busdl_address = hash160(output)
-
-        output, manifest = self.get_output(usdl_path)
-        usdl_address = hash160(output)
-
-        self.run_smart_contract(engine, path, '_deploy', None, False,
-                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
-        self.run_smart_contract(engine, bneo_path, '_deploy', None, False,
-                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
-        self.run_smart_contract(engine, busdl_path, '_deploy', None, False,
-                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
-        self.run_smart_contract(engine, usdl_path, '_deploy', None, False,
-                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        engine = self.get_deployed_engine()
 
-        # For testing, we set the Nest script hash to the owner script hash
-        self.run_smart_contract(engine, busdl_path, 'setNestScriptHash', self.OWNER_SCRIPT_HASH,
-                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
-        self.run_smart_contract(engine, busdl_path, 'setUnderlyingScriptHash', usdl_address,
-                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        nest_address = self.get_address(path)
+        bneo_address = self.get_address(bneo_path)
+        busdl_address = self.get_address(busdl_path)
+        usdl_address = self.get_address(usdl_path)
 
         result = self.run_smart_contract(engine, path, 'getCollateralBalance', bneo_address, self.OWNER_SCRIPT_HASH)
         self.assertEqual(0, result)
@@ -386,6 +279,8 @@ class TestTemplate(BoaTest):
 
         result = self.run_smart_contract(engine, path, 'getCollateralBalance', bneo_address, self.OWNER_SCRIPT_HASH)
         self.assertEqual((1000 - 210) * TOKEN_MULT, result)
+        result = self.run_smart_contract(engine, path, 'getTotalCollateral', bneo_address)
+        self.assertEqual((1000 - 210) * TOKEN_MULT, result)
 
         liquidate_events = engine.get_events('Liquidate', origin=nest_address)
         self.assertEqual(1, len(liquidate_events))
@@ -395,3 +290,793 @@ class TestTemplate(BoaTest):
         self.assertEqual('bNEO', args[2])
         self.assertEqual(100 * TOKEN_MULT, args[3])
         self.assertEqual(210 * TOKEN_MULT, args[4])
+
+    def test_nest_liquidation_auction(self):
+        path = self.get_path()
+        bneo_path = self.get_bneo_path()
+        busdl_path = self.get_busdl_path()
+        usdl_path = self.get_usdl_path()
+        engine = self.get_deployed_engine()
+
+        nest_address = self.get_address(path)
+        bneo_address = self.get_address(bneo_path)
+        busdl_address = self.get_address(busdl_path)
+        usdl_address = self.get_address(usdl_path)
+
+        self.run_smart_contract(engine, path, 'setBNEOScriptHash', bneo_address,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        self.run_smart_contract(engine, path, 'setBUSDLScriptHash', busdl_address,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        self.run_smart_contract(engine, path, 'setUSDLScriptHash', usdl_address,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+
+        result = self.run_smart_contract(engine, path, 'getAuctionDuration')
+        self.assertEqual(0, result)
+        self.run_smart_contract(engine, path, 'setAuctionDuration', 240,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        result = self.run_smart_contract(engine, path, 'getAuctionPenaltyFloor')
+        self.assertEqual(5000, result)
+        with self.assertRaises(TestExecutionException, msg=self.ASSERT_RESULTED_FALSE_MSG):
+            self.run_smart_contract(engine, path, 'setAuctionPenaltyFloor', 10001,
+                                             signer_accounts=[self.OWNER_SCRIPT_HASH])
+
+        self.run_smart_contract(engine, usdl_path, 'transfer', self.OWNER_SCRIPT_HASH, busdl_address,
+                                         1000 * TOKEN_MULT, [ 'ACTION_DEPOSIT' ],
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        self.run_smart_contract(engine, bneo_path, 'transfer', self.OWNER_SCRIPT_HASH, nest_address, 1000 * TOKEN_MULT, [ 'ACTION_COLLATERALIZE' ],
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        self.run_smart_contract(engine, usdl_path, 'transfer', self.OWNER_SCRIPT_HASH, self.OTHER_SCRIPT_HASH, 1000 * TOKEN_MULT, None,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+
+        loan_data = {
+            'account': self.OWNER_SCRIPT_HASH,
+            'loan_quantity': 700 * TOKEN_MULT,
+            'loan_token': busdl_address,
+        }
+        oracle_result = b'{"USDL":1000000,"bNEO":1000000}'
+        self.run_smart_contract(engine, path, 'loanCallback', 'url', loan_data, 0, oracle_result,
+                                         signer_accounts=[self.ORACLE_SCRIPT_HASH])
+
+        self.run_smart_contract(engine, usdl_path, 'transfer', self.OTHER_SCRIPT_HASH, nest_address, 700 * TOKEN_MULT,
+                                         [ 'ACTION_LIQUIDATE', self.OTHER_SCRIPT_HASH ],
+                                         signer_accounts=[self.OTHER_SCRIPT_HASH])
+
+        result = self.run_smart_contract(engine, path, 'getLiquidationAuction', self.OWNER_SCRIPT_HASH, bneo_address)
+        self.assertEqual([], result)
+
+        liquidate_data = {
+            'liquidator': self.OTHER_SCRIPT_HASH,
+            'account': self.OWNER_SCRIPT_HASH,
+            'collateral_token': bneo_address,
+            'usdl_quantity': 100 * TOKEN_MULT,
+        }
+        # The first liquidation opens an auction for 50% of the collateral, at the liquidation penalty
+        oracle_result = b'{"USDL":1000000,"bNEO":500000}'
+        self.run_smart_contract(engine, path, 'liquidateCallback', 'url', liquidate_data, 0, oracle_result,
+                                         signer_accounts=[self.ORACLE_SCRIPT_HASH])
+        start_height = engine.height
+
+        auction_events = engine.get_events('LiquidationAuction', origin=nest_address)
+        self.assertEqual(1, len(auction_events))
+        args = auction_events[0].arguments
+        self.assertEqual(self.OWNER_SCRIPT_HASH, args[0])
+        self.assertEqual('bNEO', args[1])
+        self.assertEqual(500 * TOKEN_MULT, args[2])
+
+        result = self.run_smart_contract(engine, bneo_path, 'balanceOf', self.OTHER_SCRIPT_HASH)
+        self.assertEqual(210 * TOKEN_MULT, result)
+        result = self.run_smart_contract(engine, path, 'getLiquidationAuction', self.OWNER_SCRIPT_HASH, bneo_address)
+        self.assertEqual([start_height, 290 * TOKEN_MULT, 500], result)
+
+        # Later liquidations fill the same auction, at a penalty which decays with every block towards half of it
+        engine.increase_block(engine.height + 120)
+        self.run_smart_contract(engine, path, 'liquidateCallback', 'url', liquidate_data, 0, oracle_result,
+                                         signer_accounts=[self.ORACLE_SCRIPT_HASH])
+
+        self.assertEqual(1, len(engine.get_events('LiquidationAuction', origin=nest_address)))
+        result = self.run_smart_contract(engine, bneo_path, 'balanceOf', self.OTHER_SCRIPT_HASH)
+        self.assertEqual(41750000000, result)
+        result = self.run_smart_contract(engine, path, 'getCollateralBalance', bneo_address, self.OWNER_SCRIPT_HASH)
+        self.assertEqual(1000 * TOKEN_MULT - 41750000000, result)
+        result = self.run_smart_contract(engine, path, 'getLiquidationAuction', self.OWNER_SCRIPT_HASH, bneo_address)
+        self.assertEqual([start_height, 8250000000, 375], result)
+
+        # An exhausted auction stays open until it expires, instead of letting the next liquidation open a new lot
+        self.run_smart_contract(engine, path, 'liquidateCallback', 'url', liquidate_data, 0, oracle_result,
+                                         signer_accounts=[self.ORACLE_SCRIPT_HASH])
+        result = self.run_smart_contract(engine, bneo_path, 'balanceOf', self.OTHER_SCRIPT_HASH)
+        self.assertEqual(49999999999, result)
+        result = self.run_smart_contract(engine, path, 'getLiquidationAuction', self.OWNER_SCRIPT_HASH, bneo_address)
+        self.assertEqual([start_height, 1, 375], result)
+
+        self.run_smart_contract(engine, path, 'liquidateCallback', 'url', liquidate_data, 0, oracle_result,
+                                         signer_accounts=[self.ORACLE_SCRIPT_HASH])
+        self.assertEqual(1, len(engine.get_events('LiquidateFailure', origin=nest_address)))
+        self.assertEqual(1, len(engine.get_events('LiquidationAuction', origin=nest_address)))
+        result = self.run_smart_contract(engine, bneo_path, 'balanceOf', self.OTHER_SCRIPT_HASH)
+        self.assertEqual(49999999999, result)
+
+        # Once it expires, the next liquidation opens a new auction for 50% of the remaining collateral
+        engine.increase_block(start_height + 240)
+        result = self.run_smart_contract(engine, path, 'getLiquidationAuction', self.OWNER_SCRIPT_HASH, bneo_address)
+        self.assertEqual([], result)
+        self.run_smart_contract(engine, path, 'liquidateCallback', 'url', liquidate_data, 0, oracle_result,
+                                         signer_accounts=[self.ORACLE_SCRIPT_HASH])
+        start_height = engine.height
+
+        auction_events = engine.get_events('LiquidationAuction', origin=nest_address)
+        self.assertEqual(2, len(auction_events))
+        self.assertEqual(25000000000, auction_events[1].arguments[2])
+        result = self.run_smart_contract(engine, path, 'getLiquidationAuction', self.OWNER_SCRIPT_HASH, bneo_address)
+        self.assertEqual([start_height, 4000000000, 500], result)
+
+        # The auction closes once the position is no longer eligible
+        oracle_result = b'{"USDL":1000000,"bNEO":2000000}'
+        self.run_smart_contract(engine, path, 'liquidateCallback', 'url', liquidate_data, 0, oracle_result,
+                                         signer_accounts=[self.ORACLE_SCRIPT_HASH])
+        self.assertEqual(2, len(engine.get_events('LiquidateFailure', origin=nest_address)))
+        result = self.run_smart_contract(engine, path, 'getLiquidationAuction', self.OWNER_SCRIPT_HASH, bneo_address)
+        self.assertEqual([], result)
+
+        # Disabling the auctions deletes the open ones
+        self.run_smart_contract(engine, path, 'liquidateCallback', 'url', liquidate_data, 0, b'{"USDL":1000000,"bNEO":500000}',
+                                         signer_accounts=[self.ORACLE_SCRIPT_HASH])
+        self.run_smart_contract(engine, path, 'setAuctionDuration', 0,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        self.run_smart_contract(engine, path, 'setAuctionDuration', 240,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        result = self.run_smart_contract(engine, path, 'getLiquidationAuction', self.OWNER_SCRIPT_HASH, bneo_address)
+        self.assertEqual([], result)
+
+    def test_nest_liquidate_targets(self):
+        path = self.get_path()
+        bneo_path = self.get_bneo_path()
+        busdl_path = self.get_busdl_path()
+        usdl_path = self.get_usdl_path()
+        engine = self.get_wired_engine()
+
+        nest_address = self.get_address(path)
+        bneo_address = self.get_address(bneo_path)
+        busdl_address = self.get_address(busdl_path)
+
+        self.run_smart_contract(engine, bneo_path, 'transfer', self.OWNER_SCRIPT_HASH, self.OTHER_SCRIPT_HASH, 500 * TOKEN_MULT, None,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        self.run_smart_contract(engine, bneo_path, 'transfer', self.OWNER_SCRIPT_HASH, nest_address, 500 * TOKEN_MULT, [ 'ACTION_COLLATERALIZE' ],
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        self.run_smart_contract(engine, bneo_path, 'transfer', self.OTHER_SCRIPT_HASH, nest_address, 500 * TOKEN_MULT, [ 'ACTION_COLLATERALIZE' ],
+                                         signer_accounts=[self.OTHER_SCRIPT_HASH])
+        self.run_smart_contract(engine, usdl_path, 'transfer', self.OWNER_SCRIPT_HASH, self.LIQUIDATOR_SCRIPT_HASH, 400 * TOKEN_MULT, None,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+
+        oracle_result = b'{"USDL":1000000,"bNEO":1000000}'
+        for account in [self.OWNER_SCRIPT_HASH, self.OTHER_SCRIPT_HASH]:
+            loan_data = {
+                'account': account,
+                'loan_quantity': 350 * TOKEN_MULT,
+                'loan_token': busdl_address,
+            }
+            self.run_smart_contract(engine, path, 'loanCallback', 'url', loan_data, 0, oracle_result,
+                                             signer_accounts=[self.ORACLE_SCRIPT_HASH])
+
+        # Targets must be valid accounts with at least one collateral token
+        with self.assertRaises(TestExecutionException, msg=self.ASSERT_RESULTED_FALSE_MSG):
+            self.run_smart_contract(engine, usdl_path, 'transfer', self.LIQUIDATOR_SCRIPT_HASH, nest_address, 400 * TOKEN_MULT,
+                                             [ 'ACTION_LIQUIDATE', [ [ self.OWNER_SCRIPT_HASH, [] ] ] ],
+                                             signer_accounts=[self.LIQUIDATOR_SCRIPT_HASH])
+        # And each account is targeted once
+        with self.assertRaises(TestExecutionException, msg=self.ASSERT_RESULTED_FALSE_MSG):
+            self.run_smart_contract(engine, usdl_path, 'transfer', self.LIQUIDATOR_SCRIPT_HASH, nest_address, 400 * TOKEN_MULT,
+                                             [ 'ACTION_LIQUIDATE', [ [ self.OWNER_SCRIPT_HASH, [ bneo_address ] ], [ self.OWNER_SCRIPT_HASH, [ bneo_address ] ] ] ],
+                                             signer_accounts=[self.LIQUIDATOR_SCRIPT_HASH])
+
+        targets = [
+            [ self.OWNER_SCRIPT_HASH, [ bneo_address ] ],
+            [ self.OTHER_SCRIPT_HASH, [ bneo_address ] ],
+        ]
+        self.run_smart_contract(engine, usdl_path, 'transfer', self.LIQUIDATOR_SCRIPT_HASH, nest_address, 400 * TOKEN_MULT,
+                                         [ 'ACTION_LIQUIDATE', targets ],
+                                         signer_accounts=[self.LIQUIDATOR_SCRIPT_HASH])
+
+        # A single Oracle request is made for every target
+        oracle_request_events = engine.get_events('OracleRequest')
+        self.assertEqual(1, len(oracle_request_events))
+        request_id = oracle_request_events[0].arguments[0]
+
+        oracle_result = b'{"USDL":1000000,"bNEO":500000}'
+        self.run_oracle_response(engine, request_id, OracleResponseCode.Success, oracle_result)
+
+        # Each account is liquidated up to the max liquidation ratio, for 125 USDL
+        liquidate_events = engine.get_events('Liquidate', origin=nest_address)
+        self.assertEqual(2, len(liquidate_events))
+        for event, account in zip(liquidate_events, [self.OWNER_SCRIPT_HASH, self.OTHER_SCRIPT_HASH]):
+            args = event.arguments
+            self.assertEqual(self.LIQUIDATOR_SCRIPT_HASH, args[0])
+            self.assertEqual(account, args[1])
+            self.assertEqual(125 * TOKEN_MULT, args[3])
+            self.assertEqual(26250000000, args[4])
+
+            result = self.run_smart_contract(engine, path, 'getCollateralBalance', bneo_address, account)
+            self.assertEqual(23750000000, result)
+
+        result = self.run_smart_contract(engine, bneo_path, 'balanceOf', self.LIQUIDATOR_SCRIPT_HASH)
+        self.assertEqual(525 * TOKEN_MULT, result)
+        # The unused 150 USDL are refunded once
+        result = self.run_smart_contract(engine, usdl_path, 'balanceOf', self.LIQUIDATOR_SCRIPT_HASH)
+        self.assertEqual(150 * TOKEN_MULT, result)
+        # The refund isn't notified as a failure of any target
+        self.assertEqual(0, len(engine.get_events('LiquidateFailure', origin=nest_address)))
+        result = self.run_smart_contract(engine, usdl_path, 'balanceOf', nest_address)
+        self.assertEqual(0, result)
+
+
+    def test_nest_reclaim_request(self):
+        path = self.get_path()
+        bneo_path = self.get_bneo_path()
+        busdl_path = self.get_busdl_path()
+        usdl_path = self.get_usdl_path()
+        engine = self.get_wired_engine()
+
+        nest_address = self.get_address(path)
+        bneo_address = self.get_address(bneo_path)
+        busdl_address = self.get_address(busdl_path)
+
+        self.run_smart_contract(engine, bneo_path, 'transfer', self.OWNER_SCRIPT_HASH, nest_address, 500 * TOKEN_MULT, [ 'ACTION_COLLATERALIZE' ],
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        self.run_smart_contract(engine, usdl_path, 'transfer', self.OWNER_SCRIPT_HASH, self.LIQUIDATOR_SCRIPT_HASH, 400 * TOKEN_MULT, None,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        loan_data = {
+            'account': self.OWNER_SCRIPT_HASH,
+            'loan_quantity': 350 * TOKEN_MULT,
+            'loan_token': busdl_address,
+        }
+        self.run_smart_contract(engine, path, 'loanCallback', 'url', loan_data, 0, b'{"USDL":1000000,"bNEO":1000000}',
+                                         signer_accounts=[self.ORACLE_SCRIPT_HASH])
+
+        # The collateral tokens are capped over all the targets
+        with self.assertRaises(TestExecutionException, msg=self.ASSERT_RESULTED_FALSE_MSG):
+            self.run_smart_contract(engine, usdl_path, 'transfer', self.LIQUIDATOR_SCRIPT_HASH, nest_address, 400 * TOKEN_MULT,
+                                             [ 'ACTION_LIQUIDATE', [ [ self.OWNER_SCRIPT_HASH, [ bneo_address ] * (MAX_LIQUIDATE_PAIRS + 1) ] ] ],
+                                             signer_accounts=[self.LIQUIDATOR_SCRIPT_HASH])
+
+        self.run_smart_contract(engine, usdl_path, 'transfer', self.LIQUIDATOR_SCRIPT_HASH, nest_address, 400 * TOKEN_MULT,
+                                         [ 'ACTION_LIQUIDATE', [ [ self.OWNER_SCRIPT_HASH, [ bneo_address ] ], [ self.OTHER_SCRIPT_HASH, [ bneo_address ] ] ] ],
+                                         signer_accounts=[self.LIQUIDATOR_SCRIPT_HASH])
+
+        batch_request_events = engine.get_events('BatchRequest', origin=nest_address)
+        self.assertEqual(1, len(batch_request_events))
+        args = batch_request_events[0].arguments
+        self.assertEqual(self.LIQUIDATOR_SCRIPT_HASH, args[1])
+        self.assertEqual(400 * TOKEN_MULT, args[2])
+        request_id = args[0]
+
+        # The request can't be reclaimed while its callback may still come
+        result = self.run_smart_contract(engine, path, 'reclaimRequest', request_id)
+        self.assertEqual(False, result)
+
+        engine.increase_block(engine.height + REQUEST_EXPIRY)
+        result = self.run_smart_contract(engine, path, 'reclaimRequest', request_id)
+        self.assertEqual(True, result)
+
+        # The failure is notified for each target, so that keepers know which accounts to retry,
+        # while the USDL of the request is only notified with the first one
+        liquidate_failure_events = engine.get_events('LiquidateFailure', origin=nest_address)
+        self.assertEqual(2, len(liquidate_failure_events))
+        for event, account, usdl_quantity in zip(liquidate_failure_events, [self.OWNER_SCRIPT_HASH, self.OTHER_SCRIPT_HASH], [400 * TOKEN_MULT, 0]):
+            args = event.arguments
+            self.assertEqual(self.LIQUIDATOR_SCRIPT_HASH, args[0])
+            self.assertEqual(account, args[1])
+            self.assertEqual('bNEO', args[2])
+            self.assertEqual(usdl_quantity, args[3])
+            self.assertEqual('Oracle request expired', args[4])
+
+        result = self.run_smart_contract(engine, usdl_path, 'balanceOf', self.LIQUIDATOR_SCRIPT_HASH)
+        self.assertEqual(400 * TOKEN_MULT, result)
+        result = self.run_smart_contract(engine, usdl_path, 'balanceOf', nest_address)
+        self.assertEqual(0, result)
+
+        # A reclaimed request is only refunded once, and its late callback is rejected
+        result = self.run_smart_contract(engine, path, 'reclaimRequest', request_id)
+        self.assertEqual(False, result)
+
+        oracle_request_id = engine.get_events('OracleRequest')[-1].arguments[0]
+        with self.assertRaises(TestExecutionException, msg=self.ASSERT_RESULTED_FALSE_MSG):
+            self.run_oracle_response(engine, oracle_request_id, OracleResponseCode.Success, b'{"USDL":1000000,"bNEO":500000}')
+        result = self.run_smart_contract(engine, path, 'getCollateralBalance', bneo_address, self.OWNER_SCRIPT_HASH)
+        self.assertEqual(500 * TOKEN_MULT, result)
+
+
+    def test_nest_collateral_metadata(self):
+        path = self.get_path()
+        bneo_path = self.get_bneo_path()
+        engine = self.get_deployed_engine()
+
+        bneo_address = self.get_address(bneo_path)
+
+        result = self.run_smart_contract(engine, path, 'getCollateralSymbol', bneo_address)
+        self.assertEqual('', result)
+
+        # Supporting a collateral records its symbol and decimals
+        self.run_smart_contract(engine, path, 'setBNEOScriptHash', bneo_address,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+
+        result = self.run_smart_contract(engine, path, 'getCollateralSymbol', bneo_address)
+        self.assertEqual('bNEO', result)
+        result = self.run_smart_contract(engine, path, 'getCollateralDecimals', bneo_address)
+        self.assertEqual(8, result)
+
+        # Only the owner can refresh the metadata
+        with self.assertRaises(TestExecutionException, msg=self.ABORTED_CONTRACT_MSG):
+            self.run_smart_contract(engine, path, 'updateCollateralMetadata', bneo_address,
+                                             signer_accounts=[self.OTHER_SCRIPT_HASH])
+
+
+    def test_nest_collateral_vector(self):
+        path = self.get_path()
+        bneo_path = self.get_bneo_path()
+        busdl_path = self.get_busdl_path()
+        usdl_path = self.get_usdl_path()
+        engine = self.get_wired_engine()
+
+        nest_address = self.get_address(path)
+        busdl_address = self.get_address(busdl_path)
+        usdl_address = self.get_address(usdl_path)
+
+        self.run_smart_contract(engine, path, 'supportCollateral', usdl_address,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        self.run_smart_contract(engine, bneo_path, 'transfer', self.OWNER_SCRIPT_HASH, nest_address, 1000 * TOKEN_MULT, [ 'ACTION_COLLATERALIZE' ],
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        self.run_smart_contract(engine, usdl_path, 'transfer', self.OWNER_SCRIPT_HASH, nest_address, 100 * TOKEN_MULT, [ 'ACTION_COLLATERALIZE' ],
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+
+        # Refreshing an unchanged symbol keeps the vector as it is
+        self.run_smart_contract(engine, path, 'updateCollateralMetadata', usdl_address,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+
+        # Each collateral token keeps its own entry, so both are counted at 75%
+        oracle_result = b'{"USDL":1000000,"bNEO":1000000}'
+        for loan_quantity in [826 * TOKEN_MULT, 825 * TOKEN_MULT]:
+            loan_data = {
+                'account': self.OWNER_SCRIPT_HASH,
+                'loan_quantity': loan_quantity,
+                'loan_token': busdl_address,
+            }
+            self.run_smart_contract(engine, path, 'loanCallback', 'url', loan_data, 0, oracle_result,
+                                             signer_accounts=[self.ORACLE_SCRIPT_HASH])
+
+        loan_failure_events = engine.get_events('LoanFailure', origin=nest_address)
+        self.assertEqual(1, len(loan_failure_events))
+        self.assertEqual(826 * TOKEN_MULT, loan_failure_events[0].arguments[2])
+        loan_events = engine.get_events('Loan', origin=nest_address)
+        self.assertEqual(1, len(loan_events))
+        self.assertEqual(825 * TOKEN_MULT, loan_events[0].arguments[2])
+
+
+    def test_nest_collateral_parameters(self):
+        path = self.get_path()
+        bneo_path = self.get_bneo_path()
+        engine = self.get_deployed_engine()
+
+        bneo_address = self.get_address(bneo_path)
+
+        result = self.run_smart_contract(engine, path, 'getCollateralParameters', bneo_address)
+        self.assertEqual([False, '', 0, 0, 0, 0, 0], result)
+
+        # Supporting a collateral fills in its whole record
+        self.run_smart_contract(engine, path, 'setBNEOScriptHash', bneo_address,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        result = self.run_smart_contract(engine, path, 'getCollateralParameters', bneo_address)
+        self.assertEqual([True, 'bNEO', 8, 7500, 5000, 500, 0], result)
+
+        # Each setter only changes its own field
+        self.run_smart_contract(engine, path, 'setLiquidationPenalty', bneo_address, 1000,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        self.run_smart_contract(engine, path, 'invalidateCollateral', bneo_address,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        result = self.run_smart_contract(engine, path, 'getCollateralParameters', bneo_address)
+        self.assertEqual([False, 'bNEO', 8, 7500, 5000, 1000, 0], result)
+        result = self.run_smart_contract(engine, path, 'isCollateralSupported', bneo_address)
+        self.assertEqual(False, result)
+
+        # Supporting it again keeps the parameters set by the owner
+        self.run_smart_contract(engine, path, 'setLoanToValue', bneo_address, 6000,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        self.run_smart_contract(engine, path, 'supportCollateral', bneo_address,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        result = self.run_smart_contract(engine, path, 'getCollateralParameters', bneo_address)
+        self.assertEqual([True, 'bNEO', 8, 6000, 5000, 1000, 0], result)
+
+
+    def test_nest_migrate_storage(self):
+        path = self.get_path()
+        bneo_path = self.get_bneo_path()
+        engine = self.get_deployed_engine()
+
+        bneo_address = self.get_address(bneo_path)
+        bneo64 = base64.b64encode(bneo_address).decode()
+        owner64 = base64.b64encode(self.OWNER_SCRIPT_HASH).decode()
+
+        # The layout before STORAGE_VERSION 1 was keyed by base64 encoded script hashes
+        legacy_storage = {
+            'sv': 0,
+            'col/' + bneo64: 1,
+            'lv/' + bneo64: 7500,
+            'ml/' + bneo64: 5000,
+            'lp/' + bneo64: 500,
+            'tc/' + bneo64: 1000 * TOKEN_MULT,
+            'cl/' + owner64 + '/' + bneo64: 1000 * TOKEN_MULT,
+        }
+        for key, value in legacy_storage.items():
+            engine.storage_put(key, value, path)
+
+        self.run_smart_contract(engine, path, '_deploy', None, True,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+
+        # The symbol and decimals are read from the token, and the total is recomputed from the balances
+        result = self.run_smart_contract(engine, path, 'getCollateralParameters', bneo_address)
+        self.assertEqual([True, 'bNEO', 8, 7500, 5000, 500, 1000 * TOKEN_MULT], result)
+        result = self.run_smart_contract(engine, path, 'getCollateralBalance', bneo_address, self.OWNER_SCRIPT_HASH)
+        self.assertEqual(1000 * TOKEN_MULT, result)
+        result = self.run_smart_contract(engine, path, 'getCollateralCount', self.OWNER_SCRIPT_HASH)
+        self.assertEqual(1, result)
+        result = self.run_smart_contract(engine, path, 'numPositions')
+        self.assertEqual(1, result)
+
+        for key in legacy_storage:
+            if key != 'sv':
+                self.assertIsNone(engine.storage_get(key, path))
+
+
+    def test_nest_collateral_count(self):
+        path = self.get_path()
+        bneo_path = self.get_bneo_path()
+        engine = self.get_wired_engine()
+
+        nest_address = self.get_address(path)
+        bneo_address = self.get_address(bneo_path)
+
+        result = self.run_smart_contract(engine, path, 'getCollateralCount', self.OWNER_SCRIPT_HASH)
+        self.assertEqual(0, result)
+
+        self.run_smart_contract(engine, bneo_path, 'transfer', self.OWNER_SCRIPT_HASH, nest_address, 1000 * TOKEN_MULT, [ 'ACTION_COLLATERALIZE' ],
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        self.run_smart_contract(engine, bneo_path, 'transfer', self.OWNER_SCRIPT_HASH, nest_address, 1000 * TOKEN_MULT, [ 'ACTION_COLLATERALIZE' ],
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+
+        result = self.run_smart_contract(engine, path, 'getCollateralCount', self.OWNER_SCRIPT_HASH)
+        self.assertEqual(1, result)
+
+        # Withdrawing the whole position removes it from the index
+        withdraw_collateral_data = {
+            'account': self.OWNER_SCRIPT_HASH,
+            'collateral_token': bneo_address,
+            'withdraw_quantity': 2000 * TOKEN_MULT,
+        }
+        oracle_result = b'{"USDL":1000000,"bNEO":1000000}'
+        self.run_smart_contract(engine, path, 'withdrawCollateralCallback', 'url', withdraw_collateral_data, 0, oracle_result,
+                                         signer_accounts=[self.ORACLE_SCRIPT_HASH])
+
+        result = self.run_smart_contract(engine, path, 'getCollateralCount', self.OWNER_SCRIPT_HASH)
+        self.assertEqual(0, result)
+        result = self.run_smart_contract(engine, path, 'getCollateralBalance', bneo_address, self.OWNER_SCRIPT_HASH)
+        self.assertEqual(0, result)
+
+
+    def test_nest_get_positions(self):
+        path = self.get_path()
+        bneo_path = self.get_bneo_path()
+        busdl_path = self.get_busdl_path()
+        engine = self.get_wired_engine()
+
+        nest_address = self.get_address(path)
+        bneo_address = self.get_address(bneo_path)
+        busdl_address = self.get_address(busdl_path)
+
+        result = self.run_smart_contract(engine, path, 'getPositions', 0, 10, True)
+        self.assertEqual([-1, 0, []], result)
+
+        self.run_smart_contract(engine, bneo_path, 'transfer', self.OWNER_SCRIPT_HASH, self.OTHER_SCRIPT_HASH, 1000 * TOKEN_MULT, None,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        self.run_smart_contract(engine, bneo_path, 'transfer', self.OTHER_SCRIPT_HASH, nest_address, 1000 * TOKEN_MULT, [ 'ACTION_COLLATERALIZE' ],
+                                         signer_accounts=[self.OTHER_SCRIPT_HASH])
+        self.run_smart_contract(engine, bneo_path, 'transfer', self.OWNER_SCRIPT_HASH, nest_address, 2000 * TOKEN_MULT, [ 'ACTION_COLLATERALIZE' ],
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+
+        result = self.run_smart_contract(engine, path, 'numPositions')
+        self.assertEqual(2, result)
+
+        # Loan 100 USDL to the owner
+        loan_data = {
+            'account': self.OWNER_SCRIPT_HASH,
+            'loan_token': busdl_address,
+            'loan_quantity': 100 * TOKEN_MULT,
+        }
+        oracle_result = b'{"USDL":1000000,"bNEO":1000000}'
+        self.run_smart_contract(engine, path, 'loanCallback', 'url', loan_data, 0, oracle_result,
+                                         signer_accounts=[self.ORACLE_SCRIPT_HASH])
+
+        result = self.run_smart_contract(engine, path, 'getPositions', 0, 10, True)
+        self.assertEqual([-1, [
+            [self.OTHER_SCRIPT_HASH, [[bneo_address, 1000 * TOKEN_MULT]], 0],
+            [self.OWNER_SCRIPT_HASH, [[bneo_address, 2000 * TOKEN_MULT]], 100 * TOKEN_MULT],
+        ]], result)
+        result = self.run_smart_contract(engine, path, 'getPositions', 0, 1, False)
+        self.assertEqual([1, [[self.OTHER_SCRIPT_HASH, [[bneo_address, 1000 * TOKEN_MULT]]]]], result)
+        result = self.run_smart_contract(engine, path, 'getPositions', 1, 1, False)
+        self.assertEqual([-1, [[self.OWNER_SCRIPT_HASH, [[bneo_address, 2000 * TOKEN_MULT]]]]], result)
+
+        # A partial withdrawal keeps the account in place
+        withdraw_collateral_data = {
+            'account': self.OWNER_SCRIPT_HASH,
+            'collateral_token': bneo_address,
+            'withdraw_quantity': 1000 * TOKEN_MULT,
+        }
+        self.run_smart_contract(engine, path, 'withdrawCollateralCallback', 'url', withdraw_collateral_data, 0, oracle_result,
+                                         signer_accounts=[self.ORACLE_SCRIPT_HASH])
+        result = self.run_smart_contract(engine, path, 'getPositions', 0, 10, False)
+        self.assertEqual([-1, [
+            [self.OTHER_SCRIPT_HASH, [[bneo_address, 1000 * TOKEN_MULT]]],
+            [self.OWNER_SCRIPT_HASH, [[bneo_address, 1000 * TOKEN_MULT]]],
+        ]], result)
+
+        # Withdrawing the whole position leaves the position empty instead of moving the owner into it
+        withdraw_collateral_data = {
+            'account': self.OTHER_SCRIPT_HASH,
+            'collateral_token': bneo_address,
+            'withdraw_quantity': 1000 * TOKEN_MULT,
+        }
+        self.run_smart_contract(engine, path, 'withdrawCollateralCallback', 'url', withdraw_collateral_data, 0, oracle_result,
+                                         signer_accounts=[self.ORACLE_SCRIPT_HASH])
+
+        result = self.run_smart_contract(engine, path, 'numPositions')
+        self.assertEqual(1, result)
+
+        # So a caller which read the first page before the withdrawal still finds the owner on the next one
+        result = self.run_smart_contract(engine, path, 'getPositions', 0, 1, False)
+        self.assertEqual([1, []], result)
+        result = self.run_smart_contract(engine, path, 'getPositions', 1, 1, False)
+        self.assertEqual([-1, [[self.OWNER_SCRIPT_HASH, [[bneo_address, 1000 * TOKEN_MULT]]]]], result)
+
+        with self.assertRaises(TestExecutionException, msg=self.ASSERT_RESULTED_FALSE_MSG):
+            self.run_smart_contract(engine, path, 'getPositions', 3, 10, False)
+
+
+    def test_nest_get_account_dashboard(self):
+        path = self.get_path()
+        bneo_path = self.get_bneo_path()
+        busdl_path = self.get_busdl_path()
+        engine = self.get_wired_engine()
+
+        nest_address = self.get_address(path)
+        bneo_address = self.get_address(bneo_path)
+        busdl_address = self.get_address(busdl_path)
+
+        # Supported collateral is listed even before it is deposited
+        interest_multiplier = self.run_smart_contract(engine, busdl_path, 'getInterestMultiplier')
+        bneo_parameters = [True, 'bNEO', 8, 7500, 5000, 500, 0]
+        result = self.run_smart_contract(engine, path, 'getAccountDashboard', self.OWNER_SCRIPT_HASH)
+        self.assertEqual([[[bneo_address, 0, bneo_parameters]], 0, 100_000_000, interest_multiplier], result)
+
+        self.run_smart_contract(engine, bneo_path, 'transfer', self.OWNER_SCRIPT_HASH, nest_address, 1000 * TOKEN_MULT, [ 'ACTION_COLLATERALIZE' ],
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        loan_data = {
+            'account': self.OWNER_SCRIPT_HASH,
+            'loan_token': busdl_address,
+            'loan_quantity': 100 * TOKEN_MULT,
+        }
+        oracle_result = b'{"USDL":1000000,"bNEO":1000000}'
+        self.run_smart_contract(engine, path, 'loanCallback', 'url', loan_data, 0, oracle_result,
+                                         signer_accounts=[self.ORACLE_SCRIPT_HASH])
+
+        interest_multiplier = self.run_smart_contract(engine, busdl_path, 'getInterestMultiplier')
+        bneo_parameters = [True, 'bNEO', 8, 7500, 5000, 500, 1000 * TOKEN_MULT]
+        result = self.run_smart_contract(engine, path, 'getAccountDashboard', self.OWNER_SCRIPT_HASH)
+        self.assertEqual([[[bneo_address, 1000 * TOKEN_MULT, bneo_parameters]], 100 * TOKEN_MULT, 100_000_000, interest_multiplier], result)
+
+        # Collateral that is no longer supported is only listed while the account holds it
+        self.run_smart_contract(engine, path, 'invalidateCollateral', bneo_address,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        result = self.run_smart_contract(engine, path, 'getAccountDashboard', self.OTHER_SCRIPT_HASH)
+        self.assertEqual([[], 0, 100_000_000, interest_multiplier], result)
+
+
+    def test_nest_set_loan_to_value(self):
+        path = self.get_path()
+        bneo_path = self.get_bneo_path()
+        busdl_path = self.get_busdl_path()
+        engine = self.get_wired_engine()
+
+        nest_address = self.get_address(path)
+        bneo_address = self.get_address(bneo_path)
+        busdl_address = self.get_address(busdl_path)
+
+        self.run_smart_contract(engine, bneo_path, 'transfer', self.OWNER_SCRIPT_HASH, nest_address, 1000 * TOKEN_MULT, [ 'ACTION_COLLATERALIZE' ],
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+
+        # Lowering the loan to value applies to collateral that was already deposited
+        self.run_smart_contract(engine, path, 'setLoanToValue', bneo_address, 5000,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+
+        loan_data = {
+            'account': self.OWNER_SCRIPT_HASH,
+            'loan_quantity': 600 * TOKEN_MULT,
+            'loan_token': busdl_address,
+        }
+        oracle_result = b'{"USDL":1000000,"bNEO":1000000}'
+        self.run_smart_contract(engine, path, 'loanCallback', 'url', loan_data, 0, oracle_result,
+                                         signer_accounts=[self.ORACLE_SCRIPT_HASH])
+
+        loan_failure_events = engine.get_events('LoanFailure', origin=nest_address)
+        self.assertEqual(1, len(loan_failure_events))
+
+        self.run_smart_contract(engine, path, 'setLoanToValue', bneo_address, 7500,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        self.run_smart_contract(engine, path, 'loanCallback', 'url', loan_data, 0, oracle_result,
+                                         signer_accounts=[self.ORACLE_SCRIPT_HASH])
+
+        loan_events = engine.get_events('Loan', origin=nest_address)
+        self.assertEqual(1, len(loan_events))
+        args = loan_events[0].arguments
+        self.assertEqual(self.OWNER_SCRIPT_HASH, args[0])
+        self.assertEqual('USDL', args[1])
+        self.assertEqual(600 * TOKEN_MULT, args[2])
+
+
+    def test_nest_batch(self):
+        path = self.get_path()
+        bneo_path = self.get_bneo_path()
+        busdl_path = self.get_busdl_path()
+        engine = self.get_wired_engine()
+
+        nest_address = self.get_address(path)
+        bneo_address = self.get_address(bneo_path)
+        busdl_address = self.get_address(busdl_path)
+
+        self.run_smart_contract(engine, bneo_path, 'transfer', self.OWNER_SCRIPT_HASH, nest_address, 1000 * TOKEN_MULT, [ 'ACTION_COLLATERALIZE' ],
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+
+        # Unknown actions are rejected
+        with self.assertRaises(TestExecutionException, msg=self.ABORTED_CONTRACT_MSG):
+            self.run_smart_contract(engine, path, 'batch', [ [ 'ACTION_UNKNOWN', self.OWNER_SCRIPT_HASH, bneo_address, 1 ] ],
+                                             signer_accounts=[self.OWNER_SCRIPT_HASH])
+
+        # Liquidations must be paid for with USDL
+        with self.assertRaises(TestExecutionException, msg=self.ASSERT_RESULTED_FALSE_MSG):
+            self.run_smart_contract(engine, path, 'batch', [ [ 'ACTION_LIQUIDATE', self.OWNER_SCRIPT_HASH, bneo_address, 1 ] ],
+                                             signer_accounts=[self.OWNER_SCRIPT_HASH])
+
+        actions = [
+            [ 'ACTION_LOAN', self.OWNER_SCRIPT_HASH, busdl_address, 500 * TOKEN_MULT ],
+            [ 'ACTION_WITHDRAW', self.OWNER_SCRIPT_HASH, bneo_address, 100 * TOKEN_MULT ],
+            [ 'ACTION_WITHDRAW', self.OWNER_SCRIPT_HASH, bneo_address, 800 * TOKEN_MULT ],
+        ]
+        self.run_smart_contract(engine, path, 'batch', actions,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+
+        # A single Oracle request is made for the whole batch
+        oracle_request_events = engine.get_events('OracleRequest')
+        self.assertEqual(1, len(oracle_request_events))
+        request_id = oracle_request_events[0].arguments[0]
+
+        oracle_result = b'{"USDL":1000000,"bNEO":1000000}'
+        self.run_oracle_response(engine, request_id, OracleResponseCode.Success, oracle_result)
+
+        loan_events = engine.get_events('Loan', origin=nest_address)
+        self.assertEqual(1, len(loan_events))
+        args = loan_events[0].arguments
+        self.assertEqual(self.OWNER_SCRIPT_HASH, args[0])
+        self.assertEqual(500 * TOKEN_MULT, args[2])
+
+        collateral_withdraw_events = engine.get_events('CollateralWithdraw', origin=nest_address)
+        self.assertEqual(1, len(collateral_withdraw_events))
+        args = collateral_withdraw_events[0].arguments
+        self.assertEqual(100 * TOKEN_MULT, args[2])
+
+        # The second withdrawal would leave the loan undercollateralized
+        collateral_withdraw_failure_events = engine.get_events('CollateralWithdrawFailure', origin=nest_address)
+        self.assertEqual(1, len(collateral_withdraw_failure_events))
+        args = collateral_withdraw_failure_events[0].arguments
+        self.assertEqual(800 * TOKEN_MULT, args[2])
+
+        result = self.run_smart_contract(engine, path, 'getCollateralBalance', bneo_address, self.OWNER_SCRIPT_HASH)
+        self.assertEqual(900 * TOKEN_MULT, result)
+
+
+    def test_nest_batch_max_size(self):
+        path = self.get_path()
+        bneo_path = self.get_bneo_path()
+        busdl_path = self.get_busdl_path()
+        engine = self.get_wired_engine()
+
+        nest_address = self.get_address(path)
+        busdl_address = self.get_address(busdl_path)
+
+        self.run_smart_contract(engine, bneo_path, 'transfer', self.OWNER_SCRIPT_HASH, nest_address, 1000 * TOKEN_MULT, [ 'ACTION_COLLATERALIZE' ],
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+
+        oracle_fee = 1 * TOKEN_MULT
+        self.run_smart_contract(engine, path, 'setOracleFee', oracle_fee,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+
+        loan_action = [ 'ACTION_LOAN', self.OWNER_SCRIPT_HASH, busdl_address, 10 * TOKEN_MULT ]
+
+        with self.assertRaises(TestExecutionException, msg=self.ASSERT_RESULTED_FALSE_MSG):
+            self.run_smart_contract(engine, path, 'batch', [ loan_action ] * (MAX_BATCH_SIZE + 1),
+                                             signer_accounts=[self.OWNER_SCRIPT_HASH])
+
+        self.run_smart_contract(engine, path, 'batch', [ loan_action ],
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        single_gas_consumed = engine.gas_consumed
+
+        self.run_smart_contract(engine, path, 'batch', [ loan_action ] * MAX_BATCH_SIZE,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        batch_gas_consumed = engine.gas_consumed
+
+        # The response GAS is a single Oracle fee, plus the callback cost of each action
+        self.assertGreaterEqual(batch_gas_consumed - single_gas_consumed, (MAX_BATCH_SIZE - 1) * CALLBACK_ACTION_GAS)
+        self.assertLess(batch_gas_consumed - single_gas_consumed, (MAX_BATCH_SIZE - 1) * oracle_fee)
+
+        request_id = engine.get_events('OracleRequest')[-1].arguments[0]
+        oracle_result = b'{"USDL":1000000,"bNEO":1000000}'
+        self.run_oracle_response(engine, request_id, OracleResponseCode.Success, oracle_result)
+        # Which covers what the callback spends on a full batch
+        self.assertLessEqual(engine.gas_consumed, oracle_fee + MAX_BATCH_SIZE * CALLBACK_ACTION_GAS)
+
+        # Every action of a full batch is applied within its response
+        loan_events = engine.get_events('Loan', origin=nest_address)
+        self.assertEqual(MAX_BATCH_SIZE, len(loan_events))
+
+        result = self.run_smart_contract(engine, busdl_path, 'loanedBalanceOf', self.OWNER_SCRIPT_HASH)
+        self.assertGreaterEqual(result, MAX_BATCH_SIZE * 10 * TOKEN_MULT)
+
+        # A liquidation needs the liquidator who sent its USDL, so it can't be batched without a transfer
+        liquidate_action = [ 'ACTION_LIQUIDATE', self.OWNER_SCRIPT_HASH, self.get_address(bneo_path), 10 * TOKEN_MULT ]
+        with self.assertRaises(TestExecutionException, msg=self.ASSERT_RESULTED_FALSE_MSG):
+            self.run_smart_contract(engine, path, 'batch', [ loan_action, liquidate_action ],
+                                             signer_accounts=[self.OWNER_SCRIPT_HASH])
+
+
+    def test_nest_price_snapshot(self):
+        path = self.get_path()
+        bneo_path = self.get_bneo_path()
+        busdl_path = self.get_busdl_path()
+        engine = self.get_wired_engine()
+
+        nest_address = self.get_address(path)
+        busdl_address = self.get_address(busdl_path)
+
+        self.run_smart_contract(engine, bneo_path, 'transfer', self.OWNER_SCRIPT_HASH, nest_address, 1000 * TOKEN_MULT, [ 'ACTION_COLLATERALIZE' ],
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+
+        result = self.run_smart_contract(engine, path, 'getPriceFreshness')
+        self.assertEqual(0, result)
+
+        self.run_smart_contract(engine, path, 'setPriceFreshness', 10,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+
+        # The Oracle callback records the prices it received
+        loan_data = {
+            'account': self.OWNER_SCRIPT_HASH,
+            'loan_quantity': 100 * TOKEN_MULT,
+            'loan_token': busdl_address,
+        }
+        oracle_result = b'{"USDL":1000000,"bNEO":1000000}'
+        self.run_smart_contract(engine, path, 'loanCallback', 'url', loan_data, 0, oracle_result,
+                                         signer_accounts=[self.ORACLE_SCRIPT_HASH])
+
+        result = self.run_smart_contract(engine, path, 'getPriceSnapshotHeight')
+        self.assertEqual(engine.height, result)
+
+        # Within the freshness window, loans complete without an Oracle request
+        self.run_smart_contract(engine, path, 'loan', self.OWNER_SCRIPT_HASH, busdl_address, 100 * TOKEN_MULT,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        self.assertEqual(0, len(engine.get_events('OracleRequest')))
+        loan_events = engine.get_events('Loan', origin=nest_address)
+        self.assertEqual(2, len(loan_events))
+
+        # Once the snapshot is stale, the Oracle is consulted again
+        engine.increase_block(engine.height + 10)
+        self.run_smart_contract(engine, path, 'loan', self.OWNER_SCRIPT_HASH, busdl_address, 100 * TOKEN_MULT,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        self.assertEqual(1, len(engine.get_events('OracleRequest')))
+        loan_events = engine.get_events('Loan', origin=nest_address)
+        self.assertEqual(2, len(loan_events))
@@ -1,11 +1,10 @@
 from boa3.boa3 import Boa3
 from boa3.builtin.type import UInt160
-from boa3.neo.cryptography import hash160
 from boa3_test.tests.boa_test import BoaTest
 from boa3_test.tests.test_classes.TestExecutionException import TestExecutionException
 from boa3_test.tests.test_classes.testengine import TestEngine
 
-ROOT_DIR = '/Users/william/Neo/src/lyrebird-contract'
+import fixtures
 
 TOKEN_MULT = int(1e8)
 
@@ -16,15 +15,42 @@ class TestTemplate(BoaTest):
 
 
     def get_path(self):
-        return self.get_contract_path(ROOT_DIR, 'src', 'BoweredUSDLToken.py')
+        return fixtures.get_contract_path('src', 'BoweredUSDLToken.py')
 
 
     def get_usdl_path(self):
-        return self.get_contract_path(ROOT_DIR, 'testsrc', 'LyrebirdUSDToken.py')
+        return fixtures.get_contract_path('testsrc', 'LyrebirdUSDToken.py')
 
 
-    def test_busdl_compile(self):
+    def get_address(self, path):
+        return fixtures.get_address(path)
+
+
+    def deploy(self, engine):
         path = self.get_path()
+        usdl_path = self.get_usdl_path()
+
+        self.run_smart_contract(engine, path, '_deploy', None, False,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        self.run_smart_contract(engine, usdl_path, '_deploy', None, False,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+
+        # For testing, we set the Nest script hash to the owner script hash
+        self.run_smart_contract(engine, path, 'setNestScriptHash', self.OWNER_SCRIPT_HASH,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        self.run_smart_contract(engine, path, 'setUnderlyingScriptHash', self.get_address(usdl_path),
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+
+
+    def get_deployed_engine(self):
+        """
+        A copy of an engine where bUSDL and USDL are deployed, and bUSDL treats the owner as the Nest
+        """
+        return fixtures.get_engine('busdl.deployed', [self.get_path(), self.get_usdl_path()], self.deploy)
+
+
+    def test_busdl_compile(self):
+        path = fixtures.get_source_path('src', 'BoweredUSDLToken.py')
         Boa3.compile(path)
 
 
@@ -39,9 +65,7 @@ class TestTemplate(BoaTest):
 
     def test_busdl_get_owner(self):
         path = self.get_path()
-        engine = TestEngine()
-        self.run_smart_contract(engine, path, '_deploy', None, False,
-                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        engine = self.get_deployed_engine()
 
         result = self.run_smart_contract(engine, path, 'getOwner')
         self.assertEqual(self.OWNER_SCRIPT_HASH, result)
@@ -59,9 +83,7 @@ class TestTemplate(BoaTest):
 
     def test_busdl_get_symbol(self):
         path = self.get_path()
-        engine = TestEngine()
-        self.run_smart_contract(engine, path, '_deploy', None, False,
-                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        engine = self.get_deployed_engine()
 
         result = self.run_smart_contract(engine, path, 'symbol')
         self.assertEqual('bUSDL', result)
@@ -69,9 +91,7 @@ class TestTemplate(BoaTest):
 
     def test_busdl_get_decimals(self):
         path = self.get_path()
-        engine = TestEngine()
-        self.run_smart_contract(engine, path, '_deploy', None, False,
-                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        engine = self.get_deployed_engine()
 
         result = self.run_smart_contract(engine, path, 'decimals')
         self.assertEqual(8, result)
@@ -80,24 +100,9 @@ class TestTemplate(BoaTest):
     def test_busdl_deposit(self):
         path = self.get_path()
         usdl_path = self.get_usdl_path()
-        engine = TestEngine()
-
-        output, manifest = self.get_output(path)
-        busdl_address = hash160(output)
-
-        output, manifest = self.get_output(usdl_path)
-        usdl_address = hash160(output)
+        engine = self.get_deployed_engine()
 
-        self.run_smart_contract(engine, path, '_deploy', None, False,
-                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
-        self.run_smart_contract(engine, usdl_path, '_deploy', None, False,
-                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
-
-        # For testing, we set the Nest script hash to the owner script hash
-        self.run_smart_contract(engine, path, 'setNestScriptHash', self.OWNER_SCRIPT_HASH,
-                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
-        self.run_smart_contract(engine, path, 'setUnderlyingScriptHash', usdl_address,
-                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        busdl_address = self.get_address(path)
 
         self.run_smart_contract(engine, usdl_path, 'transfer', self.OWNER_SCRIPT_HASH, busdl_address, 1000 * TOKEN_MULT, [ 'ACTION_DEPOSIT' ],
                                          signer_accounts=[self.OWNER_SCRIPT_HASH])
@@ -125,24 +130,9 @@ class TestTemplate(BoaTest):
     def test_busdl_redeem(self):
         path = self.get_path()
         usdl_path = self.get_usdl_path()
-        engine = TestEngine()
-
-        output, manifest = self.get_output(path)
-        busdl_address = hash160(output)
-
-        output, manifest = self.get_output(usdl_path)
-        usdl_address = hash160(output)
+        engine = self.get_deployed_engine()
 
-        self.run_smart_contract(engine, path, '_deploy', None, False,
-                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
-        self.run_smart_contract(engine, usdl_path, '_deploy', None, False,
-                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
-
-        # For testing, we set the Nest script hash to the owner script hash
-        self.run_smart_contract(engine, path, 'setNestScriptHash', self.OWNER_SCRIPT_HASH,
-                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
-        self.run_smart_contract(engine, path, 'setUnderlyingScriptHash', usdl_address,
-                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        busdl_address = self.get_address(path)
 
         self.run_smart_contract(engine, usdl_path, 'transfer', self.OWNER_SCRIPT_HASH, busdl_address, 1000, [ 'ACTION_DEPOSIT' ],
                                          signer_accounts=[self.OWNER_SCRIPT_HASH])
@@ -178,24 +168,9 @@ class TestTemplate(BoaTest):
     def test_busdl_loan(self):
         path = self.get_path()
         usdl_path = self.get_usdl_path()
-        engine = TestEngine()
-
-        output, manifest = self.get_output(path)
-        busdl_address = hash160(output)
-
-        output, manifest = self.get_output(usdl_path)
-        usdl_address = hash160(output)
+        engine = self.get_deployed_engine()
 
-        self.run_smart_contract(engine, path, '_deploy', None, False,
-                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
-        self.run_smart_contract(engine, usdl_path, '_deploy', None, False,
-                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
-
-        # For testing, we set the Nest script hash to the owner script hash
-        self.run_smart_contract(engine, path, 'setNestScriptHash', self.OWNER_SCRIPT_HASH,
-                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
-        self.run_smart_contract(engine, path, 'setUnderlyingScriptHash', usdl_address,
-                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        busdl_address = self.get_address(path)
 
         # Lending fails if we don't have enough supply
         with self.assertRaises(TestExecutionException, msg=self.ABORTED_CONTRACT_MSG):
@@ -286,24 +261,9 @@ class TestTemplate(BoaTest):
     def test_busdl_repayment(self):
         path = self.get_path()
         usdl_path = self.get_usdl_path()
-        engine = TestEngine()
-
-        output, manifest = self.get_output(path)
-        busdl_address = hash160(output)
-
-        output, manifest = self.get_output(usdl_path)
-        usdl_address = hash160(output)
+        engine = self.get_deployed_engine()
 
-        self.run_smart_contract(engine, path, '_deploy', None, False,
-                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
-        self.run_smart_contract(engine, usdl_path, '_deploy', None, False,
-                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
-
-        # For testing, we set the Nest script hash to the owner script hash
-        self.run_smart_contract(engine, path, 'setNestScriptHash', self.OWNER_SCRIPT_HASH,
-                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
-        self.run_smart_contract(engine, path, 'setUnderlyingScriptHash', usdl_address,
-                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        busdl_address = self.get_address(path)
 
         self.run_smart_contract(engine, usdl_path, 'transfer', self.OWNER_SCRIPT_HASH, busdl_address, 1000 * TOKEN_MULT,
                                         [ 'ACTION_DEPOSIT' ],
@@ -379,28 +339,135 @@ class TestTemplate(BoaTest):
         self.assertEqual(0, result)
 
 
-    def test_busdl_get_balances(self):
+    def test_busdl_accrue_interest(self):
         path = self.get_path()
         usdl_path = self.get_usdl_path()
-        engine = TestEngine()
+        engine = self.get_deployed_engine()
 
-        output, manifest = self.get_output(path)
-        busdl_address = hash160(output)
+        busdl_address = self.get_address(path)
 
-        output, manifest = self.get_output(usdl_path)
-        usdl_address = hash160(output)
+        # Accrue one hour of interest
+        engine.increase_block(engine.height + (4 * 60))
+        interest_multiplier = self.run_smart_contract(engine, path, 'getInterestMultiplier')
+        self.assertGreater(interest_multiplier, 1_000_000_000_000_000_000)
 
-        self.run_smart_contract(engine, path, '_deploy', None, False,
+        # The deposit persists the multiplier along with the height it was accrued at
+        self.run_smart_contract(engine, usdl_path, 'transfer', self.OWNER_SCRIPT_HASH, busdl_address, 1000, [ 'ACTION_DEPOSIT' ],
                                          signer_accounts=[self.OWNER_SCRIPT_HASH])
-        self.run_smart_contract(engine, usdl_path, '_deploy', None, False,
+        result = self.run_smart_contract(engine, path, 'getLastHeight')
+        self.assertGreater(result, 0)
+        result = self.run_smart_contract(engine, path, 'getInterestMultiplier')
+        self.assertEqual(interest_multiplier, result)
+
+        # A second deposit in the same block does not accrue again
+        self.run_smart_contract(engine, usdl_path, 'transfer', self.OWNER_SCRIPT_HASH, busdl_address, 1000, [ 'ACTION_DEPOSIT' ],
                                          signer_accounts=[self.OWNER_SCRIPT_HASH])
+        result = self.run_smart_contract(engine, path, 'getInterestMultiplier')
+        self.assertEqual(interest_multiplier, result)
+        result = self.run_smart_contract(engine, path, 'balanceOf', self.OWNER_SCRIPT_HASH)
+        self.assertEqual(2000, result)
 
-        # For testing, we set the Nest script hash to the owner script hash
-        self.run_smart_contract(engine, path, 'setNestScriptHash', self.OWNER_SCRIPT_HASH,
+
+    def test_busdl_interest_rate_model(self):
+        path = self.get_path()
+        usdl_path = self.get_usdl_path()
+        engine = self.get_deployed_engine()
+
+        busdl_address = self.get_address(path)
+
+        # Initially, a flat 100% APR
+        result = self.run_smart_contract(engine, path, 'getInterestRateModel')
+        self.assertEqual([10_000, 0, 0, 8_000], result)
+        result = self.run_smart_contract(engine, path, 'getR0')
+        self.assertEqual(10_000, result)
+
+        with self.assertRaises(TestExecutionException, msg=self.ABORTED_CONTRACT_MSG):
+            self.run_smart_contract(engine, path, 'setInterestRateModel', 0, 400, 6_000, 8_000,
+                                             signer_accounts=[self.OTHER_SCRIPT_HASH])
+
+        self.run_smart_contract(engine, path, 'setInterestRateModel', 0, 400, 6_000, 8_000,
                                          signer_accounts=[self.OWNER_SCRIPT_HASH])
-        self.run_smart_contract(engine, path, 'setUnderlyingScriptHash', usdl_address,
+        result = self.run_smart_contract(engine, path, 'getR0')
+        self.assertEqual(0, result)
+
+        self.run_smart_contract(engine, usdl_path, 'transfer', self.OWNER_SCRIPT_HASH, busdl_address, 1000 * TOKEN_MULT, [ 'ACTION_DEPOSIT' ],
                                          signer_accounts=[self.OWNER_SCRIPT_HASH])
 
+        # 50% utilization is below the kink
+        self.run_smart_contract(engine, path, 'loan', self.OWNER_SCRIPT_HASH, 500 * TOKEN_MULT,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        result = self.run_smart_contract(engine, path, 'getUtilization')
+        self.assertEqual(5_000, result)
+        result = self.run_smart_contract(engine, path, 'getR0')
+        self.assertEqual(250, result)
+
+        # 90% utilization is above the kink
+        self.run_smart_contract(engine, path, 'loan', self.OWNER_SCRIPT_HASH, 400 * TOKEN_MULT,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        result = self.run_smart_contract(engine, path, 'getUtilization')
+        self.assertEqual(9_000, result)
+        result = self.run_smart_contract(engine, path, 'getR0')
+        self.assertEqual(3_400, result)
+
+
+    def test_busdl_get_pool_state(self):
+        path = self.get_path()
+        usdl_path = self.get_usdl_path()
+        engine = self.get_deployed_engine()
+
+        busdl_address = self.get_address(path)
+
+        self.run_smart_contract(engine, usdl_path, 'transfer', self.OWNER_SCRIPT_HASH, busdl_address, 1000 * TOKEN_MULT, [ 'ACTION_DEPOSIT' ],
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        self.run_smart_contract(engine, path, 'loan', self.OWNER_SCRIPT_HASH, 500 * TOKEN_MULT,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        engine.increase_block(engine.height + (4 * 60))
+
+        # The pool state matches the individual views at the same height
+        views = ['totalSupply', 'getUnderlyingSupply', 'getLoanedSupply', 'getExchangeRate', 'getInterestMultiplier', 'getLastHeight',
+                 'numAccounts', 'totalMinted', 'totalBurned', 'getR0', 'getUtilization']
+        expected = [self.run_smart_contract(engine, path, view) for view in views]
+        result = self.run_smart_contract(engine, path, 'getPoolState')
+        self.assertEqual(expected, result)
+        self.assertGreater(result[2], 500 * TOKEN_MULT)
+
+
+    def test_busdl_balance_of_batch(self):
+        path = self.get_path()
+        usdl_path = self.get_usdl_path()
+        engine = self.get_deployed_engine()
+
+        busdl_address = self.get_address(path)
+
+        self.run_smart_contract(engine, usdl_path, 'transfer', self.OWNER_SCRIPT_HASH, busdl_address, 1000 * TOKEN_MULT, [ 'ACTION_DEPOSIT' ],
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        self.run_smart_contract(engine, path, 'loan', self.OWNER_SCRIPT_HASH, 300 * TOKEN_MULT,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        self.run_smart_contract(engine, path, 'loan', self.OTHER_SCRIPT_HASH, 200 * TOKEN_MULT,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        engine.increase_block(engine.height + (4 * 60))
+
+        accounts = [self.OWNER_SCRIPT_HASH, self.OTHER_SCRIPT_HASH, busdl_address]
+        result = self.run_smart_contract(engine, path, 'balanceOfBatch', accounts)
+        self.assertEqual([1000 * TOKEN_MULT, 0, 0], result)
+
+        # Each loaned balance matches loanedBalanceOf at the same height
+        expected = [self.run_smart_contract(engine, path, 'loanedBalanceOf', account) for account in accounts]
+        result = self.run_smart_contract(engine, path, 'loanedBalanceOfBatch', accounts)
+        self.assertEqual(expected, result)
+        self.assertGreater(result[0], 300 * TOKEN_MULT)
+
+        result = self.run_smart_contract(engine, path, 'balanceOfBatch', [])
+        self.assertEqual([], result)
+
+
+    def test_busdl_get_balances(self):
+        path = self.get_path()
+        usdl_path = self.get_usdl_path()
+        engine = self.get_deployed_engine()
+
+        busdl_address = self.get_address(path)
+
         result = self.run_smart_contract(engine, path, 'balanceOf', self.OWNER_SCRIPT_HASH,
                                          signer_accounts=[self.OWNER_SCRIPT_HASH])
         self.assertEqual(0, result)
@@ -426,12 +493,13 @@ class TestTemplate(BoaTest):
                                          signer_accounts=[self.OTHER_SCRIPT_HASH])
         self.assertEqual(2000, result)
         
+        # Balances are returned in the order of their raw script hashes
         result = self.run_smart_contract(engine, path, 'getBalances', 0, 2)
-        self.assertEqual([[self.OTHER_SCRIPT_HASH, 2000], [self.OWNER_SCRIPT_HASH, 10_000_000 * TOKEN_MULT - 2000]], result)
+        self.assertEqual([[self.OWNER_SCRIPT_HASH, 10_000_000 * TOKEN_MULT - 2000], [self.OTHER_SCRIPT_HASH, 2000]], result)
         result = self.run_smart_contract(engine, path, 'getBalances', 0, 1)
-        self.assertEqual([[self.OTHER_SCRIPT_HASH, 2000]], result)
-        result = self.run_smart_contract(engine, path, 'getBalances', 1, 1)
         self.assertEqual([[self.OWNER_SCRIPT_HASH, 10_000_000 * TOKEN_MULT - 2000]], result)
+        result = self.run_smart_contract(engine, path, 'getBalances', 1, 1)
+        self.assertEqual([[self.OTHER_SCRIPT_HASH, 2000]], result)
 
         # Page size too large fails
         with self.assertRaises(TestExecutionException, msg=self.ASSERT_RESULTED_FALSE_MSG):
@@ -439,27 +507,56 @@ class TestTemplate(BoaTest):
                                              signer_accounts=[self.OWNER_SCRIPT_HASH])
 
 
-    def test_busdl_num_accounts(self):
+    def test_busdl_transfer_many(self):
         path = self.get_path()
         usdl_path = self.get_usdl_path()
-        engine = TestEngine()
-
-        output, manifest = self.get_output(path)
-        busdl_address = hash160(output)
+        engine = self.get_deployed_engine()
 
-        output, manifest = self.get_output(usdl_path)
-        usdl_address = hash160(output)
+        busdl_address = self.get_address(path)
 
-        self.run_smart_contract(engine, path, '_deploy', None, False,
-                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
-        self.run_smart_contract(engine, usdl_path, '_deploy', None, False,
+        self.run_smart_contract(engine, usdl_path, 'transfer', self.OWNER_SCRIPT_HASH, busdl_address, 1000 * TOKEN_MULT, [ 'ACTION_DEPOSIT' ],
                                          signer_accounts=[self.OWNER_SCRIPT_HASH])
+        num_accounts = self.run_smart_contract(engine, path, 'numAccounts')
 
-        # For testing, we set the Nest script hash to the owner script hash
-        self.run_smart_contract(engine, path, 'setNestScriptHash', self.OWNER_SCRIPT_HASH,
+        recipients = [
+            [self.OTHER_SCRIPT_HASH, 100 * TOKEN_MULT],
+            [self.OTHER_SCRIPT_HASH, 50 * TOKEN_MULT],
+            [self.OWNER_SCRIPT_HASH, 10 * TOKEN_MULT],
+        ]
+
+        # The sender must sign
+        result = self.run_smart_contract(engine, path, 'transferMany', self.OWNER_SCRIPT_HASH, recipients, None,
+                                         signer_accounts=[self.OTHER_SCRIPT_HASH])
+        self.assertEqual(False, result)
+
+        # Nothing is transferred unless every transfer can be made
+        result = self.run_smart_contract(engine, path, 'transferMany', self.OWNER_SCRIPT_HASH, recipients + [[self.OTHER_SCRIPT_HASH, 1000 * TOKEN_MULT]], None,
                                          signer_accounts=[self.OWNER_SCRIPT_HASH])
-        self.run_smart_contract(engine, path, 'setUnderlyingScriptHash', usdl_address,
+        self.assertEqual(False, result)
+        result = self.run_smart_contract(engine, path, 'balanceOf', self.OTHER_SCRIPT_HASH)
+        self.assertEqual(0, result)
+
+        result = self.run_smart_contract(engine, path, 'transferMany', self.OWNER_SCRIPT_HASH, recipients, None,
                                          signer_accounts=[self.OWNER_SCRIPT_HASH])
+        self.assertEqual(True, result)
+
+        transfer_events = engine.get_events('Transfer', origin=busdl_address)[-3:]
+        self.assertEqual([[self.OWNER_SCRIPT_HASH, recipient[0], recipient[1]] for recipient in recipients],
+                         [list(event.arguments) for event in transfer_events])
+
+        # Transfers to the sender itself leave its balance unchanged
+        result = self.run_smart_contract(engine, path, 'balanceOfBatch', [self.OWNER_SCRIPT_HASH, self.OTHER_SCRIPT_HASH])
+        self.assertEqual([850 * TOKEN_MULT, 150 * TOKEN_MULT], result)
+        result = self.run_smart_contract(engine, path, 'numAccounts')
+        self.assertEqual(num_accounts + 1, result)
+
+
+    def test_busdl_num_accounts(self):
+        path = self.get_path()
+        usdl_path = self.get_usdl_path()
+        engine = self.get_deployed_engine()
+
+        busdl_address = self.get_address(path)
 
         result = self.run_smart_contract(engine, path, 'numAccounts')
         self.assertEqual(0, result)
@@ -471,10 +568,67 @@ class TestTemplate(BoaTest):
                                          signer_accounts=[self.OWNER_SCRIPT_HASH])
 
         result = self.run_smart_contract(engine, path, 'numAccounts')
-        self.assertEqual(1, result)
+        self.assertEqual(2, result)
 
         self.run_smart_contract(engine, path, 'transfer', self.OTHER_SCRIPT_HASH, self.OWNER_SCRIPT_HASH, 2000, None,
                                          signer_accounts=[self.OTHER_SCRIPT_HASH])
 
+        result = self.run_smart_contract(engine, path, 'numAccounts')
+        self.assertEqual(1, result)
+
+        # Redeeming burns the whole balance, which leaves no zero balance behind
+        self.run_smart_contract(engine, path, 'transfer', self.OWNER_SCRIPT_HASH, busdl_address, 1000 * TOKEN_MULT, [ 'ACTION_REDEEM' ],
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+
         result = self.run_smart_contract(engine, path, 'numAccounts')
         self.assertEqual(0, result)
+        result = self.run_smart_contract(engine, path, 'getBalances', 0, 1)
+        self.assertEqual([], result)
+
+
+    def test_busdl_get_balances_from(self):
+        path = self.get_path()
+        usdl_path = self.get_usdl_path()
+        engine = self.get_deployed_engine()
+
+        busdl_address = self.get_address(path)
+
+        result = self.run_smart_contract(engine, path, 'getBalancesFrom', 0, 1)
+        self.assertEqual([-1, []], result)
+
+        self.run_smart_contract(engine, usdl_path, 'transfer', self.OWNER_SCRIPT_HASH, busdl_address, 10_000_000 * TOKEN_MULT, [ 'ACTION_DEPOSIT' ],
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+
+        self.run_smart_contract(engine, path, 'transfer', self.OWNER_SCRIPT_HASH, self.OTHER_SCRIPT_HASH, 2000, None,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+
+        result = self.run_smart_contract(engine, path, 'numHolders')
+        self.assertEqual(2, result)
+
+        # Holders are listed in the order in which they first received a balance
+        result = self.run_smart_contract(engine, path, 'getBalancesFrom', 0, 2)
+        self.assertEqual([-1, [[self.OWNER_SCRIPT_HASH, 10_000_000 * TOKEN_MULT - 2000], [self.OTHER_SCRIPT_HASH, 2000]]], result)
+        result = self.run_smart_contract(engine, path, 'getBalancesFrom', 0, 1)
+        self.assertEqual([1, [[self.OWNER_SCRIPT_HASH, 10_000_000 * TOKEN_MULT - 2000]]], result)
+
+        # Emptying a balance between two pages doesn't move the other holders, so the next page still returns OTHER
+        self.run_smart_contract(engine, path, 'transfer', self.OWNER_SCRIPT_HASH, self.OTHER_SCRIPT_HASH, 10_000_000 * TOKEN_MULT - 2000, None,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        result = self.run_smart_contract(engine, path, 'getBalancesFrom', 1, 1)
+        self.assertEqual([-1, [[self.OTHER_SCRIPT_HASH, 10_000_000 * TOKEN_MULT]]], result)
+        result = self.run_smart_contract(engine, path, 'numHolders')
+        self.assertEqual(1, result)
+
+        # The emptied position is skipped, and reused when the account holds a balance again
+        result = self.run_smart_contract(engine, path, 'getBalancesFrom', 0, 2)
+        self.assertEqual([-1, [[self.OTHER_SCRIPT_HASH, 10_000_000 * TOKEN_MULT]]], result)
+        self.run_smart_contract(engine, path, 'transfer', self.OTHER_SCRIPT_HASH, self.OWNER_SCRIPT_HASH, 1000, None,
+                                         signer_accounts=[self.OTHER_SCRIPT_HASH])
+        result = self.run_smart_contract(engine, path, 'getBalancesFrom', 0, 2)
+        self.assertEqual([-1, [[self.OWNER_SCRIPT_HASH, 1000], [self.OTHER_SCRIPT_HASH, 10_000_000 * TOKEN_MULT - 1000]]], result)
+        result = self.run_smart_contract(engine, path, 'numHolders')
+        self.assertEqual(2, result)
+
+        # Cursor past the end of the index fails
+        with self.assertRaises(TestExecutionException, msg=self.ASSERT_RESULTED_FALSE_MSG):
+            self.run_smart_contract(engine, path, 'getBalancesFrom', 3, 1)
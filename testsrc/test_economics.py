@@ -0,0 +1,129 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sim'))
+
+import economics
+
+TOKEN_MULT = int(1e8)
+
+
+class TestEconomics(unittest.TestCase):
+
+    def test_economics_accrue_interest(self):
+        # Matches getInterestMultiplier in test_busdl_loan after one block at 100% APR
+        result = economics.accrue_interest(economics.exact([economics.INITIAL_INTEREST_MULTIPLIER]), 1, 10_000)
+        self.assertEqual([1000000475646879756], list(result))
+
+        interest_multiplier = economics.exact([economics.FLOAT_MULTIPLIER, 2 * economics.FLOAT_MULTIPLIER])
+        result = economics.accrue_interest(interest_multiplier, economics.BLOCKS_PER_YEAR, 10_000)
+        self.assertEqual([2 * economics.FLOAT_MULTIPLIER, 4 * economics.FLOAT_MULTIPLIER], list(result))
+
+        # Scaling a loan back and forth loses at most one unit, as in the contract
+        loan_quantity = economics.exact([700 * TOKEN_MULT])
+        interest_multiplier = economics.exact([economics.INITIAL_INTEREST_MULTIPLIER])
+        unscaled = economics.unscaled_quantity(loan_quantity, interest_multiplier)
+        result = economics.scaled_quantity(unscaled, economics.accrue_interest(interest_multiplier, 1, 10_000))
+        self.assertEqual([70000033295], list(result))
+
+
+    def test_economics_annual_rate(self):
+        utilization = economics.utilization(economics.exact([0, 500, 100, 0]), economics.exact([0, 500, 900, 1000]))
+        self.assertEqual([0, 5_000, 9_000, 10_000], list(utilization))
+
+        result = economics.annual_rate(utilization)
+        self.assertEqual([10_000] * 4, list(result))
+
+        # Matches test_busdl_interest_rate_model
+        result = economics.annual_rate(utilization, 0, 400, 6_000, 8_000)
+        self.assertEqual([0, 250, 3_400, 6_400], list(result))
+
+
+    def test_economics_exchange_rate(self):
+        busdl_supply = economics.exact([0, 1000 * TOKEN_MULT, 1000 * TOKEN_MULT])
+        underlying_supply = economics.exact([0, 1000 * TOKEN_MULT, 0])
+        loaned_supply = economics.exact([0, 0, 2000 * TOKEN_MULT])
+        result = economics.exchange_rate(busdl_supply, underlying_supply, loaned_supply)
+        self.assertEqual([economics.INITIAL_EXCHANGE_RATE, economics.EXCHANGE_RATE_MULT, 2 * economics.EXCHANGE_RATE_MULT], list(result))
+
+
+    def test_economics_liquidate(self):
+        collateral_quantity = economics.exact([[1000 * TOKEN_MULT], [1000 * TOKEN_MULT]])
+        collateral_price = economics.exact([1_000_000, 500_000])
+        account_collateral_ltv = economics.collateral_ltv(collateral_quantity, economics.INITIAL_LOAN_TO_VALUE, collateral_price[:, np.newaxis])
+        self.assertEqual([75_000_000_000_000_000, 37_500_000_000_000_000], list(account_collateral_ltv))
+
+        # Matches test_nest_liquidate, which is only eligible at the lower price
+        result = economics.liquidate(economics.exact([700 * TOKEN_MULT] * 2), collateral_quantity[:, 0], account_collateral_ltv,
+                                     economics.exact([100 * TOKEN_MULT] * 2), economics.PRICE_MULT, collateral_price)
+        self.assertEqual([False, True], list(result['liquidated']))
+        self.assertEqual([0, 100 * TOKEN_MULT], list(result['usdl_quantity']))
+        self.assertEqual([0, 210 * TOKEN_MULT], list(result['collateral_quantity']))
+        self.assertEqual([100 * TOKEN_MULT, 0], list(result['refund_quantity']))
+
+        # Matches executeLiquidate, which only takes as much collateral as the loan buys
+        collateral_quantity = economics.exact([[200 * TOKEN_MULT]])
+        collateral_price = economics.exact([250_000])
+        account_collateral_ltv = economics.collateral_ltv(collateral_quantity, economics.INITIAL_LOAN_TO_VALUE, collateral_price[:, np.newaxis])
+        result = economics.liquidate(economics.exact([40 * TOKEN_MULT]), collateral_quantity[:, 0], account_collateral_ltv,
+                                     economics.exact([100 * TOKEN_MULT]), economics.PRICE_MULT, collateral_price,
+                                     max_liquidation_ratio=economics.BASIS_POINTS)
+        self.assertEqual([True], list(result['liquidated']))
+        self.assertEqual([40 * TOKEN_MULT], list(result['usdl_quantity']))
+        self.assertEqual([168 * TOKEN_MULT], list(result['collateral_quantity']))
+        self.assertEqual([60 * TOKEN_MULT], list(result['refund_quantity']))
+
+
+    def test_economics_auction_penalty(self):
+        # Matches test_nest_liquidation_auction, and stays at the floor once the auction expires
+        height = economics.exact([0, 120, 239, 240, 480])
+        result = economics.auction_penalty(economics.INITIAL_LIQUIDATION_PENALTY, 0, 240, height)
+        self.assertEqual([500, 375, 251, 250, 250], list(result))
+
+        # A floor of BASIS_POINTS keeps the liquidation penalty throughout
+        result = economics.auction_penalty(economics.INITIAL_LIQUIDATION_PENALTY, 0, 240, height, economics.BASIS_POINTS)
+        self.assertEqual([500] * 5, list(result))
+
+
+    def test_economics_stress_liquidations(self):
+        collateral_quantity = economics.exact([1000 * TOKEN_MULT, 1000 * TOKEN_MULT])
+        loan_quantity = economics.exact([700 * TOKEN_MULT, 0])
+        collateral_prices = economics.exact([
+            [1_000_000, 1_000_000],
+            [1_000_000, 500_000],
+        ])
+        result = economics.stress_liquidations(collateral_quantity, loan_quantity, collateral_prices)
+
+        self.assertEqual([[0, 0], [1, 0]], result['liquidations'].tolist())
+        # At most half of the collateral, plus the penalty, is liquidated at once
+        self.assertEqual([[1000 * TOKEN_MULT, 1000 * TOKEN_MULT], [475 * TOKEN_MULT, 1000 * TOKEN_MULT]], result['collateral_quantity'].tolist())
+        self.assertEqual([[700 * TOKEN_MULT, 0], [450 * TOKEN_MULT, 0]], result['loan_quantity'].tolist())
+        # The remaining 475 bNEO at 0.5 USDL no longer cover the 450 USDL loan
+        self.assertEqual([0, (450 * TOKEN_MULT * 1_000_000) - (475 * TOKEN_MULT * 500_000)], list(result['bad_debt']))
+
+
+    def test_economics_int64_overflow(self):
+        # 1000 bNEO weighted by the loan to value at 1 USDL is 7.5e20, which would wrap around in int64
+        collateral_quantity = np.array([1000 * TOKEN_MULT])
+        loan_quantity = np.array([700 * TOKEN_MULT])
+        collateral_prices = np.array([[1_000_000, 500_000]] * 4)
+        with self.assertRaises(OverflowError):
+            economics.stress_liquidations(collateral_quantity, loan_quantity, collateral_prices)
+        with self.assertRaises(OverflowError):
+            economics.collateral_ltv(collateral_quantity[:, np.newaxis], economics.INITIAL_LOAN_TO_VALUE, collateral_prices[:, :1])
+
+        # A single array of Python integers is enough for the whole computation to be exact
+        result = economics.stress_liquidations(economics.exact(collateral_quantity), loan_quantity, collateral_prices)
+        self.assertEqual([[1]] * 4, result['liquidations'].tolist())
+        self.assertEqual([(450 * TOKEN_MULT * 1_000_000) - (475 * TOKEN_MULT * 500_000)] * 4, list(result['bad_debt']))
+
+        # int64 arrays are still accepted when their products fit
+        result = economics.collateral_ltv(np.array([[1000]]), economics.INITIAL_LOAN_TO_VALUE, np.array([[1_000_000]]))
+        self.assertEqual([750_000_000], list(result))
+
+
+if __name__ == '__main__':
+    unittest.main()
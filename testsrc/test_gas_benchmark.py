@@ -0,0 +1,526 @@
+import json
+import os
+import tempfile
+
+from boa3.builtin.type import UInt160
+from boa3_test.tests.boa_test import BoaTest
+from boa3_test.tests.test_classes.testengine import TestEngine
+from boa3_test.tests.test_classes.transactionattribute.oracleresponse import OracleResponseCode
+
+import fixtures
+
+TOKEN_MULT = int(1e8)
+CALLBACK_ACTION_GAS = 50000000
+MAX_BATCH_SIZE = 8
+MAX_LIQUIDATE_PAIRS = 32
+REQUEST_EXPIRY = 240
+
+# The GAS consumed by each benchmark, keyed by contract.method[scale]
+# The TestEngine only reports the GAS consumed, not the number of VM instructions executed,
+# so GAS, which weighs each instruction and syscall by its price, is the only metric recorded
+GAS_BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gas_baseline.json')
+# Set UPDATE_GAS_BASELINE=1 to record the GAS consumed instead of checking it
+# A benchmark fails while some of its entries are missing from the baseline, until it is recorded
+UPDATE_GAS_BASELINE = os.environ.get('UPDATE_GAS_BASELINE', '') == '1'
+# The fraction by which a benchmark may exceed its baseline before failing
+GAS_REGRESSION_THRESHOLD = float(os.environ.get('GAS_REGRESSION_THRESHOLD', '0.05'))
+
+# The number of bUSDL holders, Nest positions and collateral tokens per account to benchmark with
+HOLDER_SCALES = [1, 8, 32]
+POSITION_SCALES = [1, 8, 32]
+COLLATERAL_SCALES = [1, 2, 4]
+
+
+class TestGasBenchmark(BoaTest):
+    # Typically, we will set the owner to be the address that deploys the contract. However, the test suite uses a different script hash for the caller.
+    OWNER_SCRIPT_HASH = UInt160(b'\x9c\xa5/\x04"{\xf6Z\xe2\xe5\xd1\xffe\x03\xd1\x9dd\xc2\x9cF')
+    OTHER_SCRIPT_HASH = UInt160(b'\xf7\x82<X\xb5:\xcf\xe8\xb4e\xa67C\xcb}2;..b')
+    ORACLE_SCRIPT_HASH = UInt160(b'X\x87\x17\x11~\n\xa8\x10r\xaf\xabq\xd2\xdd\x89\xfe|K\x92\xfe')
+
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.gas_baseline = {}
+        if os.path.isfile(GAS_BASELINE_PATH):
+            with open(GAS_BASELINE_PATH) as baseline_file:
+                cls.gas_baseline = json.load(baseline_file)
+        cls.gas_consumed = {}
+        cls.collateral_dir = tempfile.TemporaryDirectory()
+
+
+    def setUp(self):
+        super().setUp()
+        self.missing_baseline = []
+
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.collateral_dir.cleanup()
+        if UPDATE_GAS_BASELINE:
+            # Re-read the baseline, as other pytest-xdist workers may have updated it since setUpClass
+            gas_baseline = {}
+            if os.path.isfile(GAS_BASELINE_PATH):
+                with open(GAS_BASELINE_PATH) as baseline_file:
+                    gas_baseline = json.load(baseline_file)
+            gas_baseline.update(cls.gas_consumed)
+            with open(GAS_BASELINE_PATH, 'w') as baseline_file:
+                json.dump(gas_baseline, baseline_file, indent=4, sort_keys=True)
+                baseline_file.write('\n')
+        super().tearDownClass()
+
+
+    def get_path(self):
+        return fixtures.get_contract_path('src', 'BowerbirdNest.py')
+
+
+    def get_bneo_path(self):
+        return fixtures.get_contract_path('testsrc', 'BurgerNeoToken.py')
+
+
+    def get_busdl_path(self):
+        return fixtures.get_contract_path('src', 'BoweredUSDLToken.py')
+
+
+    def get_usdl_path(self):
+        return fixtures.get_contract_path('testsrc', 'LyrebirdUSDToken.py')
+
+
+    def get_collateral_path(self, index: int):
+        """
+        The first collateral is bNEO, and the others are copies of it with their own symbol and script hash
+        """
+        if index == 0:
+            return self.get_bneo_path()
+        collateral_path = os.path.join(self.collateral_dir.name, 'BurgerNeoToken{0}.py'.format(index))
+        if not os.path.isfile(collateral_path):
+            with open(fixtures.get_source_path('testsrc', 'BurgerNeoToken.py')) as bneo_file:
+                source = bneo_file.read()
+            with open(collateral_path, 'w') as collateral_file:
+                collateral_file.write(source.replace("TOKEN_SYMBOL = 'bNEO'", "TOKEN_SYMBOL = 'bNEO{0}'".format(index)))
+        return fixtures.compile_contract(collateral_path)
+
+
+    def get_address(self, path: str) -> UInt160:
+        return fixtures.get_address(path)
+
+
+    def get_account(self, index: int) -> UInt160:
+        return UInt160((index + 1).to_bytes(20, 'little'))
+
+
+    def record_gas(self, engine: TestEngine, name: str):
+        """
+        Records the GAS consumed by the last invocation, and fails if it regressed past the baseline
+        """
+        gas_consumed = engine.gas_consumed
+        self.gas_consumed[name] = gas_consumed
+        if UPDATE_GAS_BASELINE:
+            return
+        if name not in self.gas_baseline:
+            self.missing_baseline.append(name)
+            return
+        max_gas_consumed = int(self.gas_baseline[name] * (1 + GAS_REGRESSION_THRESHOLD))
+        self.assertLessEqual(gas_consumed, max_gas_consumed,
+                             '{0} consumed {1} GAS, baseline is {2}'.format(name, gas_consumed, self.gas_baseline[name]))
+
+
+    def check_baseline(self):
+        """
+        Fails the benchmark if the baseline lacks any of the entries it recorded, so that a missing baseline isn't a silent pass
+        """
+        if len(self.missing_baseline) > 0:
+            self.fail('{0} have no entry in {1}, record them with UPDATE_GAS_BASELINE=1'.format(
+                ', '.join(self.missing_baseline), os.path.basename(GAS_BASELINE_PATH)))
+
+
+    def get_contract_paths(self, num_collateral: int) -> list:
+        return [self.get_path(), self.get_busdl_path(), self.get_usdl_path()] + [self.get_collateral_path(index) for index in range(num_collateral)]
+
+
+    def get_addresses(self, num_collateral: int) -> dict:
+        return {
+            'nest': self.get_address(self.get_path()),
+            'busdl': self.get_address(self.get_busdl_path()),
+            'usdl': self.get_address(self.get_usdl_path()),
+            'collateral': [self.get_address(self.get_collateral_path(index)) for index in range(num_collateral)],
+        }
+
+
+    def get_deployed_engine(self, num_collateral: int) -> TestEngine:
+        """
+        A copy of an engine where deploy ran with num_collateral collateral tokens, which is deployed once per session
+        """
+        return fixtures.get_engine('gas.deployed[collateral={0}]'.format(num_collateral), self.get_contract_paths(num_collateral),
+                                   lambda engine: self.deploy(engine, num_collateral))
+
+
+    def deploy(self, engine: TestEngine, num_collateral: int):
+        """
+        Deploys and wires the Nest, bUSDL, USDL and num_collateral collateral tokens
+        """
+        path = self.get_path()
+        busdl_path = self.get_busdl_path()
+        usdl_path = self.get_usdl_path()
+        collateral_paths = [self.get_collateral_path(index) for index in range(num_collateral)]
+        addresses = self.get_addresses(num_collateral)
+
+        for contract_path in [path, busdl_path, usdl_path] + collateral_paths:
+            self.run_smart_contract(engine, contract_path, '_deploy', None, False,
+                                             signer_accounts=[self.OWNER_SCRIPT_HASH])
+
+        self.run_smart_contract(engine, busdl_path, 'setNestScriptHash', addresses['nest'],
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        self.run_smart_contract(engine, busdl_path, 'setUnderlyingScriptHash', addresses['usdl'],
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+
+        self.run_smart_contract(engine, path, 'setBNEOScriptHash', addresses['collateral'][0],
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        for collateral_address in addresses['collateral'][1:]:
+            self.run_smart_contract(engine, path, 'supportCollateral', collateral_address,
+                                             signer_accounts=[self.OWNER_SCRIPT_HASH])
+        self.run_smart_contract(engine, path, 'setBUSDLScriptHash', addresses['busdl'],
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        self.run_smart_contract(engine, path, 'setUSDLScriptHash', addresses['usdl'],
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+
+        self.run_smart_contract(engine, usdl_path, 'transfer', self.OWNER_SCRIPT_HASH, addresses['busdl'],
+                                         100_000 * TOKEN_MULT, [ 'ACTION_DEPOSIT' ],
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+
+
+    def get_oracle_result(self, num_collateral: int, collateral_price: int) -> bytes:
+        prices = {'USDL': 1_000_000, 'bNEO': collateral_price}
+        for index in range(1, num_collateral):
+            prices['bNEO{0}'.format(index)] = collateral_price
+        return json.dumps(prices).encode()
+
+
+    def collateralize(self, engine: TestEngine, addresses: dict, account: UInt160, num_collateral: int):
+        for index in range(num_collateral):
+            collateral_path = self.get_collateral_path(index)
+            self.run_smart_contract(engine, collateral_path, 'transfer', self.OWNER_SCRIPT_HASH, account, 1000 * TOKEN_MULT, None,
+                                             signer_accounts=[self.OWNER_SCRIPT_HASH])
+            self.run_smart_contract(engine, collateral_path, 'transfer', account, addresses['nest'], 1000 * TOKEN_MULT, [ 'ACTION_COLLATERALIZE' ],
+                                             signer_accounts=[account])
+
+
+    def test_gas_busdl(self):
+        busdl_path = self.get_busdl_path()
+        usdl_path = self.get_usdl_path()
+
+        for num_holders in HOLDER_SCALES:
+            engine = self.get_deployed_engine(1)
+            addresses = self.get_addresses(1)
+            scale = '[holders={0}]'.format(num_holders)
+
+            # The owner already holds bUSDL from the deposit in deploy
+            for index in range(num_holders - 1):
+                self.run_smart_contract(engine, busdl_path, 'transfer', self.OWNER_SCRIPT_HASH, self.get_account(index), 1000, None,
+                                                 signer_accounts=[self.OWNER_SCRIPT_HASH])
+
+            self.run_smart_contract(engine, busdl_path, 'balanceOf', self.OWNER_SCRIPT_HASH)
+            self.record_gas(engine, 'busdl.balanceOf' + scale)
+            self.run_smart_contract(engine, busdl_path, 'getExchangeRate')
+            self.record_gas(engine, 'busdl.getExchangeRate' + scale)
+            self.run_smart_contract(engine, busdl_path, 'getInterestMultiplier')
+            self.record_gas(engine, 'busdl.getInterestMultiplier' + scale)
+            self.run_smart_contract(engine, busdl_path, 'getBalancesFrom', 0, num_holders)
+            self.record_gas(engine, 'busdl.getBalancesFrom' + scale)
+            # getBalances skips the holders of the earlier pages, while getBalancesFrom starts at its cursor
+            self.run_smart_contract(engine, busdl_path, 'getBalances', num_holders - 1, 1)
+            self.record_gas(engine, 'busdl.getBalances[page=last]' + scale)
+            self.run_smart_contract(engine, busdl_path, 'getBalancesFrom', num_holders - 1, 1)
+            self.record_gas(engine, 'busdl.getBalancesFrom[page=last]' + scale)
+            self.run_smart_contract(engine, busdl_path, 'balanceOfBatch', [self.OWNER_SCRIPT_HASH] + [self.get_account(index) for index in range(num_holders - 1)])
+            self.record_gas(engine, 'busdl.balanceOfBatch' + scale)
+            self.run_smart_contract(engine, busdl_path, 'getPoolState')
+            self.record_gas(engine, 'busdl.getPoolState' + scale)
+            self.run_smart_contract(engine, busdl_path, 'getUtilization')
+            self.record_gas(engine, 'busdl.getUtilization' + scale)
+
+            self.run_smart_contract(engine, busdl_path, 'transfer', self.OWNER_SCRIPT_HASH, self.OTHER_SCRIPT_HASH, 1000, None,
+                                             signer_accounts=[self.OWNER_SCRIPT_HASH])
+            self.record_gas(engine, 'busdl.transfer' + scale)
+
+            engine.increase_block(engine.height + 1)
+            self.run_smart_contract(engine, usdl_path, 'transfer', self.OWNER_SCRIPT_HASH, addresses['busdl'], 1000 * TOKEN_MULT, [ 'ACTION_DEPOSIT' ],
+                                             signer_accounts=[self.OWNER_SCRIPT_HASH])
+            self.record_gas(engine, 'busdl.deposit' + scale)
+
+            engine.increase_block(engine.height + 1)
+            self.run_smart_contract(engine, busdl_path, 'transfer', self.OWNER_SCRIPT_HASH, addresses['busdl'], 500 * TOKEN_MULT, [ 'ACTION_REDEEM' ],
+                                             signer_accounts=[self.OWNER_SCRIPT_HASH])
+            self.record_gas(engine, 'busdl.redeem' + scale)
+
+            recipients = [[self.get_account(index), 1000] for index in range(num_holders)]
+            self.run_smart_contract(engine, busdl_path, 'transferMany', self.OWNER_SCRIPT_HASH, recipients, None,
+                                             signer_accounts=[self.OWNER_SCRIPT_HASH])
+            self.record_gas(engine, 'busdl.transferMany' + scale)
+
+            # bUSDL lends to whoever the Nest names, so the Nest signs for it directly
+            accounts = [self.get_account(index) for index in range(num_holders)]
+            for account in accounts:
+                self.run_smart_contract(engine, busdl_path, 'loan', account, 10 * TOKEN_MULT,
+                                                 signer_accounts=[addresses['nest']])
+            self.record_gas(engine, 'busdl.loan' + scale)
+
+            engine.increase_block(engine.height + 1)
+            self.run_smart_contract(engine, busdl_path, 'loanedBalanceOf', accounts[0])
+            self.record_gas(engine, 'busdl.loanedBalanceOf' + scale)
+            self.run_smart_contract(engine, busdl_path, 'loanedBalanceOfBatch', accounts)
+            self.record_gas(engine, 'busdl.loanedBalanceOfBatch' + scale)
+
+            self.run_smart_contract(engine, usdl_path, 'transfer', self.OWNER_SCRIPT_HASH, addresses['busdl'], 5 * TOKEN_MULT, [ 'ACTION_REPAYMENT', accounts[0] ],
+                                             signer_accounts=[self.OWNER_SCRIPT_HASH])
+            self.record_gas(engine, 'busdl.repayment' + scale)
+
+        self.check_baseline()
+
+
+    def test_gas_busdl_owner(self):
+        busdl_path = self.get_busdl_path()
+        engine = self.get_deployed_engine(1)
+
+        # The interest rate model is benchmarked with its current value, so that the deployment stays valid
+        interest_rate_model = self.run_smart_contract(engine, busdl_path, 'getInterestRateModel')
+        self.run_smart_contract(engine, busdl_path, 'setInterestRateModel', *interest_rate_model,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        self.record_gas(engine, 'busdl.setInterestRateModel')
+
+        self.check_baseline()
+
+
+    def test_gas_nest(self):
+        path = self.get_path()
+        usdl_path = self.get_usdl_path()
+
+        for num_collateral in COLLATERAL_SCALES:
+            for num_positions in POSITION_SCALES:
+                engine = self.get_deployed_engine(num_collateral)
+                addresses = self.get_addresses(num_collateral)
+                scale = '[collateral={0},positions={1}]'.format(num_collateral, num_positions)
+
+                # The owner holds the benchmarked position, the others are prior positions
+                for index in range(num_positions - 1):
+                    self.collateralize(engine, addresses, self.get_account(index), num_collateral)
+
+                self.run_smart_contract(engine, self.get_collateral_path(0), 'transfer', self.OWNER_SCRIPT_HASH, addresses['nest'], 1000 * TOKEN_MULT, [ 'ACTION_COLLATERALIZE' ],
+                                                 signer_accounts=[self.OWNER_SCRIPT_HASH])
+                self.record_gas(engine, 'nest.depositCollateral' + scale)
+                for index in range(1, num_collateral):
+                    self.run_smart_contract(engine, self.get_collateral_path(index), 'transfer', self.OWNER_SCRIPT_HASH, addresses['nest'], 1000 * TOKEN_MULT, [ 'ACTION_COLLATERALIZE' ],
+                                                     signer_accounts=[self.OWNER_SCRIPT_HASH])
+
+                self.run_smart_contract(engine, path, 'getPositions', 0, num_positions, True)
+                self.record_gas(engine, 'nest.getPositions' + scale)
+                self.run_smart_contract(engine, path, 'getAccountDashboard', self.OWNER_SCRIPT_HASH)
+                self.record_gas(engine, 'nest.getAccountDashboard' + scale)
+
+                # The requests, whose callbacks are benchmarked below
+                self.run_smart_contract(engine, path, 'loan', self.OWNER_SCRIPT_HASH, addresses['busdl'], 10 * TOKEN_MULT,
+                                                 signer_accounts=[self.OWNER_SCRIPT_HASH])
+                self.record_gas(engine, 'nest.loan' + scale)
+                self.run_smart_contract(engine, path, 'withdrawCollateral', self.OWNER_SCRIPT_HASH, addresses['collateral'][0], 10 * TOKEN_MULT,
+                                                 signer_accounts=[self.OWNER_SCRIPT_HASH])
+                self.record_gas(engine, 'nest.withdrawCollateral' + scale)
+
+                oracle_result = self.get_oracle_result(num_collateral, 1_000_000)
+                loan_data = {
+                    'account': self.OWNER_SCRIPT_HASH,
+                    'loan_token': addresses['busdl'],
+                    'loan_quantity': 700 * TOKEN_MULT * num_collateral,
+                }
+                self.run_smart_contract(engine, path, 'loanCallback', 'url', loan_data, 0, oracle_result,
+                                                 signer_accounts=[self.ORACLE_SCRIPT_HASH])
+                self.record_gas(engine, 'nest.loanCallback' + scale)
+
+                withdraw_collateral_data = {
+                    'account': self.OWNER_SCRIPT_HASH,
+                    'collateral_token': addresses['collateral'][0],
+                    'withdraw_quantity': 10 * TOKEN_MULT,
+                }
+                self.run_smart_contract(engine, path, 'withdrawCollateralCallback', 'url', withdraw_collateral_data, 0, oracle_result,
+                                                 signer_accounts=[self.ORACLE_SCRIPT_HASH])
+                self.record_gas(engine, 'nest.withdrawCollateralCallback' + scale)
+
+                # The liquidator sends USDL to the Nest ahead of the callback
+                self.run_smart_contract(engine, usdl_path, 'transfer', self.OWNER_SCRIPT_HASH, addresses['nest'], 100 * TOKEN_MULT, None,
+                                                 signer_accounts=[self.OWNER_SCRIPT_HASH])
+                liquidate_data = {
+                    'liquidator': self.OTHER_SCRIPT_HASH,
+                    'account': self.OWNER_SCRIPT_HASH,
+                    'collateral_token': addresses['collateral'][0],
+                    'usdl_quantity': 100 * TOKEN_MULT,
+                }
+                oracle_result = self.get_oracle_result(num_collateral, 500_000)
+                self.run_smart_contract(engine, path, 'liquidateCallback', 'url', liquidate_data, 0, oracle_result,
+                                                 signer_accounts=[self.ORACLE_SCRIPT_HASH])
+                self.record_gas(engine, 'nest.liquidateCallback' + scale)
+
+        self.check_baseline()
+
+
+    def test_gas_nest_owner(self):
+        path = self.get_path()
+        engine = self.get_deployed_engine(1)
+        addresses = self.get_addresses(1)
+        token = addresses['collateral'][0]
+
+        # Each setter is benchmarked with the current value, so that the deployment stays valid
+        for name in ['LoanToValue', 'LiquidationPenalty']:
+            value = self.run_smart_contract(engine, path, 'get' + name, token)
+            self.run_smart_contract(engine, path, 'set' + name, token, value,
+                                             signer_accounts=[self.OWNER_SCRIPT_HASH])
+            self.record_gas(engine, 'nest.set' + name)
+        value = self.run_smart_contract(engine, path, 'getMaxLiquidationRatio', token)
+        self.run_smart_contract(engine, path, 'setMaxLiquiationRatio', token, value,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        self.record_gas(engine, 'nest.setMaxLiquiationRatio')
+        for name in ['OracleFee', 'PriceFreshness', 'AuctionDuration', 'AuctionPenaltyFloor']:
+            value = self.run_smart_contract(engine, path, 'get' + name)
+            self.run_smart_contract(engine, path, 'set' + name, value,
+                                             signer_accounts=[self.OWNER_SCRIPT_HASH])
+            self.record_gas(engine, 'nest.set' + name)
+
+        # The collateral records, read and written against every supported collateral
+        for num_collateral in COLLATERAL_SCALES:
+            engine = self.get_deployed_engine(num_collateral)
+            addresses = self.get_addresses(num_collateral)
+            scale = '[collateral={0}]'.format(num_collateral)
+            token = addresses['collateral'][-1]
+            self.collateralize(engine, addresses, self.OWNER_SCRIPT_HASH, num_collateral)
+
+            self.run_smart_contract(engine, path, 'getTotalCollaterals')
+            self.record_gas(engine, 'nest.getTotalCollaterals' + scale)
+            self.run_smart_contract(engine, path, 'getCollateralParameters', token)
+            self.record_gas(engine, 'nest.getCollateralParameters' + scale)
+            self.run_smart_contract(engine, path, 'updateCollateralMetadata', token,
+                                             signer_accounts=[self.OWNER_SCRIPT_HASH])
+            self.record_gas(engine, 'nest.updateCollateralMetadata' + scale)
+            self.run_smart_contract(engine, path, 'invalidateCollateral', token,
+                                             signer_accounts=[self.OWNER_SCRIPT_HASH])
+            self.record_gas(engine, 'nest.invalidateCollateral' + scale)
+            self.run_smart_contract(engine, path, 'supportCollateral', token,
+                                             signer_accounts=[self.OWNER_SCRIPT_HASH])
+            self.record_gas(engine, 'nest.supportCollateral' + scale)
+
+        self.check_baseline()
+
+
+    def test_gas_nest_batch(self):
+        path = self.get_path()
+
+        for num_collateral in COLLATERAL_SCALES:
+            engine = self.get_deployed_engine(num_collateral)
+            addresses = self.get_addresses(num_collateral)
+            scale = '[collateral={0}]'.format(num_collateral)
+            self.collateralize(engine, addresses, self.OWNER_SCRIPT_HASH, num_collateral)
+
+            # A full batch of loans and withdrawals answered by a single Oracle response
+            actions = []
+            for index in range(MAX_BATCH_SIZE // 2):
+                actions.append([ 'ACTION_LOAN', self.OWNER_SCRIPT_HASH, addresses['busdl'], 10 * TOKEN_MULT ])
+                actions.append([ 'ACTION_WITHDRAW', self.OWNER_SCRIPT_HASH, addresses['collateral'][index % num_collateral], 10 * TOKEN_MULT ])
+            self.run_smart_contract(engine, path, 'batch', actions,
+                                             signer_accounts=[self.OWNER_SCRIPT_HASH])
+            self.record_gas(engine, 'nest.batch' + scale)
+
+            request_id = engine.get_events('OracleRequest')[-1].arguments[0]
+            self.run_oracle_response(engine, request_id, OracleResponseCode.Success, self.get_oracle_result(num_collateral, 1_000_000))
+            self.record_gas(engine, 'nest.batchCallback' + scale)
+            # The callback stays within the response GAS requested for it
+            oracle_fee = self.run_smart_contract(engine, path, 'getOracleFee')
+            self.assertLessEqual(self.gas_consumed['nest.batchCallback' + scale], oracle_fee + CALLBACK_ACTION_GAS * len(actions))
+
+        self.check_baseline()
+
+
+    def test_gas_nest_liquidate_targets(self):
+        path = self.get_path()
+        usdl_path = self.get_usdl_path()
+
+        for num_positions in POSITION_SCALES:
+            engine = self.get_deployed_engine(1)
+            addresses = self.get_addresses(1)
+            scale = '[positions={0}]'.format(num_positions)
+            oracle_result = self.get_oracle_result(1, 1_000_000)
+
+            accounts = [self.get_account(index) for index in range(num_positions)]
+            for account in accounts:
+                self.collateralize(engine, addresses, account, 1)
+                loan_data = {
+                    'account': account,
+                    'loan_token': addresses['busdl'],
+                    'loan_quantity': 700 * TOKEN_MULT,
+                }
+                self.run_smart_contract(engine, path, 'loanCallback', 'url', loan_data, 0, oracle_result,
+                                                 signer_accounts=[self.ORACLE_SCRIPT_HASH])
+            self.run_smart_contract(engine, usdl_path, 'transfer', self.OWNER_SCRIPT_HASH, self.OTHER_SCRIPT_HASH, 500 * TOKEN_MULT * num_positions, None,
+                                             signer_accounts=[self.OWNER_SCRIPT_HASH])
+
+            # Every position is liquidated against one Oracle response
+            targets = [[account, [addresses['collateral'][0]]] for account in accounts[:MAX_LIQUIDATE_PAIRS]]
+            self.run_smart_contract(engine, usdl_path, 'transfer', self.OTHER_SCRIPT_HASH, addresses['nest'], 250 * TOKEN_MULT * num_positions,
+                                             [ 'ACTION_LIQUIDATE', targets ],
+                                             signer_accounts=[self.OTHER_SCRIPT_HASH])
+            self.record_gas(engine, 'nest.liquidateTargets' + scale)
+
+            request_id = engine.get_events('OracleRequest')[-1].arguments[0]
+            self.run_oracle_response(engine, request_id, OracleResponseCode.Success, self.get_oracle_result(1, 500_000))
+            self.record_gas(engine, 'nest.liquidateTargetsCallback' + scale)
+            oracle_fee = self.run_smart_contract(engine, path, 'getOracleFee')
+            self.assertLessEqual(self.gas_consumed['nest.liquidateTargetsCallback' + scale], oracle_fee + CALLBACK_ACTION_GAS * len(targets))
+
+            # A request whose response never comes is refunded once it expires
+            self.run_smart_contract(engine, usdl_path, 'transfer', self.OTHER_SCRIPT_HASH, addresses['nest'], 250 * TOKEN_MULT * num_positions,
+                                             [ 'ACTION_LIQUIDATE', targets ],
+                                             signer_accounts=[self.OTHER_SCRIPT_HASH])
+            batch_request_id = engine.get_events('BatchRequest', origin=addresses['nest'])[-1].arguments[0]
+            engine.increase_block(engine.height + REQUEST_EXPIRY)
+            self.run_smart_contract(engine, path, 'reclaimRequest', batch_request_id)
+            self.record_gas(engine, 'nest.reclaimRequest' + scale)
+
+        self.check_baseline()
+
+
+    def test_gas_nest_auction(self):
+        path = self.get_path()
+        usdl_path = self.get_usdl_path()
+
+        for num_collateral in COLLATERAL_SCALES:
+            engine = self.get_deployed_engine(num_collateral)
+            addresses = self.get_addresses(num_collateral)
+            scale = '[collateral={0}]'.format(num_collateral)
+            self.run_smart_contract(engine, path, 'setAuctionDuration', 240,
+                                             signer_accounts=[self.OWNER_SCRIPT_HASH])
+            self.collateralize(engine, addresses, self.OWNER_SCRIPT_HASH, num_collateral)
+
+            loan_data = {
+                'account': self.OWNER_SCRIPT_HASH,
+                'loan_token': addresses['busdl'],
+                'loan_quantity': 700 * TOKEN_MULT * num_collateral,
+            }
+            self.run_smart_contract(engine, path, 'loanCallback', 'url', loan_data, 0, self.get_oracle_result(num_collateral, 1_000_000),
+                                             signer_accounts=[self.ORACLE_SCRIPT_HASH])
+
+            liquidate_data = {
+                'liquidator': self.OTHER_SCRIPT_HASH,
+                'account': self.OWNER_SCRIPT_HASH,
+                'collateral_token': addresses['collateral'][0],
+                'usdl_quantity': 100 * TOKEN_MULT,
+            }
+            oracle_result = self.get_oracle_result(num_collateral, 500_000)
+            # The first liquidation opens the auction, and the next one fills it at a decayed penalty
+            for name in ['nest.liquidateCallback[auction=open]', 'nest.liquidateCallback[auction=fill]']:
+                self.run_smart_contract(engine, usdl_path, 'transfer', self.OWNER_SCRIPT_HASH, addresses['nest'], 100 * TOKEN_MULT, None,
+                                                 signer_accounts=[self.OWNER_SCRIPT_HASH])
+                self.run_smart_contract(engine, path, 'liquidateCallback', 'url', liquidate_data, 0, oracle_result,
+                                                 signer_accounts=[self.ORACLE_SCRIPT_HASH])
+                self.record_gas(engine, name + scale)
+                engine.increase_block(engine.height + 120)
+
+            self.run_smart_contract(engine, path, 'getLiquidationAuction', self.OWNER_SCRIPT_HASH, addresses['collateral'][0])
+            self.record_gas(engine, 'nest.getLiquidationAuction' + scale)
+
+        self.check_baseline()
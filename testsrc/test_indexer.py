@@ -0,0 +1,190 @@
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+from boa3_test.tests.test_classes.transactionattribute.oracleresponse import OracleResponseCode
+
+import fixtures
+from indexer import Indexer
+
+TOKEN_MULT = int(1e8)
+OWNER = b'\x01' * 20
+OTHER = b'\x02' * 20
+BUSDL = b'\x0b' * 20
+NEST = b'\x0e' * 20
+USDL = b'\x0d' * 20
+
+
+def notification(origin: bytes, name: str, *arguments) -> SimpleNamespace:
+    return SimpleNamespace(origin=origin, name=name, arguments=list(arguments))
+
+
+# A deposit, a collateralized loan, a liquidation and a redemption, as notified by the contracts
+BLOCKS = [
+    (1, [
+        notification(USDL, 'Transfer', OWNER, BUSDL, 1000 * TOKEN_MULT),
+        notification(BUSDL, 'Transfer', None, BUSDL, 1000 * TOKEN_MULT),
+        notification(BUSDL, 'Transfer', BUSDL, OWNER, 1000 * TOKEN_MULT),
+        notification(BUSDL, 'Deposit', OWNER, 1000 * TOKEN_MULT, 1000 * TOKEN_MULT),
+    ]),
+    (2, [
+        notification(NEST, 'CollateralDeposit', OTHER, 'bNEO', 1000 * TOKEN_MULT),
+        notification(BUSDL, 'Loan', OTHER, 700 * TOKEN_MULT),
+        notification(NEST, 'Loan', OTHER, 'USDL', 700 * TOKEN_MULT),
+    ]),
+    (5, [
+        notification(BUSDL, 'Repayment', OTHER, 250 * TOKEN_MULT),
+        notification(NEST, 'Liquidate', OWNER, OTHER, 'bNEO', 250 * TOKEN_MULT, 525 * TOKEN_MULT),
+        notification(BUSDL, 'Transfer', OWNER, BUSDL, 400 * TOKEN_MULT),
+        # bUSDL notifies its burns as transfers from None too
+        notification(BUSDL, 'Transfer', None, BUSDL, 400 * TOKEN_MULT),
+        notification(BUSDL, 'Redeem', OWNER, 400 * TOKEN_MULT, 400 * TOKEN_MULT),
+    ]),
+]
+
+
+class TestIndexer(unittest.TestCase):
+
+    def test_indexer_apply_blocks(self):
+        indexer = Indexer(':memory:', BUSDL, NEST)
+        self.assertEqual(-1, indexer.checkpoint)
+        self.assertEqual(3, indexer.apply_blocks(BLOCKS))
+        self.assertEqual(5, indexer.checkpoint)
+
+        self.assertEqual(600 * TOKEN_MULT, indexer.balance_of(BUSDL, OWNER))
+        self.assertEqual(0, indexer.balance_of(BUSDL, BUSDL))
+        self.assertEqual([(OWNER, 600 * TOKEN_MULT)], indexer.get_balances(BUSDL))
+        self.assertEqual(-1000 * TOKEN_MULT, indexer.balance_of(USDL, OWNER))
+
+        self.assertEqual(450 * TOKEN_MULT, indexer.principal_of(OTHER))
+        self.assertEqual({'bNEO': 475 * TOKEN_MULT}, indexer.collateral_of(OTHER))
+        self.assertEqual(475 * TOKEN_MULT, indexer.total_collateral('bNEO'))
+
+        # Repayments beyond the principal are refunded, and zero rows are dropped
+        indexer.apply_block(6, [
+            notification(BUSDL, 'Repayment', OTHER, 500 * TOKEN_MULT),
+            notification(NEST, 'CollateralWithdraw', OTHER, 'bNEO', 475 * TOKEN_MULT),
+        ])
+        self.assertEqual(0, indexer.principal_of(OTHER))
+        self.assertEqual({}, indexer.collateral_of(OTHER))
+        self.assertEqual(0, indexer.connection.execute('SELECT COUNT(*) FROM principal').fetchone()[0])
+
+
+    def test_indexer_resume(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'index.sqlite')
+            indexer = Indexer(path, BUSDL, NEST)
+            self.assertEqual(2, indexer.apply_blocks(BLOCKS[:2]))
+            indexer.close()
+
+            # The checkpoint survives a restart, and the blocks before it are skipped
+            indexer = Indexer(path, BUSDL, NEST)
+            self.assertEqual(2, indexer.checkpoint)
+            self.assertEqual(1, indexer.apply_blocks(BLOCKS))
+            self.assertEqual(450 * TOKEN_MULT, indexer.principal_of(OTHER))
+            self.assertEqual(600 * TOKEN_MULT, indexer.balance_of(BUSDL, OWNER))
+
+            # A block which fails is rolled back with its checkpoint
+            with self.assertRaises(ValueError):
+                indexer.apply_block(7, [
+                    notification(NEST, 'CollateralDeposit', OWNER, 'bNEO', 100 * TOKEN_MULT),
+                    notification(NEST, 'CollateralDeposit', OWNER),
+                ])
+            self.assertEqual(5, indexer.checkpoint)
+            self.assertEqual({}, indexer.collateral_of(OWNER))
+            indexer.close()
+
+
+    def test_indexer_accrued_interest(self):
+        indexer = Indexer(':memory:', BUSDL, NEST)
+        indexer.apply_block(2, [notification(BUSDL, 'Loan', OTHER, 700 * TOKEN_MULT)])
+
+        # The loan grows to 750 USDL over the following blocks, which isn't notified, so the principal stays at what was lent
+        indexer.apply_block(100_000, [])
+        self.assertEqual(700 * TOKEN_MULT, indexer.principal_of(OTHER))
+
+        # Repaying the 50 USDL of interest leaves a loan of 700 USDL, while the index only subtracts the repayment
+        indexer.apply_block(100_001, [notification(BUSDL, 'Repayment', OTHER, 50 * TOKEN_MULT)])
+        self.assertEqual(650 * TOKEN_MULT, indexer.principal_of(OTHER))
+
+        # Repaying the whole loan clears the principal, as the repayment is clipped to it
+        indexer.apply_block(100_002, [notification(BUSDL, 'Repayment', OTHER, 700 * TOKEN_MULT)])
+        self.assertEqual(0, indexer.principal_of(OTHER))
+
+
+class TestNestIndexer(fixtures.NestTemplate):
+
+    def test_nest_indexer(self):
+        path = self.get_path()
+        bneo_path = self.get_bneo_path()
+        busdl_path = self.get_busdl_path()
+        usdl_path = self.get_usdl_path()
+        engine = self.get_wired_engine()
+
+        nest_address = self.get_address(path)
+        bneo_address = self.get_address(bneo_path)
+        busdl_address = self.get_address(busdl_path)
+        usdl_address = self.get_address(usdl_path)
+
+        state_indexer = Indexer(':memory:', busdl_address, nest_address)
+        blocks = []
+
+        def index_notifications():
+            # Each invocation is indexed as a block of its own
+            num_notifications = sum(len(notifications) for block_index, notifications in blocks)
+            blocks.append((len(blocks), engine.get_events()[num_notifications:]))
+            state_indexer.apply_blocks(blocks)
+
+        index_notifications()
+        self.run_smart_contract(engine, bneo_path, 'transfer', self.OWNER_SCRIPT_HASH, nest_address, 1000 * TOKEN_MULT, [ 'ACTION_COLLATERALIZE' ],
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        index_notifications()
+        self.run_smart_contract(engine, usdl_path, 'transfer', self.OWNER_SCRIPT_HASH, self.LIQUIDATOR_SCRIPT_HASH, 300 * TOKEN_MULT, None,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        index_notifications()
+        loan_data = {
+            'account': self.OWNER_SCRIPT_HASH,
+            'loan_quantity': 700 * TOKEN_MULT,
+            'loan_token': busdl_address,
+        }
+        self.run_smart_contract(engine, path, 'loanCallback', 'url', loan_data, 0, b'{"USDL":1000000,"bNEO":1000000}',
+                                         signer_accounts=[self.ORACLE_SCRIPT_HASH])
+        index_notifications()
+        # Interest accrues on the loan without any notification
+        engine.increase_block(engine.height + (4 * 60))
+
+        self.run_smart_contract(engine, usdl_path, 'transfer', self.LIQUIDATOR_SCRIPT_HASH, nest_address, 300 * TOKEN_MULT,
+                                         [ 'ACTION_LIQUIDATE', [ [ self.OWNER_SCRIPT_HASH, [ bneo_address ] ] ] ],
+                                         signer_accounts=[self.LIQUIDATOR_SCRIPT_HASH])
+        index_notifications()
+        request_id = engine.get_events('OracleRequest')[-1].arguments[0]
+        self.run_oracle_response(engine, request_id, OracleResponseCode.Success, b'{"USDL":1000000,"bNEO":500000}')
+        index_notifications()
+        self.run_smart_contract(engine, busdl_path, 'transfer', self.OWNER_SCRIPT_HASH, busdl_address, 100 * TOKEN_MULT, [ 'ACTION_REDEEM' ],
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        index_notifications()
+        self.assertEqual(len(blocks) - 1, state_indexer.checkpoint)
+
+        # The index agrees with the contracts
+        for account in [self.OWNER_SCRIPT_HASH, self.LIQUIDATOR_SCRIPT_HASH]:
+            result = self.run_smart_contract(engine, path, 'getCollateralBalance', bneo_address, account)
+            self.assertEqual(result, state_indexer.collateral_of(account).get('bNEO', 0))
+        for account in [self.OWNER_SCRIPT_HASH, self.LIQUIDATOR_SCRIPT_HASH, busdl_address, nest_address]:
+            for token_address, token_path in [(busdl_address, busdl_path), (usdl_address, usdl_path), (bneo_address, bneo_path)]:
+                result = self.run_smart_contract(engine, token_path, 'balanceOf', account)
+                self.assertEqual(result, state_indexer.balance_of(token_address, account))
+        # Except for the principal, which excludes the accrued interest of the debt
+        result = self.run_smart_contract(engine, busdl_path, 'loanedBalanceOf', self.OWNER_SCRIPT_HASH)
+        self.assertGreater(result, state_indexer.principal_of(self.OWNER_SCRIPT_HASH))
+        result = self.run_smart_contract(engine, busdl_path, 'loanedBalanceOf', self.LIQUIDATOR_SCRIPT_HASH)
+        self.assertEqual(result, state_indexer.principal_of(self.LIQUIDATOR_SCRIPT_HASH))
+
+        result = self.run_smart_contract(engine, busdl_path, 'getBalances', 0, 10)
+        self.assertEqual(result, [list(balance) for balance in state_indexer.get_balances(busdl_address)])
+        self.assertEqual({'bNEO': (1000 - 525) * TOKEN_MULT}, state_indexer.collateral_of(self.OWNER_SCRIPT_HASH))
+        self.assertEqual(450 * TOKEN_MULT, state_indexer.principal_of(self.OWNER_SCRIPT_HASH))
+
+
+if __name__ == '__main__':
+    unittest.main()
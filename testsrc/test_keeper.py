@@ -0,0 +1,248 @@
+import asyncio
+import unittest
+from types import SimpleNamespace
+
+from boa3.builtin.type import UInt160
+from boa3_test.tests.test_classes.transactionattribute.oracleresponse import OracleResponseCode
+
+import fixtures
+from keeper import Collateral, Keeper, PositionIndex, PriceServer, fetch_prices, liquidate_data, read_prices
+
+TOKEN_MULT = int(1e8)
+OWNER = b'\x01' * 20
+OTHER = b'\x02' * 20
+LIQUIDATOR = b'\x03' * 20
+BNEO = b'\x0b' * 20
+FLM = b'\x0f' * 20
+
+
+def get_index() -> PositionIndex:
+    return PositionIndex({
+        'bNEO': Collateral(BNEO, 7500, 5000),
+        'FLM': Collateral(FLM, 5000, 5000),
+    })
+
+
+def notification(name: str, *arguments) -> SimpleNamespace:
+    return SimpleNamespace(name=name, arguments=list(arguments))
+
+
+class TestKeeper(unittest.TestCase):
+
+    def test_keeper_position_index(self):
+        index = get_index()
+        index.apply_events([
+            notification('CollateralDeposit', OWNER, 'bNEO', 1000 * TOKEN_MULT),
+            notification('Loan', OWNER, 'USDL', 700 * TOKEN_MULT),
+            # bUSDL notifies the same loan
+            notification('Loan', OWNER, 700 * TOKEN_MULT),
+            notification('Transfer', OWNER, OTHER, 1),
+        ])
+        self.assertEqual({'bNEO': 1000 * TOKEN_MULT}, index.positions[OWNER].collateral)
+        self.assertEqual(700 * TOKEN_MULT, index.positions[OWNER].debt)
+
+        # Matches test_economics_liquidate
+        self.assertEqual(75_000_000_000_000_000, index.collateral_ltv(OWNER, {'USDL': 1_000_000, 'bNEO': 1_000_000}))
+        self.assertEqual(37_500_000_000_000_000, index.collateral_ltv(OWNER, {'USDL': 1_000_000, 'bNEO': 500_000}))
+        self.assertFalse(index.is_eligible(OWNER, {'USDL': 1_000_000, 'bNEO': 1_000_000}))
+        self.assertTrue(index.is_eligible(OWNER, {'USDL': 1_000_000, 'bNEO': 500_000}))
+        # Half of the collateral at 0.5 USDL
+        self.assertEqual(250 * TOKEN_MULT, index.liquidation_quantity(OWNER, {'USDL': 1_000_000, 'bNEO': 500_000}))
+
+        # Liquidate takes the collateral, while bUSDL notifies the repayment
+        index.apply_events([
+            notification('Liquidate', LIQUIDATOR, OWNER, 'bNEO', 250 * TOKEN_MULT, 525 * TOKEN_MULT),
+            notification('Repayment', OWNER, 250 * TOKEN_MULT),
+        ])
+        self.assertEqual({'bNEO': 475 * TOKEN_MULT}, index.positions[OWNER].collateral)
+        self.assertEqual(450 * TOKEN_MULT, index.positions[OWNER].debt)
+
+        # Overpayments are refunded, and closed positions are dropped
+        index.apply_events([
+            notification('Repayment', OWNER, 500 * TOKEN_MULT),
+            notification('CollateralWithdraw', OWNER, 'bNEO', 475 * TOKEN_MULT),
+        ])
+        self.assertEqual({}, index.positions)
+        self.assertFalse(index.is_eligible(OTHER, {'USDL': 1_000_000}))
+        self.assertEqual({}, index.positions)
+
+
+    def test_keeper_targets(self):
+        index = get_index()
+        index.apply_events([
+            notification('CollateralDeposit', OWNER, 'bNEO', 100 * TOKEN_MULT),
+            notification('CollateralDeposit', OWNER, 'FLM', 1000 * TOKEN_MULT),
+            notification('Loan', OWNER, 'USDL', 100 * TOKEN_MULT),
+            notification('CollateralDeposit', OTHER, 'bNEO', 1000 * TOKEN_MULT),
+            notification('Loan', OTHER, 'USDL', 700 * TOKEN_MULT),
+        ])
+        price_map = {'USDL': 1_000_000, 'bNEO': 500_000, 'FLM': 100_000}
+
+        # Largest loans first, and the collateral of each account by value
+        self.assertEqual([[OTHER, [BNEO]], [OWNER, [FLM, BNEO]]], index.get_targets(price_map, 32))
+        self.assertEqual([[OTHER, [BNEO]]], index.get_targets(price_map, 1))
+        # The collateral tokens are capped over all the targets
+        self.assertEqual([[OTHER, [BNEO]], [OWNER, [FLM]]], index.get_targets(price_map, 2))
+        self.assertEqual([[OWNER, [FLM, BNEO]]], index.get_targets(price_map, 32, {OTHER}))
+
+        index.set_debt(OWNER, 50 * TOKEN_MULT)
+        self.assertEqual([[OTHER, [BNEO]]], index.get_targets(price_map, 32))
+
+
+    def test_keeper_step(self):
+        index = get_index()
+        submissions = []
+        notifications = [
+            notification('CollateralDeposit', OWNER, 'bNEO', 1000 * TOKEN_MULT),
+            notification('Loan', OWNER, 'USDL', 700 * TOKEN_MULT),
+        ]
+
+        async def submit(targets, usdl_quantity):
+            submissions.append((liquidate_data(targets), usdl_quantity))
+
+        async def poll_events():
+            new_notifications = list(notifications)
+            notifications.clear()
+            return new_notifications
+
+        with PriceServer({'USDL': 1_000_000, 'bNEO': 1_000_000}) as price_server:
+            keeper = Keeper(index, submit, poll_events, get_prices=lambda: fetch_prices(price_server.url),
+                            usdl_budget=200 * TOKEN_MULT, pending_steps=2)
+
+            self.assertEqual([], asyncio.run(keeper.step()))
+            self.assertEqual([], submissions)
+
+            price_server.set_prices({'bNEO': 500_000})
+            self.assertEqual([[OWNER, [BNEO]]], asyncio.run(keeper.step()))
+            # The liquidation would take 250 USDL, which is clipped to the budget
+            self.assertEqual([(['ACTION_LIQUIDATE', [[OWNER, [BNEO]]]], 200 * TOKEN_MULT)], submissions)
+
+            # The account isn't submitted again while its liquidation is pending
+            self.assertEqual([], asyncio.run(keeper.step()))
+
+            # Until the Nest notifies the outcome
+            notifications.append(notification('LiquidateFailure', LIQUIDATOR, OWNER, 'bNEO', 200 * TOKEN_MULT, 'Oracle invocation failed'))
+            self.assertEqual([[OWNER, [BNEO]]], asyncio.run(keeper.step()))
+            self.assertEqual(2, len(submissions))
+
+
+    def test_keeper_read_debts(self):
+        index = get_index()
+        submissions = []
+        debts = {OWNER: 700 * TOKEN_MULT}
+        notifications = [
+            notification('CollateralDeposit', OWNER, 'bNEO', 1000 * TOKEN_MULT),
+            notification('Loan', OWNER, 'USDL', 700 * TOKEN_MULT),
+        ]
+
+        async def submit(targets, usdl_quantity):
+            submissions.append((liquidate_data(targets), usdl_quantity))
+
+        async def poll_events():
+            new_notifications = list(notifications)
+            notifications.clear()
+            return new_notifications
+
+        async def read_debts(accounts):
+            return [debts[account] for account in accounts]
+
+        with PriceServer({'USDL': 1_000_000, 'bNEO': 1_000_000}) as price_server:
+            keeper = Keeper(index, submit, poll_events, get_prices=lambda: fetch_prices(price_server.url),
+                            read_debts=read_debts)
+
+            self.assertEqual([], asyncio.run(keeper.step()))
+            self.assertEqual(700 * TOKEN_MULT, index.positions[OWNER].debt)
+
+            # The accrued interest alone makes the account eligible, without any notification
+            debts[OWNER] = 750 * TOKEN_MULT
+            self.assertEqual([[OWNER, [BNEO]]], asyncio.run(keeper.step()))
+            self.assertEqual(750 * TOKEN_MULT, index.positions[OWNER].debt)
+            self.assertEqual([(['ACTION_LIQUIDATE', [[OWNER, [BNEO]]]], 500 * TOKEN_MULT)], submissions)
+
+
+class TestNestKeeper(fixtures.NestTemplate):
+
+    def test_nest_keeper(self):
+        path = self.get_path()
+        bneo_path = self.get_bneo_path()
+        busdl_path = self.get_busdl_path()
+        usdl_path = self.get_usdl_path()
+        engine = self.get_wired_engine()
+
+        nest_address = self.get_address(path)
+        bneo_address = self.get_address(bneo_path)
+        busdl_address = self.get_address(busdl_path)
+
+        self.run_smart_contract(engine, bneo_path, 'transfer', self.OWNER_SCRIPT_HASH, nest_address, 1000 * TOKEN_MULT, [ 'ACTION_COLLATERALIZE' ],
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        self.run_smart_contract(engine, usdl_path, 'transfer', self.OWNER_SCRIPT_HASH, self.LIQUIDATOR_SCRIPT_HASH, 500 * TOKEN_MULT, None,
+                                         signer_accounts=[self.OWNER_SCRIPT_HASH])
+        loan_data = {
+            'account': self.OWNER_SCRIPT_HASH,
+            'loan_quantity': 700 * TOKEN_MULT,
+            'loan_token': busdl_address,
+        }
+        self.run_smart_contract(engine, path, 'loanCallback', 'url', loan_data, 0, b'{"USDL":1000000,"bNEO":1000000}',
+                                         signer_accounts=[self.ORACLE_SCRIPT_HASH])
+
+        collateral_parameters = self.run_smart_contract(engine, path, 'getCollateralParameters', bneo_address)
+        index = PositionIndex({
+            'bNEO': Collateral(bneo_address, collateral_parameters[3], collateral_parameters[4]),
+        })
+        num_notifications = 0
+
+        async def poll_events():
+            nonlocal num_notifications
+            notifications = engine.get_events()
+            new_notifications = notifications[num_notifications:]
+            num_notifications = len(notifications)
+            return new_notifications
+
+        with PriceServer({'USDL': 1000000, 'bNEO': 1000000}) as price_server:
+            async def submit(targets, usdl_quantity):
+                targets = [[UInt160(account), [UInt160(token) for token in tokens]] for account, tokens in targets]
+                self.run_smart_contract(engine, usdl_path, 'transfer', self.LIQUIDATOR_SCRIPT_HASH, nest_address, usdl_quantity,
+                                                 liquidate_data(targets),
+                                                 signer_accounts=[self.LIQUIDATOR_SCRIPT_HASH])
+                # Answer the Oracle request with the feed of the stand-in, as the Oracle nodes would with PRICE_URL
+                request_id = engine.get_events('OracleRequest')[-1].arguments[0]
+                self.run_oracle_response(engine, request_id, OracleResponseCode.Success, read_prices(price_server.url))
+
+            async def read_debts(accounts):
+                return self.run_smart_contract(engine, busdl_path, 'loanedBalanceOfBatch', [UInt160(account) for account in accounts])
+
+            liquidation_keeper = Keeper(index, submit, poll_events,
+                                               get_prices=lambda: fetch_prices(price_server.url),
+                                               read_debts=read_debts)
+
+            # The positions are indexed from the notifications, and none is eligible at these prices
+            self.assertEqual([], asyncio.run(liquidation_keeper.step()))
+            position = index.positions[bytes(self.OWNER_SCRIPT_HASH)]
+            self.assertEqual({'bNEO': 1000 * TOKEN_MULT}, position.collateral)
+            self.assertEqual(700 * TOKEN_MULT, position.debt)
+
+            price_server.set_prices({'bNEO': 500000})
+            targets = asyncio.run(liquidation_keeper.step())
+            self.assertEqual([[bytes(self.OWNER_SCRIPT_HASH), [bneo_address]]], targets)
+
+        # The keeper sent what the Nest takes for half of the collateral
+        liquidate_events = engine.get_events('Liquidate', origin=nest_address)
+        self.assertEqual(1, len(liquidate_events))
+        args = liquidate_events[0].arguments
+        self.assertEqual(self.LIQUIDATOR_SCRIPT_HASH, args[0])
+        self.assertEqual(self.OWNER_SCRIPT_HASH, args[1])
+        self.assertEqual(250 * TOKEN_MULT, args[3])
+        self.assertEqual(525 * TOKEN_MULT, args[4])
+
+        result = self.run_smart_contract(engine, usdl_path, 'balanceOf', self.LIQUIDATOR_SCRIPT_HASH)
+        self.assertEqual(250 * TOKEN_MULT, result)
+
+        # The index follows the liquidation and the repayment
+        liquidation_keeper.apply_events(asyncio.run(poll_events()))
+        self.assertEqual({'bNEO': 475 * TOKEN_MULT}, position.collateral)
+        self.assertEqual(450 * TOKEN_MULT, position.debt)
+        self.assertEqual({}, liquidation_keeper.pending)
+
+
+if __name__ == '__main__':
+    unittest.main()